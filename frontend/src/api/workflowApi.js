@@ -52,6 +52,25 @@ const workflowDefinitionApi = {
     return api.delete(`/workflows/definitions/${definitionId}`);
   },
 
+  /**
+   * 校验并发布工作流定义 (生成编译形式并递增版本)
+   * @param {string} definitionId - 工作流定义的ID
+   * @returns 成功时为更新后的定义；校验失败时返回 400 { errors: [...] }
+   */
+  publishDefinition: (definitionId) => {
+    return api.post(`/workflows/definitions/${definitionId}/publish`);
+  },
+
+  /**
+   * 在内存中模拟运行工作流定义草稿 (不创建实例)
+   * @param {string} definitionId - 工作流定义的ID
+   * @param {object} options - { payloads: [样本负载], instances, outcomes: { 节点ID: { 结果: 权重 } }, job_results, seed }
+   * @returns 节点访问次数、决策分支概率、各指派对象的任务量等
+   */
+  simulateDefinition: (definitionId, options) => {
+    return api.post(`/workflows/definitions/${definitionId}/simulate`, options);
+  },
+
   /**
    * 复制一个工作流定义来创建一个新的
    * @param {string} definitionId - 要复制的源工作流定义的ID
@@ -104,11 +123,28 @@ const workflowInstanceApi = {
   },
 
   /**
-   * 获取指定工作流实例的历史记录
+   * 获取指定工作流实例的历史记录 (游标分页)
+   * @param {string} instanceId - 工作流实例的ID
+   * @param {object} params - 可选，{ cursor, page_size }；响应为 { next, results }，next 中带有下一页的 cursor
+   */
+  getInstanceHistory: (instanceId, params = {}) => {
+    return api.get(`/workflows/instances/${instanceId}/history`, { params });
+  },
+
+  /**
+   * 获取已归档的工作流实例列表 (按开始时间倒序，游标分页)
+   * @param {object} params - 可选，{ cursor, page_size, object_id }；响应为 { next, previous, results }
+   */
+  getArchivedInstances: (params = {}) => {
+    return api.get('/workflows/archived-instances', { params });
+  },
+
+  /**
+   * 获取已归档的工作流实例详情，包含归档时的 instance、tasks 和 history
    * @param {string} instanceId - 工作流实例的ID
    */
-  getInstanceHistory: (instanceId) => {
-    return api.get(`/workflows/instances/${instanceId}/history`);
+  getArchivedInstance: (instanceId) => {
+    return api.get(`/workflows/archived-instances/${instanceId}`);
   },
 
   /**
@@ -0,0 +1,128 @@
+# leave_api/management/commands/bench_pending_approvals.py
+"""
+基准测试：审批人待审批列表一页 (查询 + 序列化) 的延迟和查询数，
+比较原写法 (全部 pending 按 apply_time 排序，逐行取申请人 / 审批人) 与按审批人部门限定 + select_related 的写法。
+
+用法 (会向当前数据库写入大量测试数据，请只在开发/测试库上运行):
+    python manage.py bench_pending_approvals --applications 500000 --departments 200
+默认规模较小，便于快速验证。运行结束后删除生成的数据 (--keep 保留)。
+"""
+import random
+import statistics
+import time
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from leave_api.serializers import LeaveApplicationSerializer
+from leave_api.services import pending_applications
+from myapp.models import Department, EmployeeDepartment, EmployeeProfile, LeaveApplication, Position
+
+BENCH_PREFIX = '__bench_pending__'
+CHUNK_SIZE = 5000
+STATUSES = ('pending', 'approved', 'rejected', 'cancelled')
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def naive_pending():
+    return LeaveApplication.objects.filter(status='pending').order_by('-apply_time')
+
+
+class Command(BaseCommand):
+    help = '比较审批人待审批列表在 500k 级申请量下每页的延迟和查询数'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--applications', type=int, default=50000, help='生成的请假申请数')
+        parser.add_argument('--departments', type=int, default=50, help='生成的部门数')
+        parser.add_argument('--employees', type=int, default=5000, help='生成的员工数')
+        parser.add_argument('--samples', type=int, default=50, help='采样查询的审批人数')
+        parser.add_argument('--page-size', type=int, default=50, help='每页的申请数')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--keep', action='store_true', help='保留生成的数据')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        try:
+            approvers = self._populate(rng, options)
+            self._measure(rng, approvers, options)
+        finally:
+            if not options['keep']:
+                self._cleanup()
+
+    def _populate(self, rng, options):
+        self.stdout.write(f"生成 {options['departments']} 个部门、{options['employees']} 个员工、{options['applications']} 个申请...")
+        begin = time.perf_counter()
+
+        Department.objects.bulk_create([Department(name=f"{BENCH_PREFIX}{i}") for i in range(options['departments'])])
+        departments = list(Department.objects.filter(name__startswith=BENCH_PREFIX).values_list('pk', flat=True))
+        Position.objects.bulk_create([Position(department_id=pk, title=f"{BENCH_PREFIX}manager") for pk in departments])
+        positions = dict(Position.objects.filter(title=f"{BENCH_PREFIX}manager").values_list('department_id', 'pk'))
+
+        # bulk_create 不调用 EmployeeProfile.save()，入职时间需显式给出
+        EmployeeProfile.objects.bulk_create(
+            [EmployeeProfile(name=f"{BENCH_PREFIX}{i}", age=30, current_hire_date=date(2020, 1, 1)) for i in range(options['employees'])],
+            batch_size=CHUNK_SIZE,
+        )
+        employees = list(EmployeeProfile.objects.filter(name__startswith=BENCH_PREFIX).values_list('pk', flat=True))
+
+        # 每个部门一名审批人
+        approvers = rng.sample(employees, len(departments))
+        EmployeeDepartment.objects.bulk_create([
+            EmployeeDepartment(employee_id=approver, department_id=department, position_id=positions[department])
+            for approver, department in zip(approvers, departments)
+        ])
+
+        base = date(2026, 1, 1)
+        batch = []
+        for i in range(options['applications']):
+            start = base + timedelta(days=rng.randrange(365))
+            batch.append(LeaveApplication(
+                employee_id=rng.choice(employees), department_id=rng.choice(departments), leave_type='annual',
+                start_date=start, end_date=start + timedelta(days=1), days=2, reason=BENCH_PREFIX,
+                # 多数申请已处理完毕，待审批的只占一小部分
+                status=rng.choices(STATUSES, weights=(1, 7, 1, 1))[0],
+            ))
+            if len(batch) >= CHUNK_SIZE:
+                LeaveApplication.objects.bulk_create(batch)
+                batch = []
+        LeaveApplication.objects.bulk_create(batch)
+        self.stdout.write(f"  生成数据用时 {time.perf_counter() - begin:.1f} 秒")
+        return approvers
+
+    def _page(self, queryset, page_size):
+        with CaptureQueriesContext(connection) as captured:
+            begin = time.perf_counter()
+            LeaveApplicationSerializer(queryset[:page_size], many=True).data
+            seconds = time.perf_counter() - begin
+        return seconds, len(captured.captured_queries)
+
+    def _measure(self, rng, approvers, options):
+        page_size = options['page_size']
+        sampled = [rng.choice(approvers) for _ in range(options['samples'])]
+        strategies = (
+            ('原写法', lambda approver: naive_pending()),
+            ('部门+select_related', pending_applications),
+        )
+        self.stdout.write(f"\n{'写法':<20} {'p50 (ms)':>10} {'p95 (ms)':>10} {'平均 (ms)':>10} {'查询/页':>8}")
+        for label, build in strategies:
+            timings, queries = [], []
+            for approver in sampled:
+                seconds, count = self._page(build(approver), page_size)
+                timings.append(seconds * 1000)
+                queries.append(count)
+            self.stdout.write(
+                f"{label:<20} {percentile(timings, 0.5):>10.2f} {percentile(timings, 0.95):>10.2f} "
+                f"{statistics.mean(timings):>10.2f} {max(queries):>8}"
+            )
+
+    def _cleanup(self):
+        LeaveApplication.objects.filter(reason=BENCH_PREFIX).delete()
+        EmployeeDepartment.objects.filter(position__title=f"{BENCH_PREFIX}manager").delete()
+        EmployeeProfile.objects.filter(name__startswith=BENCH_PREFIX).delete()
+        Department.objects.filter(name__startswith=BENCH_PREFIX).delete()
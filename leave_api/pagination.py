@@ -0,0 +1,9 @@
+# leave_api/pagination.py
+from rest_framework.pagination import PageNumberPagination
+
+
+class LeaveApplicationPagination(PageNumberPagination):
+    """待审批列表的分页，参数与前端表格一致 (page / pageSize)"""
+    page_size = 10
+    page_size_query_param = 'pageSize'
+    max_page_size = 100
@@ -21,8 +21,7 @@ class LeaveApplicationSerializer(serializers.ModelSerializer):
     id = serializers.IntegerField(source='application_id', read_only=True)
     applicantName = serializers.CharField(source='employee.name', read_only=True)
     
-    # ** DEMO 硬编码部门 **
-    department = serializers.SerializerMethodField(read_only=True)
+    department = serializers.CharField(source='department.name', read_only=True)
     
     leaveType = serializers.CharField(source='get_leave_type_display', read_only=True)
     startDate = serializers.DateField(source='start_date')
@@ -32,19 +31,17 @@ class LeaveApplicationSerializer(serializers.ModelSerializer):
     # status 字段会由前端的 StatusIndicator 使用，所以可以直接传原始值
     # status = serializers.CharField() # Meta 中已包含 status
 
-    def get_department(self, obj):
-        # ** DEMO: 始终返回 "人力资源部" **
-        return "人力资源部"
-
     class Meta:
         model = LeaveApplication
         fields = [
             'id',
             'employee',         # 原始外键，用于调试或未来需要
             'employee_id_val',  # 映射的员工ID
+            'employee_name',
             'applicantName',
-            'department',       # 硬编码的部门
+            'department',       # 部门名称
             'leave_type',       # 原始 choice
+            'leave_type_display',
             'leaveType',        # 可读显示
             'start_date',       # 原始字段
             'startDate',        # 映射给前端
@@ -63,4 +60,10 @@ class LeaveApplicationSerializer(serializers.ModelSerializer):
             'approval_comment',
         ]
         # 对于 demo，我们让一些字段在视图中处理只读逻辑
-        # read_only_fields = ['apply_time', 'approval_time', 'approver']
\ No newline at end of file
+        # read_only_fields = ['apply_time', 'approval_time', 'approver']
+
+
+class BulkApprovalSerializer(serializers.Serializer):
+    """批量审批的请求体"""
+    ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False, max_length=500)
+    comment = serializers.CharField(required=False, allow_blank=True)
@@ -0,0 +1,79 @@
+# leave_api/services.py
+"""
+请假审批的查询和批量审批。
+
+审批人只看到自己所在部门 (EmployeeDepartment) 的待审批申请：
+筛选条件 department IN (...) AND status = 'pending' 按 -apply_time 排序，正好落在
+(department, status, -apply_time) 复合索引上。序列化需要的申请人 / 审批人 / 部门
+通过 select_related 一次取回，每页的查询数与页大小无关。
+
+批量审批 (decide_applications) 在一个事务中用一次 select_for_update 锁定全部申请并 bulk_update，
+批准时一次写入全部扣减流水，余额按 (员工, 年份) 各一条 F() 表达式 UPDATE (见 myapp.leave_ledger)。
+"""
+from django.db import transaction
+from django.utils import timezone
+
+from myapp.leave_ledger import record_deductions
+from myapp.models import EmployeeDepartment, EmployeeProfile, LeaveApplication
+
+
+def approver_department_ids(approver_employee_id):
+    """审批人所在部门的 ID (子查询，不单独求值)"""
+    return EmployeeDepartment.objects.filter(employee_id=approver_employee_id).values('department_id')
+
+
+def pending_applications(approver_employee_id):
+    """审批人所在部门的待审批申请，按申请时间倒序"""
+    return (
+        LeaveApplication.objects
+        .filter(department_id__in=approver_department_ids(approver_employee_id), status='pending')
+        .select_related('employee', 'approver', 'department')
+        .order_by('-apply_time')
+    )
+
+
+@transaction.atomic
+def decide_applications(application_ids, new_status, comment, approver_employee_id):
+    """
+    批量批准 / 拒绝请假申请。
+    返回 (outcomes, decided)：outcomes 按 application_ids 的顺序给出每一项的结果
+    {"id", "success", "status", "error"}；decided 为 {申请ID: 已更新的 LeaveApplication}。
+    只能审批审批人所在部门的申请 (与 pending_applications 的范围一致)；不存在或不在范围内的 ID
+    同样作为该项的错误返回，不区分两者，避免泄露其他部门的申请是否存在。
+    审批人档案不存在时抛出 EmployeeProfile.DoesNotExist。
+    """
+    approver = EmployeeProfile.objects.get(employee_id=approver_employee_id)
+    applications = (
+        LeaveApplication.objects.select_for_update()
+        .filter(department_id__in=approver_department_ids(approver_employee_id))
+        .in_bulk(list(dict.fromkeys(application_ids)))
+    )
+
+    now = timezone.now()
+    outcomes, decided = [], {}
+    for application_id in application_ids:
+        application = applications.get(application_id)
+        if application is None:
+            outcomes.append({'id': application_id, 'success': False, 'status': None, 'error': '请假申请不存在或不在审批范围内'})
+            continue
+        if application.status != 'pending':  # 包括同一批中重复出现的 ID
+            outcomes.append({
+                'id': application_id, 'success': False, 'status': application.status,
+                'error': f"申请状态为 {application.get_status_display()}，无法重复审批",
+            })
+            continue
+        application.status = new_status
+        application.approver = approver
+        application.approval_comment = comment
+        application.approval_time = now
+        decided[application_id] = application
+        outcomes.append({'id': application_id, 'success': True, 'status': new_status, 'error': None})
+
+    if decided:
+        # bulk_update 不经过 LeaveApplication.save()，扣减流水在这里统一记录
+        LeaveApplication.objects.bulk_update(
+            decided.values(), ['status', 'approver', 'approval_comment', 'approval_time'],
+        )
+        if new_status == 'approved':
+            record_deductions(decided.values())
+    return outcomes, decided
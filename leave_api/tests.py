@@ -1,3 +1,176 @@
+from datetime import date, timedelta
+
+from django.contrib.auth import get_user_model
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from myapp.leave_ledger import reconcile, record_entry
+from myapp.models import Department, EmployeeDepartment, EmployeeProfile, Leave, LeaveApplication, Position
+
+from .services import pending_applications
+from .views import (
+    DEMO_APPROVER_EMPLOYEE_ID, ApproveLeaveRequestView, BulkApproveLeaveRequestsView, BulkRejectLeaveRequestsView,
+    PendingApprovalsListView,
+)
+
+
+def make_employee(name):
+    return EmployeeProfile.objects.create(name=name, age=30, current_hire_date=date(2020, 1, 1))
+
+
+def make_application(employee, department, status='pending', offset=0, leave_type='annual'):
+    start = date(2026, 3, 2) + timedelta(days=offset) # 2026-03-02 为周一
+    return LeaveApplication.objects.create(
+        employee=employee, department=department, leave_type=leave_type,
+        start_date=start, end_date=start + timedelta(days=1), reason='休假', status=status,
+    )
+
+
+class LeaveApiTestBase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.department = Department.objects.create(name='人力资源部')
+        cls.other_department = Department.objects.create(name='研发部')
+        # EmployeeProfile.save() 会把指定主键的新对象当作更新，这里用 bulk_create 固定 DEMO 审批人的 ID
+        cls.approver, = EmployeeProfile.objects.bulk_create([EmployeeProfile(
+            employee_id=DEMO_APPROVER_EMPLOYEE_ID, name='审批人', age=40, current_hire_date=date(2020, 1, 1),
+        )])
+        EmployeeDepartment.objects.create(
+            employee=cls.approver, department=cls.department,
+            position=Position.objects.create(department=cls.department, title='经理'),
+        )
+        cls.user = get_user_model().objects.create_user('approver')
+
+    def call(self, view, method, path, data=None, **kwargs):
+        factory = APIRequestFactory()
+        if method == 'get':
+            request = factory.get(path, {'approverId': str(DEMO_APPROVER_EMPLOYEE_ID), **(data or {})})
+        else:
+            request = getattr(factory, method)(f'{path}?actingUserId={DEMO_APPROVER_EMPLOYEE_ID}', data, format='json')
+        request.session = {'user_id': DEMO_APPROVER_EMPLOYEE_ID}
+        force_authenticate(request, self.user)
+        response = view.as_view()(request, **kwargs)
+        response.render()
+        return response
+
+
+class PendingApprovalsTests(LeaveApiTestBase):
+    def list_pending(self, **params):
+        return self.call(PendingApprovalsListView, 'get', '/requests/pending/', params)
+
+    def add_pending(self, count, department=None):
+        for i in range(count):
+            make_application(make_employee(f'员工{i}'), department or self.department, offset=i)
+
+    def test_only_pending_applications_of_approver_departments(self):
+        employee = make_employee('张三')
+        mine = make_application(employee, self.department)
+        make_application(employee, self.department, status='approved')
+        make_application(employee, self.other_department)
+
+        self.assertEqual(list(pending_applications(self.approver.employee_id)), [mine])
+        response = self.list_pending()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['total'], 1)
+        self.assertEqual(response.data['data'][0]['department'], '人力资源部')
+        self.assertEqual(response.data['data'][0]['applicantName'], '张三')
+        self.assertEqual(self.list_pending(department='研发部').data['total'], 0)
+
+    def test_page_query_count_is_independent_of_page_size(self):
+        self.add_pending(3)
+        with CaptureQueriesContext(connection) as small:
+            self.assertEqual(len(self.list_pending(pageSize=3).data['data']), 3)
+        self.add_pending(30)
+        with CaptureQueriesContext(connection) as large:
+            self.assertEqual(len(self.list_pending(pageSize=30).data['data']), 30)
+        # 计数 + 一页数据
+        self.assertEqual(len(large.captured_queries), len(small.captured_queries))
+        self.assertLessEqual(len(large.captured_queries), 2)
+
+    def test_sort_by_start_date(self):
+        self.add_pending(3)
+        rows = self.list_pending(sortField='startDate', sortOrder='descend').data['data']
+        self.assertEqual([row['startDate'] for row in rows], ['2026-03-04', '2026-03-03', '2026-03-02'])
+
+
+class BulkApprovalTests(LeaveApiTestBase):
+    def setUp(self):
+        self.alice = make_employee('Alice')
+        self.bob = make_employee('Bob')
+        record_entry(self.alice.pk, 2026, 'annual', 10, entry_type='accrual')
+        record_entry(self.alice.pk, 2026, 'sick', 5, entry_type='accrual')
+        record_entry(self.bob.pk, 2026, 'annual', 1, entry_type='accrual')
+
+    def bulk(self, view, ids, **data):
+        return self.call(view, 'patch', '/requests/bulk/', {'ids': ids, **data})
+
+    def test_bulk_approve_deducts_balances_per_employee_and_reports_each_item(self):
+        annual = [make_application(self.alice, self.department, offset=i) for i in range(3)]
+        sick = make_application(self.alice, self.department, leave_type='sick')
+        bobs = make_application(self.bob, self.department)
+        done = make_application(self.bob, self.department, status='rejected')
+
+        ids = [a.pk for a in annual] + [sick.pk, bobs.pk, done.pk, 999999]
+        response = self.bulk(BulkApproveLeaveRequestsView, ids, comment='节后统一审批')
+        self.assertEqual(response.status_code, 200)
+        results = response.data['results']
+        self.assertEqual([r['id'] for r in results], ids)
+        self.assertEqual([r['success'] for r in results], [True] * 5 + [False, False])
+        self.assertEqual(results[-1]['error'], '请假申请不存在或不在审批范围内')
+        self.assertEqual(results[-2]['status'], 'rejected')
+
+        alice = Leave.objects.get(employee=self.alice, year=2026)
+        self.assertEqual((alice.annual_leave, alice.sick_leave), (10 - 3 * 2, 5 - 2))
+        self.assertEqual(Leave.objects.get(employee=self.bob).annual_leave, 1 - 2) # 透支记为负数
+        self.assertEqual(reconcile(), [])
+        approved = LeaveApplication.objects.filter(status='approved')
+        self.assertEqual(approved.count(), 5)
+        self.assertEqual(set(approved.values_list('approval_comment', flat=True)), {'节后统一审批'})
+        self.assertEqual(set(approved.values_list('approver_id', flat=True)), {DEMO_APPROVER_EMPLOYEE_ID})
+
+    def test_bulk_query_count_is_independent_of_batch_size(self):
+        def run(count):
+            ids = [make_application(employee, self.department, offset=i).pk for i in range(count) for employee in (self.alice, self.bob)]
+            with CaptureQueriesContext(connection) as captured:
+                self.bulk(BulkApproveLeaveRequestsView, ids)
+            return len(captured.captured_queries)
+        self.assertEqual(run(2), run(20))
+
+    def test_applications_outside_approver_departments_are_refused(self):
+        mine = make_application(self.alice, self.department)
+        foreign = make_application(self.bob, self.other_department)
+        results = self.bulk(BulkApproveLeaveRequestsView, [mine.pk, foreign.pk]).data['results']
+        self.assertEqual([r['success'] for r in results], [True, False])
+        self.assertEqual(results[1], {'id': foreign.pk, 'success': False, 'status': None, 'error': '请假申请不存在或不在审批范围内'})
+        foreign.refresh_from_db()
+        self.assertEqual((foreign.status, foreign.approver_id), ('pending', None))
+        self.assertEqual(Leave.objects.get(employee=self.bob).annual_leave, 1)
+        response = self.call(ApproveLeaveRequestView, 'patch', '/requests/approve/', {}, pk=foreign.pk)
+        self.assertEqual(response.status_code, 404)
+
+    def test_bulk_reject_keeps_balances_and_rejects_duplicates(self):
+        application = make_application(self.alice, self.department)
+        results = self.bulk(BulkRejectLeaveRequestsView, [application.pk, application.pk]).data['results']
+        self.assertEqual([r['success'] for r in results], [True, False])
+        application.refresh_from_db()
+        self.assertEqual((application.status, application.approval_comment), ('rejected', '不同意'))
+        self.assertEqual(Leave.objects.get(employee=self.alice).annual_leave, 10)
+
+    def test_invalid_payload_and_permission(self):
+        self.assertEqual(self.bulk(BulkApproveLeaveRequestsView, []).status_code, 400)
+        request = APIRequestFactory().patch('/requests/bulk/', {'ids': [1]}, format='json')
+        request.session = {'user_id': DEMO_APPROVER_EMPLOYEE_ID}
+        force_authenticate(request, self.user)
+        self.assertEqual(BulkApproveLeaveRequestsView.as_view()(request).status_code, 403)
 
-# Create your tests here.
+    def test_single_approval_shares_the_bulk_path(self):
+        application = make_application(self.alice, self.department)
+        response = self.call(ApproveLeaveRequestView, 'patch', '/requests/approve/', {}, pk=application.pk)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['data']['status'], 'approved')
+        self.assertEqual(Leave.objects.get(employee=self.alice).annual_leave, 8)
+        again = self.call(ApproveLeaveRequestView, 'patch', '/requests/approve/', {}, pk=application.pk)
+        self.assertEqual(again.status_code, 400)
+        self.assertEqual(self.call(ApproveLeaveRequestView, 'patch', '/requests/approve/', {}, pk=999999).status_code, 404)
@@ -6,4 +6,6 @@ urlpatterns = [
     path('requests/pending/', views.PendingApprovalsListView.as_view(), name='pending-leave-requests'),
     path('requests/<int:pk>/approve/', views.ApproveLeaveRequestView.as_view(), name='approve-leave-request'),
     path('requests/<int:pk>/reject/', views.RejectLeaveRequestView.as_view(), name='reject-leave-request'),
+    path('requests/bulk/approve/', views.BulkApproveLeaveRequestsView.as_view(), name='bulk-approve-leave-requests'),
+    path('requests/bulk/reject/', views.BulkRejectLeaveRequestsView.as_view(), name='bulk-reject-leave-requests'),
 ]
\ No newline at end of file
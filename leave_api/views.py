@@ -1,12 +1,13 @@
 # leave_api/views.py
-from django.utils import timezone
 from rest_framework import generics, status
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 
 from myapp.models import LeaveApplication, EmployeeProfile # 从 myapp.models 导入
-from .serializers import LeaveApplicationSerializer
+from .pagination import LeaveApplicationPagination
+from .serializers import BulkApprovalSerializer, LeaveApplicationSerializer
+from .services import decide_applications, pending_applications
 
 # Demo 常量
 DEMO_APPROVER_EMPLOYEE_ID = 1
@@ -14,6 +15,7 @@ DEMO_APPROVER_EMPLOYEE_ID = 1
 class PendingApprovalsListView(generics.ListAPIView):
     serializer_class = LeaveApplicationSerializer
     permission_classes = [IsAuthenticated] # 确保用户已登录
+    pagination_class = LeaveApplicationPagination
 
     def get_queryset(self):
         # ** DEMO 逻辑 **
@@ -33,17 +35,15 @@ class PendingApprovalsListView(generics.ListAPIView):
             return LeaveApplication.objects.none() # 不返回任何数据
 
         print(f"DEMO: Fetching pending approvals for hardcoded approver ID: {DEMO_APPROVER_EMPLOYEE_ID}")
-        # 返回所有状态为 'pending' 的申请
+        # 审批人所在部门的待审批申请 (走 (department, status, apply_time) 索引，申请人 / 审批人 / 部门一并取回)
         # 在真实场景中，这里会通过 WorkflowTask 查询
-        queryset = LeaveApplication.objects.filter(status='pending').order_by('-apply_time')
-        
+        queryset = pending_applications(DEMO_APPROVER_EMPLOYEE_ID)
+
         # --- 前端筛选和排序的简单实现 (基于模型字段) ---
-        # 部门筛选 (由于部门是硬编码的，这里的筛选可能效果不大，除非前端传的就是"人力资源部")
+        # 部门筛选 (按部门名称，只能在审批人所在部门范围内)
         department_filter = self.request.query_params.get('department')
-        if department_filter and department_filter == "人力资源部":
-            pass # 所有都是人力资源部，所以不需要额外过滤
-        elif department_filter: # 如果传了其他部门，则返回空
-            return LeaveApplication.objects.none()
+        if department_filter:
+            queryset = queryset.filter(department__name=department_filter)
 
         # 申请人姓名筛选
         applicant_name_filter = self.request.query_params.get('applicantName')
@@ -115,46 +115,59 @@ class PendingApprovalsListView(generics.ListAPIView):
 class BaseApprovalActionView(APIView):
     permission_classes = [IsAuthenticated]
 
-    def update_leave_application_status(self, pk, new_status, comment, approver_employee_id):
+    def is_demo_approver(self):
         session_user_id = self.request.session.get('user_id')
         acting_user_id_from_query = self.request.query_params.get('actingUserId')
+        return bool(session_user_id) and \
+            bool(acting_user_id_from_query) and \
+            str(session_user_id) == acting_user_id_from_query and \
+            int(session_user_id) == DEMO_APPROVER_EMPLOYEE_ID
 
+    def update_leave_application_status(self, pk, new_status, comment, approver_employee_id):
         # 权限校验
-        if not session_user_id or \
-           not acting_user_id_from_query or \
-           str(session_user_id) != acting_user_id_from_query or \
-           int(session_user_id) != DEMO_APPROVER_EMPLOYEE_ID:
+        if not self.is_demo_approver():
             return Response({"error": "无权限操作或用户不匹配"}, status=status.HTTP_403_FORBIDDEN)
 
         try:
-            leave_application = LeaveApplication.objects.get(application_id=pk)
-        except LeaveApplication.DoesNotExist:
-            return Response({"error": "请假申请不存在"}, status=status.HTTP_404_NOT_FOUND)
-
-        if leave_application.status != 'pending':
-            return Response({"error": f"申请状态为 {leave_application.get_status_display()}，无法重复审批"}, status=status.HTTP_400_BAD_REQUEST)
-
-        try:
-            approver_profile = EmployeeProfile.objects.get(employee_id=approver_employee_id)
+            (outcome,), decided = decide_applications([pk], new_status, comment, approver_employee_id)
         except EmployeeProfile.DoesNotExist:
             # 理论上 approver_employee_id (DEMO_APPROVER_EMPLOYEE_ID) 应该是存在的
             return Response({"error": "审批人档案不存在"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-        leave_application.status = new_status
-        leave_application.approver = approver_profile
-        leave_application.approval_comment = comment
-        leave_application.approval_time = timezone.now() # 使用 django.utils.timezone
-        leave_application.save()
-        
+        if not outcome['success']:
+            error_status = status.HTTP_404_NOT_FOUND if outcome['status'] is None else status.HTTP_400_BAD_REQUEST
+            return Response({"error": outcome['error']}, status=error_status)
+
         # ** DEMO: 这里我们不调用工作流引擎 **
         # workflow_engine.complete_task(task_id, approver_employee_id, outcome, completion_data)
 
+        leave_application = decided[pk]
         serializer = LeaveApplicationSerializer(leave_application)
         return Response({
             "message": f"申请已{leave_application.get_status_display()}", 
             "data": serializer.data
         }, status=status.HTTP_200_OK)
 
+    def bulk_update_leave_application_status(self, new_status, default_comment, approver_employee_id):
+        if not self.is_demo_approver():
+            return Response({"error": "无权限操作或用户不匹配"}, status=status.HTTP_403_FORBIDDEN)
+
+        serializer = BulkApprovalSerializer(data=self.request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            outcomes, decided = decide_applications(
+                serializer.validated_data['ids'], new_status,
+                serializer.validated_data.get('comment', default_comment), approver_employee_id,
+            )
+        except EmployeeProfile.DoesNotExist:
+            return Response({"error": "审批人档案不存在"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        status_display = dict(LeaveApplication.STATUS_CHOICES)[new_status]
+        return Response({
+            "message": f"{len(decided)} 个申请已{status_display}，{len(outcomes) - len(decided)} 个失败",
+            "results": outcomes,
+        }, status=status.HTTP_200_OK)
+
 
 class ApproveLeaveRequestView(BaseApprovalActionView):
     def patch(self, request, pk, *args, **kwargs):
@@ -165,4 +178,16 @@ class ApproveLeaveRequestView(BaseApprovalActionView):
 class RejectLeaveRequestView(BaseApprovalActionView):
     def patch(self, request, pk, *args, **kwargs):
         comment = request.data.get('comment', '不同意')
-        return self.update_leave_application_status(pk, 'rejected', comment, DEMO_APPROVER_EMPLOYEE_ID)
\ No newline at end of file
+        return self.update_leave_application_status(pk, 'rejected', comment, DEMO_APPROVER_EMPLOYEE_ID)
+
+
+class BulkApproveLeaveRequestsView(BaseApprovalActionView):
+    """批量批准：{"ids": [...], "comment": "..."}，返回每个申请的处理结果"""
+    def patch(self, request, *args, **kwargs):
+        return self.bulk_update_leave_application_status('approved', '同意', DEMO_APPROVER_EMPLOYEE_ID)
+
+
+class BulkRejectLeaveRequestsView(BaseApprovalActionView):
+    """批量拒绝：{"ids": [...], "comment": "..."}，返回每个申请的处理结果"""
+    def patch(self, request, *args, **kwargs):
+        return self.bulk_update_leave_application_status('rejected', '不同意', DEMO_APPROVER_EMPLOYEE_ID)
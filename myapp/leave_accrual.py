@@ -0,0 +1,145 @@
+# myapp/leave_accrual.py
+"""
+年度假期发放 (年度结转)。
+
+为全部在职员工生成新一年的假期余额：
+  * 年假按截至当年 1 月 1 日的工龄 (current_hire_date 起算的整年数) 查 ANNUAL_TIERS 发放；
+  * 上一年未休的年假最多结转 CARRY_OVER_MAX 天，透支 (负余额) 全额结转到新一年抵扣；
+  * 其他假期按 YEARLY_GRANTS 每年发放。
+每一笔都记入假期流水 (发放 / 调整)，余额与流水合计保持一致。
+
+按员工 ID 键集分块，每块一个事务：锁定本块员工行后读取已发放标记、上一年和当年的余额行 (各一次查询)，
+bulk_create 新余额行和流水，bulk_update 已有的余额行。
+每位员工的年假发放流水 (备注 ROLLOVER_COMMENT) 即已处理标记，重复运行或中断后重跑只处理尚未发放的员工。
+"""
+from datetime import date
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import EmployeeProfile, Leave, LeaveLedgerEntry
+
+# 可在 settings.LEAVE_ACCRUAL 中覆盖
+DEFAULT_LEAVE_ACCRUAL_SETTINGS = {
+    'ANNUAL_TIERS': ((20, 15), (10, 10), (1, 5)),  # (工龄满多少年, 年假天数)，从高到低
+    'NEW_HIRE_ANNUAL_DAYS': 0,                     # 工龄不满一年的年假天数
+    'CARRY_OVER_MAX': 5,                           # 上年未休年假最多结转的天数
+    'YEARLY_GRANTS': {},                           # 其他假期每年发放的天数，如 {'sick': 5, 'personal': 3}
+    'CHUNK_SIZE': 1000,                            # 每个事务处理的员工数
+}
+
+ROLLOVER_COMMENT = '年度发放'
+
+
+def get_leave_accrual_settings():
+    return {**DEFAULT_LEAVE_ACCRUAL_SETTINGS, **getattr(settings, 'LEAVE_ACCRUAL', {})}
+
+
+def service_years(hire_date, as_of):
+    """截至 as_of 的整年工龄"""
+    years = as_of.year - hire_date.year - ((as_of.month, as_of.day) < (hire_date.month, hire_date.day))
+    return max(years, 0)
+
+
+def annual_entitlement(hire_date, year, accrual_settings):
+    years = service_years(hire_date, date(year, 1, 1))
+    for min_years, days in accrual_settings['ANNUAL_TIERS']:
+        if years >= min_years:
+            return days
+    return accrual_settings['NEW_HIRE_ANNUAL_DAYS']
+
+
+def _carry_over(previous_annual, cap):
+    if previous_annual < 0:
+        return previous_annual
+    return min(previous_annual, cap)
+
+
+@transaction.atomic
+def roll_over_chunk(employees, year, accrual_settings):
+    """
+    为一批员工 [(employee_id, current_hire_date), ...] 发放 year 年的假期，跳过已发放的员工。
+    返回本块实际处理的员工数。
+    """
+    employee_ids = [employee_id for employee_id, _hire_date in employees]
+    # 先锁定本块员工行再读已发放标记：两次运行重叠时 (定时任务与手动重跑)，后到的一方
+    # 等前一方提交后才读标记，看到已发放而跳过，不会重复发放
+    list(EmployeeProfile.objects.select_for_update().filter(employee_id__in=employee_ids).order_by('employee_id').values_list('employee_id', flat=True))
+    done = set(
+        LeaveLedgerEntry.objects.filter(
+            employee_id__in=employee_ids, year=year, leave_type='annual', entry_type='accrual', comment=ROLLOVER_COMMENT,
+        ).values_list('employee_id', flat=True)
+    )
+    todo = [(employee_id, hire_date) for employee_id, hire_date in employees if employee_id not in done]
+    if not todo:
+        return 0
+    todo_ids = [employee_id for employee_id, _hire_date in todo]
+    previous = {row.employee_id: row for row in Leave.objects.select_for_update().filter(employee_id__in=todo_ids, year=year - 1)}
+    current = {row.employee_id: row for row in Leave.objects.select_for_update().filter(employee_id__in=todo_ids, year=year)}
+
+    entries, new_rows, changed_rows = [], [], []
+    for employee_id, hire_date in todo:
+        annual = annual_entitlement(hire_date, year, accrual_settings)
+        # 年假发放流水即使为 0 天也写入，作为已处理标记
+        entries.append(LeaveLedgerEntry(
+            employee_id=employee_id, year=year, leave_type='annual', entry_type='accrual', days=annual, comment=ROLLOVER_COMMENT,
+        ))
+        deltas = {'annual': annual}
+        for leave_type, days in accrual_settings['YEARLY_GRANTS'].items():
+            if days:
+                entries.append(LeaveLedgerEntry(
+                    employee_id=employee_id, year=year, leave_type=leave_type, entry_type='accrual', days=days, comment=ROLLOVER_COMMENT,
+                ))
+                deltas[leave_type] = deltas.get(leave_type, 0) + days
+
+        previous_row = previous.get(employee_id)
+        carry = _carry_over(previous_row.annual_leave, accrual_settings['CARRY_OVER_MAX']) if previous_row else 0
+        if carry:
+            entries.append(LeaveLedgerEntry(
+                employee_id=employee_id, year=year - 1, leave_type='annual', entry_type='adjustment', days=-carry,
+                comment=f'结转至 {year} 年',
+            ))
+            entries.append(LeaveLedgerEntry(
+                employee_id=employee_id, year=year, leave_type='annual', entry_type='adjustment', days=carry,
+                comment=f'自 {year - 1} 年结转',
+            ))
+            previous_row.annual_leave -= carry
+            changed_rows.append(previous_row)
+            deltas['annual'] += carry
+
+        row = current.get(employee_id)
+        if row is None:
+            new_rows.append(Leave(employee_id=employee_id, year=year, **{Leave.BALANCE_FIELDS[t]: days for t, days in deltas.items()}))
+        else:
+            # 年度发放前已有当年的余额行 (例如提前批准了当年的请假)，在其基础上累加
+            for leave_type, days in deltas.items():
+                field = Leave.BALANCE_FIELDS[leave_type]
+                setattr(row, field, getattr(row, field) + days)
+            changed_rows.append(row)
+
+    Leave.objects.bulk_create(new_rows)
+    if changed_rows:
+        Leave.objects.bulk_update(changed_rows, list(Leave.BALANCE_FIELDS.values()))
+    LeaveLedgerEntry.objects.bulk_create(entries)
+    return len(todo)
+
+
+def employee_chunks(chunk_size):
+    """在职员工按 ID 键集分块：[(employee_id, current_hire_date), ...]"""
+    last_id = 0
+    while True:
+        chunk = list(
+            EmployeeProfile.objects.filter(is_employed=True, employee_id__gt=last_id)
+            .order_by('employee_id').values_list('employee_id', 'current_hire_date')[:chunk_size]
+        )
+        if not chunk:
+            return
+        yield chunk
+        last_id = chunk[-1][0]
+
+
+def roll_over(year, chunk_size=None):
+    """逐块为在职员工发放 year 年的假期，每块产出 (本块员工数, 本块新处理的员工数)"""
+    accrual_settings = get_leave_accrual_settings()
+    for chunk in employee_chunks(chunk_size or accrual_settings['CHUNK_SIZE']):
+        yield len(chunk), roll_over_chunk(chunk, year, accrual_settings)
@@ -0,0 +1,120 @@
+# myapp/leave_ledger.py
+"""
+假期流水与余额。
+
+LeaveLedgerEntry 是只追加的流水 (发放为正、扣减为负、调整可正可负)，
+Leave 的各类余额字段是流水按 (员工, 年份, 假期类型) 的合计，读余额仍然只读一行。
+
+写入流水时余额用 F() 表达式在数据库中原子加减 (UPDATE ... SET annual_leave = annual_leave + x)，
+不在 Python 中读-改-写，并发审批不会丢失更新。每个 (员工, 年份) 一条 UPDATE，
+流水和余额在同一事务中写入。
+
+余额不再截断为 0：扣减超过余额时余额为负 (透支)，流水合计与余额始终一致，
+对账 (reconcile) 是一次按 (员工, 年份, 假期类型) 分组的 SUM。
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import F, Sum
+
+from .models import Leave, LeaveLedgerEntry
+
+
+def _apply_to_balances(entries):
+    """把流水的天数按 (员工, 年份) 汇总后用 F() 原子加到余额行，余额行不存在时先创建"""
+    deltas = defaultdict(lambda: defaultdict(float))
+    for entry in entries:
+        deltas[(entry.employee_id, entry.year)][Leave.BALANCE_FIELDS[entry.leave_type]] += entry.days
+
+    for (employee_id, year), fields in deltas.items():
+        changes = {field: F(field) + days for field, days in fields.items()}
+        if not Leave.objects.filter(employee_id=employee_id, year=year).update(**changes):
+            Leave.objects.get_or_create(employee_id=employee_id, year=year)
+            Leave.objects.filter(employee_id=employee_id, year=year).update(**changes)
+
+
+@transaction.atomic
+def post_entries(entries):
+    """写入一批流水 (未保存的 LeaveLedgerEntry) 并更新余额，天数为 0 的流水忽略"""
+    entries = [entry for entry in entries if entry.days]
+    if entries:
+        LeaveLedgerEntry.objects.bulk_create(entries)
+        _apply_to_balances(entries)
+    return entries
+
+
+def record_deductions(applications):
+    """为已批准的请假申请记扣减流水 (不计余额的假期类型跳过)"""
+    return post_entries([
+        LeaveLedgerEntry(
+            employee_id=application.employee_id,
+            year=application.start_date.year,
+            leave_type=application.leave_type,
+            entry_type='deduction',
+            days=-application.days,
+            application=application,
+        )
+        for application in applications
+        if application.leave_type in Leave.BALANCE_FIELDS
+    ])
+
+
+def record_entry(employee_id, year, leave_type, days, entry_type='adjustment', comment=''):
+    """记一笔发放或调整"""
+    return post_entries([LeaveLedgerEntry(
+        employee_id=employee_id, year=year, leave_type=leave_type,
+        entry_type=entry_type, days=days, comment=comment,
+    )])
+
+
+def ledger_totals(year=None, employee_ids=None):
+    """流水按 (员工, 年份, 假期类型) 的合计：{(employee_id, year, leave_type): days}"""
+    entries = LeaveLedgerEntry.objects.all()
+    if year is not None:
+        entries = entries.filter(year=year)
+    if employee_ids is not None:
+        entries = entries.filter(employee_id__in=employee_ids)
+    rows = entries.values('employee_id', 'year', 'leave_type').annotate(total=Sum('days')).order_by()
+    return {(row['employee_id'], row['year'], row['leave_type']): row['total'] for row in rows}
+
+
+def reconcile(year=None, employee_ids=None, tolerance=1e-6):
+    """
+    比较余额行与流水合计，返回不一致的项
+    [{"employee_id", "year", "leave_type", "balance", "ledger"}]；缺少余额行时 balance 为 None。
+    """
+    totals = ledger_totals(year, employee_ids)
+    balances = Leave.objects.all()
+    if year is not None:
+        balances = balances.filter(year=year)
+    if employee_ids is not None:
+        balances = balances.filter(employee_id__in=employee_ids)
+
+    mismatches = []
+    seen = set()
+    for balance in balances.values('employee_id', 'year', *Leave.BALANCE_FIELDS.values()):
+        seen.add((balance['employee_id'], balance['year']))
+        for leave_type, field in Leave.BALANCE_FIELDS.items():
+            ledger = totals.get((balance['employee_id'], balance['year'], leave_type), 0)
+            if abs(balance[field] - ledger) > tolerance:
+                mismatches.append({
+                    'employee_id': balance['employee_id'], 'year': balance['year'], 'leave_type': leave_type,
+                    'balance': balance[field], 'ledger': ledger,
+                })
+    for (employee_id, entry_year, leave_type), ledger in totals.items():
+        if (employee_id, entry_year) not in seen and abs(ledger) > tolerance:
+            mismatches.append({
+                'employee_id': employee_id, 'year': entry_year, 'leave_type': leave_type,
+                'balance': None, 'ledger': ledger,
+            })
+    return mismatches
+
+
+@transaction.atomic
+def rebuild_balances(mismatches):
+    """按流水合计重写不一致的余额 (reconcile 的结果)；流水是唯一的事实来源"""
+    for mismatch in mismatches:
+        Leave.objects.get_or_create(employee_id=mismatch['employee_id'], year=mismatch['year'])
+        Leave.objects.filter(employee_id=mismatch['employee_id'], year=mismatch['year']).update(
+            **{Leave.BALANCE_FIELDS[mismatch['leave_type']]: mismatch['ledger']}
+        )
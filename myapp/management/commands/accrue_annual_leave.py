@@ -0,0 +1,46 @@
+# myapp/management/commands/accrue_annual_leave.py
+"""
+年度假期发放：为全部在职员工生成新一年的假期余额 (年假按工龄发放，上年未休年假按规则结转)。
+
+用法:
+    python manage.py accrue_annual_leave                 # 当前年份
+    python manage.py accrue_annual_leave --year 2027
+    python manage.py accrue_annual_leave --year 2027 --dry-run   # 只统计尚未发放的员工数
+规则见 settings.LEAVE_ACCRUAL。可以重复运行：已发放的员工会被跳过，中断后重跑从未完成的员工继续。
+"""
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from myapp.leave_accrual import ROLLOVER_COMMENT, get_leave_accrual_settings, roll_over
+from myapp.models import EmployeeProfile, LeaveLedgerEntry
+
+
+class Command(BaseCommand):
+    help = '为在职员工发放新一年的假期并结转上年年假'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--year', type=int, help='发放的年份 (默认当前年份)')
+        parser.add_argument('--chunk-size', type=int, default=get_leave_accrual_settings()['CHUNK_SIZE'], help='每个事务处理的员工数')
+        parser.add_argument('--dry-run', action='store_true', help='只统计，不发放')
+
+    def handle(self, *args, **options):
+        year = options['year'] or timezone.now().year
+        if options['dry_run']:
+            done = LeaveLedgerEntry.objects.filter(
+                year=year, leave_type='annual', entry_type='accrual', comment=ROLLOVER_COMMENT, employee__is_employed=True,
+            ).values('employee_id').distinct().count()
+            employed = EmployeeProfile.objects.filter(is_employed=True).count()
+            self.stdout.write(f"{year} 年：在职员工 {employed} 人，已发放 {done} 人，待发放 {employed - done} 人")
+            return
+
+        scanned = processed = 0
+        begin = time.perf_counter()
+        for chunk_size, chunk_processed in roll_over(year, options['chunk_size']):
+            scanned += chunk_size
+            processed += chunk_processed
+            self.stdout.write(f"已检查 {scanned} 人，发放 {processed} 人")
+        self.stdout.write(self.style.SUCCESS(
+            f"完成：{year} 年为 {processed} 人发放假期 (跳过已发放 {scanned - processed} 人)，用时 {time.perf_counter() - begin:.1f} 秒"
+        ))
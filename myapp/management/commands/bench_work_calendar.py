@@ -0,0 +1,61 @@
+# myapp/management/commands/bench_work_calendar.py
+"""
+基准测试：为大量员工计算一年内各自在职区间的工作日数，
+比较逐日循环判断与工作日历前缀和 (每个区间两次数组下标相减) 的耗时。
+
+用法:
+    python manage.py bench_work_calendar --employees 10000 --year 2026
+不读写数据库。
+"""
+import random
+import time
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from myapp.workcalendar import get_work_calendar
+
+
+class Command(BaseCommand):
+    help = '比较逐日循环与前缀和计算工作日数的耗时'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--employees', type=int, default=10000, help='员工 (区间) 数')
+        parser.add_argument('--year', type=int, default=date.today().year)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        first, last = date(options['year'], 1, 1), date(options['year'], 12, 31)
+        length = (last - first).days
+        # 年中入职 / 离职的员工只统计在职区间
+        ranges = []
+        for _ in range(options['employees']):
+            start = first + timedelta(days=rng.choice((0, rng.randrange(length))))
+            end = last - timedelta(days=rng.choice((0, rng.randrange((last - start).days + 1))))
+            ranges.append((start, end))
+
+        work_calendar = get_work_calendar()
+        begin = time.perf_counter()
+        work_calendar.year(options['year'])
+        build_ms = (time.perf_counter() - begin) * 1000
+
+        begin = time.perf_counter()
+        naive = []
+        for start, end in ranges:
+            count, day = 0, start
+            while day <= end:
+                count += work_calendar.is_workday(day)
+                day += timedelta(days=1)
+            naive.append(count)
+        naive_ms = (time.perf_counter() - begin) * 1000
+
+        begin = time.perf_counter()
+        counts = work_calendar.count_workdays_many(ranges)
+        prefix_ms = (time.perf_counter() - begin) * 1000
+
+        if counts != naive:
+            raise CommandError('前缀和结果与逐日循环不一致')
+        self.stdout.write(f"{options['employees']} 个区间，{options['year']} 年位图构建 {build_ms:.2f} ms")
+        self.stdout.write(f"{'逐日循环':<10} {naive_ms:>10.1f} ms")
+        self.stdout.write(f"{'前缀和':<10} {prefix_ms:>10.1f} ms")
@@ -0,0 +1,40 @@
+# myapp/management/commands/reconcile_leave_balances.py
+"""
+核对假期余额 (Leave) 与假期流水 (LeaveLedgerEntry) 的合计。
+
+用法:
+    python manage.py reconcile_leave_balances               # 核对全部年份
+    python manage.py reconcile_leave_balances --year 2026 --fix   # 按流水重写不一致的余额
+对账只做一次按 (员工, 年份, 假期类型) 分组的 SUM 和一次余额表扫描。
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from myapp.leave_ledger import rebuild_balances, reconcile
+
+
+class Command(BaseCommand):
+    help = '核对假期余额与假期流水，可按流水修复余额'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--year', type=int, help='只核对该年份')
+        parser.add_argument('--fix', action='store_true', help='按流水合计重写不一致的余额')
+
+    def handle(self, *args, **options):
+        begin = time.perf_counter()
+        mismatches = reconcile(year=options['year'])
+        seconds = time.perf_counter() - begin
+        for mismatch in mismatches:
+            balance = '无余额行' if mismatch['balance'] is None else f"{mismatch['balance']:g}"
+            self.stdout.write(
+                f"员工 {mismatch['employee_id']} {mismatch['year']} 年 {mismatch['leave_type']}：余额 {balance}，流水合计 {mismatch['ledger']:g}"
+            )
+        if not mismatches:
+            self.stdout.write(self.style.SUCCESS(f"余额与流水一致 (用时 {seconds:.2f} 秒)"))
+            return
+        if options['fix']:
+            rebuild_balances(mismatches)
+            self.stdout.write(self.style.SUCCESS(f"已按流水修复 {len(mismatches)} 项余额"))
+        else:
+            self.stdout.write(self.style.WARNING(f"{len(mismatches)} 项不一致，使用 --fix 按流水修复 (用时 {seconds:.2f} 秒)"))
@@ -0,0 +1,21 @@
+# Generated by Django 5.1.7 on 2026-10-18 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0009_leave_leaveapplication'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='leaveapplication',
+            index=models.Index(fields=['department', 'status', '-apply_time'], name='leave_app_dept_pending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='leaveapplication',
+            index=models.Index(fields=['status', 'start_date'], name='leave_app_status_start_idx'),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.1.7 on 2026-10-18 05:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+BALANCE_FIELDS = {
+    'annual': 'annual_leave',
+    'sick': 'sick_leave',
+    'personal': 'personal_leave',
+    'marriage': 'marriage_leave',
+    'maternity': 'maternity_leave',
+    'paternity': 'paternity_leave',
+    'bereavement': 'bereavement_leave',
+}
+
+
+def create_opening_entries(apps, schema_editor):
+    """为已有的余额各记一笔期初调整，使流水合计与余额一致"""
+    Leave = apps.get_model('myapp', 'Leave')
+    LeaveLedgerEntry = apps.get_model('myapp', 'LeaveLedgerEntry')
+    entries = [
+        LeaveLedgerEntry(
+            employee_id=balance.employee_id, year=balance.year, leave_type=leave_type,
+            entry_type='adjustment', days=getattr(balance, field), comment='期初余额',
+        )
+        for balance in Leave.objects.all()
+        for leave_type, field in BALANCE_FIELDS.items()
+        if getattr(balance, field)
+    ]
+    LeaveLedgerEntry.objects.bulk_create(entries, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0010_leaveapplication_pending_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeaveLedgerEntry',
+            fields=[
+                ('entry_id', models.AutoField(primary_key=True, serialize=False, verbose_name='流水ID')),
+                ('year', models.IntegerField(verbose_name='年份')),
+                ('leave_type', models.CharField(choices=[('annual', '年假'), ('sick', '病假'), ('personal', '事假'), ('marriage', '婚假'), ('maternity', '产假'), ('paternity', '陪产假'), ('bereavement', '丧假')], max_length=20, verbose_name='假期类型')),
+                ('entry_type', models.CharField(choices=[('accrual', '发放'), ('deduction', '扣减'), ('adjustment', '调整')], max_length=20, verbose_name='流水类型')),
+                ('days', models.FloatField(verbose_name='天数 (扣减为负)')),
+                ('comment', models.CharField(blank=True, max_length=200, verbose_name='备注')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='记录时间')),
+                ('application', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ledger_entries', to='myapp.leaveapplication', verbose_name='关联申请')),
+                ('employee', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='leave_ledger', to='myapp.employeeprofile', verbose_name='关联员工')),
+            ],
+            options={
+                'verbose_name': '假期流水',
+                'verbose_name_plural': '假期流水',
+                'indexes': [models.Index(fields=['employee', 'year', 'leave_type'], name='leave_ledger_balance_idx')],
+            },
+        ),
+        migrations.RunPython(create_opening_entries, migrations.RunPython.noop),
+    ]
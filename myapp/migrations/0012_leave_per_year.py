@@ -0,0 +1,25 @@
+# Generated by Django 5.1.7 on 2026-10-18 05:15
+
+import django.db.models.deletion
+import myapp.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0011_leave_ledger'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='leave',
+            name='employee',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='leave_balances', to='myapp.employeeprofile', verbose_name='关联员工'),
+        ),
+        migrations.AlterField(
+            model_name='leave',
+            name='year',
+            field=models.IntegerField(default=myapp.models.current_year, verbose_name='年份'),
+        ),
+    ]
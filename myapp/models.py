@@ -6,6 +6,8 @@ from django.core.exceptions import ValidationError
 from django.db import transaction
 import json
 
+from .workcalendar import leave_days
+
 def HundredPercentValidator(value):
     """自定义验证器，确保任务完成率不超过100%"""
     if value > 100:
@@ -404,13 +406,18 @@ class TaskAssignment(models.Model):
         verbose_name="任务分配"
         verbose_name_plural="任务分配"
 
+def current_year():
+    """Leave.year 的默认值 (每次创建时取当前年份，而不是导入模块时的年份)"""
+    return timezone.now().year
+
+
 class Leave(models.Model):
     """剩余假期天数表
-    记录员工各类假期的剩余天数"""
-    employee = models.OneToOneField(
+    记录员工各类假期的剩余天数，每人每年一行"""
+    employee = models.ForeignKey(
         EmployeeProfile,
         on_delete=models.CASCADE,
-        related_name='leave_balance',
+        related_name='leave_balances',
         verbose_name="关联员工"
     )
     annual_leave = models.FloatField(default=0, verbose_name="年假剩余天数")
@@ -420,7 +427,19 @@ class Leave(models.Model):
     maternity_leave = models.FloatField(default=0, verbose_name="产假剩余天数")
     paternity_leave = models.FloatField(default=0, verbose_name="陪产假剩余天数")
     bereavement_leave = models.FloatField(default=0, verbose_name="丧假剩余天数")
-    year = models.IntegerField(default=timezone.now().year, verbose_name="年份")
+    year = models.IntegerField(default=current_year, verbose_name="年份")
+
+    # 假期类型 -> 余额字段 (其他类型不计余额)
+    # 余额由 LeaveLedgerEntry 流水物化而来，只应通过 myapp.leave_ledger 修改
+    BALANCE_FIELDS = {
+        'annual': 'annual_leave',
+        'sick': 'sick_leave',
+        'personal': 'personal_leave',
+        'marriage': 'marriage_leave',
+        'maternity': 'maternity_leave',
+        'paternity': 'paternity_leave',
+        'bereavement': 'bereavement_leave',
+    }
     
     def __str__(self):
         return f"{self.employee.name}的假期余额({self.year}年)"
@@ -501,39 +520,19 @@ class LeaveApplication(models.Model):
     def save(self, *args, **kwargs):
         """重写save方法，自动计算请假天数"""
         if not self.days:
-            # 计算请假天数（包括开始日期和结束日期）
-            delta = self.end_date - self.start_date
-            self.days = delta.days + 1
+            # 计算请假天数（包括开始日期和结束日期；除产假外不含周末和法定节假日）
+            self.days = leave_days(self.leave_type, self.start_date, self.end_date)
         
-        # 如果状态变更为已批准，自动设置审批时间
-        if self.status == 'approved' and not self.approval_time:
+        # 如果状态变更为已批准，自动设置审批时间，并在流水中记一笔扣减
+        deduct = self.status == 'approved' and not self.approval_time
+        if deduct:
             self.approval_time = timezone.now()
-            
-            # 更新员工的假期余额
-            try:
-                leave_balance = Leave.objects.get(employee=self.employee, year=self.start_date.year)
-                
-                # 根据假期类型减少相应的余额
-                if self.leave_type == 'annual':
-                    leave_balance.annual_leave = max(0, leave_balance.annual_leave - self.days)
-                elif self.leave_type == 'sick':
-                    leave_balance.sick_leave = max(0, leave_balance.sick_leave - self.days)
-                elif self.leave_type == 'personal':
-                    leave_balance.personal_leave = max(0, leave_balance.personal_leave - self.days)
-                elif self.leave_type == 'marriage':
-                    leave_balance.marriage_leave = max(0, leave_balance.marriage_leave - self.days)
-                elif self.leave_type == 'maternity':
-                    leave_balance.maternity_leave = max(0, leave_balance.maternity_leave - self.days)
-                elif self.leave_type == 'paternity':
-                    leave_balance.paternity_leave = max(0, leave_balance.paternity_leave - self.days)
-                elif self.leave_type == 'bereavement':
-                    leave_balance.bereavement_leave = max(0, leave_balance.bereavement_leave - self.days)
-                
-                leave_balance.save()
-            except Leave.DoesNotExist:
-                pass
-        
-        super().save(*args, **kwargs)
+
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if deduct:
+                from .leave_ledger import record_deductions
+                record_deductions([self])
     
     class Meta:
         verbose_name = "假期申请"
@@ -544,4 +543,61 @@ class LeaveApplication(models.Model):
             models.Index(fields=['status']),
             models.Index(fields=['start_date']),
             models.Index(fields=['end_date']),
-        ]
\ No newline at end of file
+            # 审批人待办列表：按部门 + 状态筛选，按申请时间倒序
+            models.Index(fields=['department', 'status', '-apply_time'], name='leave_app_dept_pending_idx'),
+            # 按状态筛选后按开始日期排序 / 筛选
+            models.Index(fields=['status', 'start_date'], name='leave_app_status_start_idx'),
+        ]
+
+
+class LeaveLedgerEntry(models.Model):
+    """假期流水表 (只追加)
+    每次发放、扣减、调整记一笔，Leave 中的余额是流水按 (员工, 年份, 假期类型) 的合计"""
+    ENTRY_TYPES = [
+        ('accrual', '发放'),
+        ('deduction', '扣减'),
+        ('adjustment', '调整'),
+    ]
+
+    entry_id = models.AutoField(primary_key=True, verbose_name="流水ID")
+    employee = models.ForeignKey(
+        EmployeeProfile,
+        on_delete=models.CASCADE,
+        related_name='leave_ledger',
+        verbose_name="关联员工"
+    )
+    year = models.IntegerField(verbose_name="年份")
+    leave_type = models.CharField(
+        max_length=20,
+        choices=[choice for choice in LeaveApplication.LEAVE_TYPES if choice[0] in Leave.BALANCE_FIELDS],
+        verbose_name="假期类型"
+    )
+    entry_type = models.CharField(max_length=20, choices=ENTRY_TYPES, verbose_name="流水类型")
+    days = models.FloatField(verbose_name="天数 (扣减为负)")
+    application = models.ForeignKey(
+        LeaveApplication,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='ledger_entries',
+        verbose_name="关联申请"
+    )
+    comment = models.CharField(max_length=200, blank=True, verbose_name="备注")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="记录时间")
+
+    def __str__(self):
+        return f"{self.employee_id} {self.year} {self.get_leave_type_display()} {self.get_entry_type_display()} {self.days:+g}"
+
+    def save(self, *args, **kwargs):
+        """流水只追加：已保存的记录不允许修改，更正请追加调整记录"""
+        if not self._state.adding:
+            raise ValueError("假期流水只能追加，不能修改")
+        super().save(*args, **kwargs)
+
+    class Meta:
+        verbose_name = "假期流水"
+        verbose_name_plural = "假期流水"
+        indexes = [
+            # 对账：按 (员工, 年份, 假期类型) 汇总
+            models.Index(fields=['employee', 'year', 'leave_type'], name='leave_ledger_balance_idx'),
+        ]
@@ -1,3 +1,259 @@
-from django.test import TestCase
+import json
+import os
+import random
+import tempfile
+from datetime import date, timedelta
+from decimal import Decimal
+from io import StringIO
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.contrib.messages import get_messages
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from .leave_accrual import get_leave_accrual_settings, roll_over, roll_over_chunk, service_years
+from .leave_ledger import ledger_totals, reconcile, record_deductions, record_entry
+from .models import Department, EmployeeProfile, Leave, LeaveApplication, LeaveLedgerEntry, Salary
+from .workcalendar import WorkCalendar, get_work_calendar, leave_days, prorate_monthly_amount
+
+
+class LeaveLedgerTests(TestCase):
+    def setUp(self):
+        self.employee = EmployeeProfile.objects.create(name='张三', age=30, current_hire_date=date(2020, 1, 1))
+        self.department = Department.objects.create(name='人力资源部')
+        record_entry(self.employee.pk, 2026, 'annual', 10, entry_type='accrual')
+        record_entry(self.employee.pk, 2026, 'sick', 5, entry_type='accrual')
+
+    def apply(self, leave_type='annual', start=date(2026, 6, 8), end=date(2026, 6, 10), status='pending'):
+        return LeaveApplication.objects.create(
+            employee=self.employee, department=self.department, leave_type=leave_type,
+            start_date=start, end_date=end, reason='休假', status=status,
+        )
+
+    def balance(self):
+        return Leave.objects.get(employee=self.employee, year=2026)
+
+    def test_entries_materialize_into_a_single_balance_row(self):
+        balance = self.balance()
+        self.assertEqual((balance.annual_leave, balance.sick_leave), (10, 5))
+        self.assertEqual(ledger_totals(2026), {(self.employee.pk, 2026, 'annual'): 10, (self.employee.pk, 2026, 'sick'): 5})
+        self.assertEqual(reconcile(), [])
+
+    def test_approval_appends_deduction_entry(self):
+        application = self.apply()
+        application.status = 'approved'
+        application.save()
+
+        self.assertEqual(self.balance().annual_leave, 7)
+        entry = LeaveLedgerEntry.objects.get(entry_type='deduction')
+        self.assertEqual((entry.application, entry.days, entry.leave_type), (application, -3, 'annual'))
+        # 再次保存已批准的申请不会重复扣减
+        application.save()
+        self.assertEqual(self.balance().annual_leave, 7)
+        self.assertEqual(reconcile(), [])
+
+    def test_overdraft_is_recorded_not_clamped(self):
+        application = self.apply(start=date(2026, 6, 1), end=date(2026, 6, 16), status='approved')
+        self.assertEqual(application.days, 12)
+        self.assertEqual(self.balance().annual_leave, -2)
+        self.assertEqual(reconcile(), [])
+
+    def test_balance_update_uses_f_expression_not_stale_instance(self):
+        stale = self.balance()
+        record_entry(self.employee.pk, 2026, 'annual', -1, comment='扣回')
+        record_deductions([self.apply(leave_type='annual')])
+        # 基于旧读数写回会丢更新；F() 更新在数据库中累加
+        self.assertEqual(stale.annual_leave, 10)
+        self.assertEqual(self.balance().annual_leave, 10 - 1 - 3)
+
+    def test_other_leave_type_has_no_entry(self):
+        self.assertEqual(record_deductions([self.apply(leave_type='other')]), [])
+
+    def test_entries_are_append_only(self):
+        entry = LeaveLedgerEntry.objects.first()
+        entry.days = 100
+        with self.assertRaises(ValueError):
+            entry.save()
+
+    def test_deductions_update_each_balance_row_once(self):
+        applications = [self.apply(start=date(2026, 6, day), end=date(2026, 6, day)) for day in range(1, 6)]
+        with CaptureQueriesContext(connection) as captured:
+            record_deductions(applications)
+        updates = [q['sql'] for q in captured.captured_queries if q['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(self.balance().annual_leave, 5)
+
+    def test_reconcile_command_detects_and_fixes_drift(self):
+        Leave.objects.filter(employee=self.employee).update(annual_leave=99)
+        out = StringIO()
+        call_command('reconcile_leave_balances', stdout=out)
+        self.assertIn('1 项不一致', out.getvalue())
+        self.assertEqual(self.balance().annual_leave, 99)
+
+        call_command('reconcile_leave_balances', '--fix', stdout=StringIO())
+        self.assertEqual(self.balance().annual_leave, 10)
+        self.assertEqual(reconcile(), [])
+
+
+class WorkCalendarTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.holiday_file = os.path.join(directory.name, 'holidays.json')
+        with open(self.holiday_file, 'w', encoding='utf-8') as f:
+            json.dump({'2026': {'holidays': ['2026-05-01/2026-05-05'], 'workdays': ['2026-05-09']}}, f)
+        self.calendar = WorkCalendar.from_file(self.holiday_file)
+
+    def naive_count(self, start, end):
+        count = 0
+        day = start
+        while day <= end:
+            count += self.calendar.is_workday(day)
+            day += timedelta(days=1)
+        return count
+
+    def test_weekends_holidays_and_make_up_workdays(self):
+        self.assertFalse(self.calendar.is_workday(date(2026, 5, 4)))  # 周一，放假
+        self.assertTrue(self.calendar.is_workday(date(2026, 5, 9)))   # 周六，调休上班
+        self.assertFalse(self.calendar.is_workday(date(2026, 5, 10))) # 周日
+        self.assertEqual(self.calendar.count_workdays(date(2026, 5, 1), date(2026, 5, 10)), 4)
+        self.assertEqual(self.calendar.workdays_in_month(2026, 5), 21 - 3 + 1)
+        self.assertEqual(self.calendar.count_workdays(date(2026, 5, 2), date(2026, 5, 1)), 0)
+
+    def test_prefix_sum_counts_match_day_by_day_counts(self):
+        rng = random.Random(7)
+        first = date(2024, 12, 1)
+        ranges = []
+        for _ in range(300):
+            start = first + timedelta(days=rng.randrange(900))
+            ranges.append((start, start + timedelta(days=rng.randrange(500))))
+        self.assertEqual(self.calendar.count_workdays_many(ranges), [self.naive_count(start, end) for start, end in ranges])
+
+    def test_leave_days_and_proration(self):
+        self.assertEqual(leave_days('annual', date(2026, 4, 30), date(2026, 5, 6), self.calendar), 2)
+        self.assertEqual(leave_days('maternity', date(2026, 4, 30), date(2026, 5, 6), self.calendar), 7)
+        # 2026 年 6 月有 22 个工作日，15 日 (周一) 入职后有 12 个
+        self.assertEqual(self.calendar.workdays_in_month(2026, 6), 22)
+        self.assertEqual(
+            prorate_monthly_amount('11000', 2026, 6, employed_from=date(2026, 6, 15), work_calendar=self.calendar),
+            Decimal('6000.00'),
+        )
+
+    def test_settings_select_holiday_file(self):
+        with override_settings(WORK_CALENDAR={'HOLIDAY_FILE': self.holiday_file}):
+            self.assertFalse(get_work_calendar().is_workday(date(2026, 5, 4)))
+        with override_settings(WORK_CALENDAR={'HOLIDAY_FILE': os.path.join(os.path.dirname(self.holiday_file), 'missing.json')}):
+            self.assertTrue(get_work_calendar().is_workday(date(2026, 5, 4)))
+
+
+class SalaryProrationTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_user(username='hr', password='secret'))
+
+    def add_salary(self, employee, day='2026-06-01', amount='11000', **extra):
+        response = self.client.post('/salary/add/', {'employee_id': employee.pk, 'date': day, 'amount': amount, **extra})
+        self.assertEqual(response.status_code, 302)
+        self.messages = [str(message) for message in get_messages(response.wsgi_request)]
+        return Salary.objects.get(employee=employee, date=day).amount
+
+    def test_salary_for_hire_month_is_prorated(self):
+        employee = EmployeeProfile.objects.create(name='新人', age=25, current_hire_date=date(2026, 6, 15))
+        expected = prorate_monthly_amount('11000', 2026, 6, employed_from=date(2026, 6, 15))
+        self.assertLess(expected, Decimal('11000'))
+        self.assertEqual(self.add_salary(employee), expected)
+        # 提示中给出录入金额和折算后的金额
+        self.assertIn(f'录入金额 11000 已按出勤工作日折算为 {expected}', self.messages[0])
+
+    def test_full_month_skips_proration(self):
+        employee = EmployeeProfile.objects.create(name='新人', age=25, current_hire_date=date(2026, 6, 15))
+        self.assertEqual(self.add_salary(employee, amount='6000', full_month='on'), Decimal('6000'))
+        self.assertNotIn('折算', self.messages[0])
+
+    def test_salary_after_hire_month_is_not_prorated(self):
+        employee = EmployeeProfile.objects.create(name='老员工', age=35, current_hire_date=date(2026, 5, 20))
+        self.assertEqual(self.add_salary(employee), Decimal('11000'))
+
+
+@override_settings(LEAVE_ACCRUAL={'YEARLY_GRANTS': {'sick': 5}, 'CARRY_OVER_MAX': 5})
+class LeaveAccrualTests(TestCase):
+    def setUp(self):
+        def hire(name, hired, employed=True):
+            return EmployeeProfile.objects.create(name=name, age=30, current_hire_date=hired, is_employed=employed)
+        self.veteran = hire('老员工', date(2004, 3, 1))   # 截至 2027-01-01 满 22 年
+        self.mid = hire('中层', date(2015, 1, 1))         # 满 12 年
+        self.junior = hire('新人', date(2026, 6, 1))      # 不满一年
+        self.gone = hire('离职', date(2010, 1, 1), employed=False)
+        record_entry(self.veteran.pk, 2026, 'annual', 8, entry_type='accrual')
+        record_entry(self.mid.pk, 2026, 'annual', 2, entry_type='accrual')
+        record_entry(self.junior.pk, 2026, 'annual', -1, comment='透支')
+
+    def balance(self, employee, year=2027):
+        return Leave.objects.get(employee=employee, year=year)
+
+    def test_service_years(self):
+        self.assertEqual(service_years(date(2015, 1, 1), date(2027, 1, 1)), 12)
+        self.assertEqual(service_years(date(2015, 1, 2), date(2027, 1, 1)), 11)
+        self.assertEqual(service_years(date(2027, 3, 1), date(2027, 1, 1)), 0)
+
+    def test_roll_over_applies_tenure_and_carry_over(self):
+        self.assertEqual(list(roll_over(2027, chunk_size=2)), [(2, 2), (1, 1)])
+
+        # 15 天 + 结转上限 5 天；上年余 8 天中 3 天作废
+        self.assertEqual((self.balance(self.veteran).annual_leave, self.balance(self.veteran).sick_leave), (20, 5))
+        self.assertEqual(self.balance(self.veteran, 2026).annual_leave, 3)
+        self.assertEqual(self.balance(self.mid).annual_leave, 10 + 2)
+        self.assertEqual(self.balance(self.mid, 2026).annual_leave, 0)
+        # 不满一年没有年假，上年透支结转到新一年
+        self.assertEqual(self.balance(self.junior).annual_leave, -1)
+        self.assertFalse(Leave.objects.filter(employee=self.gone).exists())
+        self.assertEqual(reconcile(), [])
+
+    def test_roll_over_is_idempotent_and_resumable(self):
+        first_chunk = next(roll_over(2027, chunk_size=2)) # 只完成第一块后中断
+        self.assertEqual(first_chunk, (2, 2))
+        self.assertEqual(list(roll_over(2027, chunk_size=2)), [(2, 0), (1, 1)])
+        self.assertEqual(list(roll_over(2027, chunk_size=2)), [(2, 0), (1, 0)])
+        self.assertEqual(self.balance(self.veteran).annual_leave, 20)
+        self.assertEqual(LeaveLedgerEntry.objects.filter(year=2027, entry_type='accrual', leave_type='annual').count(), 3)
+        self.assertEqual(reconcile(), [])
+
+    def test_existing_row_for_new_year_is_topped_up(self):
+        # 发放前已批准的 2027 年请假先建了余额行
+        LeaveApplication.objects.create(
+            employee=self.mid, department=Department.objects.create(name='研发部'), leave_type='annual',
+            start_date=date(2027, 1, 4), end_date=date(2027, 1, 5), reason='休假', status='approved',
+        )
+        self.assertEqual(self.balance(self.mid).annual_leave, -2)
+        list(roll_over(2027))
+        self.assertEqual(self.balance(self.mid).annual_leave, 10 + 2 - 2)
+        self.assertEqual(reconcile(), [])
+
+    def test_employee_rows_locked_before_reading_markers(self):
+        # 重叠运行时后到的一方在员工行锁上等待，之后才读到前一方写入的发放标记
+        employees = [(self.mid.pk, self.mid.current_hire_date)]
+        with CaptureQueriesContext(connection) as captured:
+            roll_over_chunk(employees, 2027, get_leave_accrual_settings())
+        selects = [query['sql'] for query in captured.captured_queries if query['sql'].startswith('SELECT')]
+        self.assertIn(EmployeeProfile._meta.db_table, selects[0])
+        self.assertIn(LeaveLedgerEntry._meta.db_table, selects[1])
+        self.assertEqual(roll_over_chunk(employees, 2027, get_leave_accrual_settings()), 0)
+
+    def test_chunk_query_count_is_constant(self):
+        with CaptureQueriesContext(connection) as captured:
+            list(roll_over(2027, chunk_size=10))
+        few = len(captured.captured_queries)
+        for i in range(20):
+            EmployeeProfile.objects.create(name=f'员工{i}', age=30, current_hire_date=date(2012, 1, 1))
+        with CaptureQueriesContext(connection) as captured:
+            list(roll_over(2028, chunk_size=100))
+        self.assertEqual(len(captured.captured_queries), few)
+
+    def test_command(self):
+        out = StringIO()
+        call_command('accrue_annual_leave', '--year', '2027', '--dry-run', stdout=out)
+        self.assertIn('待发放 3 人', out.getvalue())
+        call_command('accrue_annual_leave', '--year', '2027', stdout=out)
+        call_command('accrue_annual_leave', '--year', '2027', '--dry-run', stdout=out)
+        self.assertIn('待发放 0 人', out.getvalue())
@@ -5,6 +5,7 @@ from django.utils import timezone
 from datetime import datetime, timedelta
 
 from ..models import EmployeeProfile, Attendance, EmployeeDepartment, Department
+from ..workcalendar import get_work_calendar
 
 
 @login_required
@@ -109,6 +110,9 @@ def attendance_stats(request):
     # 按员工分组统计
     employees = EmployeeProfile.objects.filter(is_employed=True)
     stats = []
+
+    # 应出勤天数：区间内的工作日 (不含周末和法定节假日，含调休上班日)
+    workdays = get_work_calendar().count_workdays(start_date, end_date)
     
     for employee in employees:
         employee_records = attendance_query.filter(employee=employee)
@@ -119,9 +123,6 @@ def attendance_stats(request):
         # 统计下班打卡次数
         out_count = employee_records.filter(type='out').count()
         
-        # 计算工作日数量（简化处理，实际应考虑节假日）
-        workdays = (end_date - start_date).days + 1
-        
         stats.append({
             'employee': employee,
             'in_count': in_count,
@@ -7,6 +7,7 @@ from django.utils import timezone
 from datetime import datetime
 
 from ..models import EmployeeProfile, Salary, EmployeeDepartment, Department
+from ..workcalendar import prorate_monthly_amount
 
 
 @login_required
@@ -91,6 +92,17 @@ def salary_add(request):
         amount = request.POST.get('amount')
         
         employee = get_object_or_404(EmployeeProfile, pk=employee_id)
+
+        # 当月入职的员工默认按入职后的工作日占当月工作日的比例折算月薪；
+        # 录入的已是折算后的金额时提交 full_month 跳过折算
+        month = datetime.strptime(date, '%Y-%m-%d').date()
+        hire_date = employee.current_hire_date
+        prorated_note = ''
+        if (hire_date and (hire_date.year, hire_date.month) == (month.year, month.month)
+                and not request.POST.get('full_month')):
+            entered = amount
+            amount = prorate_monthly_amount(entered, month.year, month.month, employed_from=hire_date)
+            prorated_note = f'（{hire_date} 入职，录入金额 {entered} 已按出勤工作日折算为 {amount}）'
         
         # 检查是否已存在该月薪资记录
         existing = Salary.objects.filter(
@@ -107,7 +119,7 @@ def salary_add(request):
                 date=date,
                 amount=amount
             )
-            messages.success(request, f'员工 {employee.name} 的薪资记录添加成功！')
+            messages.success(request, f'员工 {employee.name} 的薪资记录添加成功！{prorated_note}')
             return redirect('salary_list')
     
     # 获取员工列表用于表单选择
@@ -0,0 +1,172 @@
+# myapp/workcalendar.py
+"""
+工作日历。
+
+每年一个位图 (第 i 位表示该年第 i 天是否上班) 和它的前缀和数组 prefix，
+prefix[i] 为该年前 i 天中的工作日数，任意日期区间的工作日数是两次数组下标相减，与区间长度无关；
+跨年区间拆成首年尾段 + 中间整年 + 末年首段。位图在第一次用到某年时由周末规则和节假日文件生成，
+之后常驻内存 (每年约 1KB)。
+
+节假日文件 (settings.WORK_CALENDAR['HOLIDAY_FILE']，默认 myapp/data/holidays.json) 按年列出
+放假日 holidays 和调休上班的周末 workdays，日期可写成 "起/止" 区间；文件中没有的年份按周末规则计算。
+请假天数、考勤应出勤天数和月薪折算都通过 get_work_calendar() 共用同一份日历。
+"""
+import calendar
+import json
+from array import array
+from datetime import date, timedelta
+from decimal import ROUND_HALF_UP, Decimal
+from pathlib import Path
+
+from django.conf import settings
+from django.core.signals import setting_changed
+
+# 可在 settings.WORK_CALENDAR 中覆盖
+DEFAULT_WORK_CALENDAR_SETTINGS = {
+    'HOLIDAY_FILE': Path(__file__).resolve().parent / 'data' / 'holidays.json',  # 节假日文件
+    'WEEKEND': (5, 6),                                                            # 周末 (date.weekday()，周一为 0)
+}
+
+# 按自然日计算天数的假期类型 (含周末和节假日)
+CALENDAR_DAY_LEAVE_TYPES = ('maternity',)
+
+
+def get_work_calendar_settings():
+    return {**DEFAULT_WORK_CALENDAR_SETTINGS, **getattr(settings, 'WORK_CALENDAR', {})}
+
+
+def _expand(values):
+    """["2026-05-01/2026-05-05", "2026-05-09"] -> 日期集合"""
+    days = set()
+    for value in values:
+        first, _, last = value.partition('/')
+        day, last = date.fromisoformat(first), date.fromisoformat(last or first)
+        while day <= last:
+            days.add(day)
+            day += timedelta(days=1)
+    return days
+
+
+class YearCalendar:
+    """一年的工作日位图和前缀和"""
+    __slots__ = ('year', 'first', 'bitmap', 'prefix')
+
+    def __init__(self, year, weekend, holidays=(), workdays=()):
+        self.year = year
+        self.first = date(year, 1, 1)
+        length = 366 if calendar.isleap(year) else 365
+        bitmap = 0
+        prefix = array('H', [0]) * (length + 1)
+        first_weekday = self.first.weekday()
+        for i in range(length):
+            day = self.first + timedelta(days=i)
+            is_workday = (day in workdays) or ((first_weekday + i) % 7 not in weekend and day not in holidays)
+            if is_workday:
+                bitmap |= 1 << i
+            prefix[i + 1] = prefix[i] + is_workday
+        self.bitmap = bitmap
+        self.prefix = prefix
+
+    @property
+    def total(self):
+        return self.prefix[-1]
+
+    def is_workday(self, day):
+        return bool(self.bitmap >> (day - self.first).days & 1)
+
+    def count(self, start, end):
+        """本年内 [start, end] 的工作日数"""
+        return self.prefix[(end - self.first).days + 1] - self.prefix[(start - self.first).days]
+
+
+class WorkCalendar:
+    def __init__(self, holidays_by_year=None, weekend=(5, 6)):
+        # {year: (放假日集合, 调休上班日集合)}
+        self.holidays_by_year = holidays_by_year or {}
+        self.weekend = frozenset(weekend)
+        self._years = {}
+
+    @classmethod
+    def from_file(cls, path, weekend=(5, 6)):
+        try:
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            print(f"工作日历：节假日文件 {path} 不存在，按周末规则计算")
+            data = {}
+        holidays_by_year = {
+            int(year): (_expand(entry.get('holidays', ())), _expand(entry.get('workdays', ())))
+            for year, entry in data.items() if year.isdigit()
+        }
+        return cls(holidays_by_year, weekend)
+
+    def year(self, year):
+        year_calendar = self._years.get(year)
+        if year_calendar is None:
+            holidays, workdays = self.holidays_by_year.get(year, ((), ()))
+            year_calendar = self._years[year] = YearCalendar(year, self.weekend, holidays, workdays)
+        return year_calendar
+
+    def is_workday(self, day):
+        return self.year(day.year).is_workday(day)
+
+    def count_workdays(self, start, end):
+        """[start, end] (含两端) 的工作日数，end 早于 start 时为 0"""
+        if end < start:
+            return 0
+        if start.year == end.year:
+            return self.year(start.year).count(start, end)
+        return (
+            self.year(start.year).count(start, date(start.year, 12, 31))
+            + sum(self.year(year).total for year in range(start.year + 1, end.year))
+            + self.year(end.year).count(date(end.year, 1, 1), end)
+        )
+
+    def count_workdays_many(self, ranges):
+        """批量计算 [(start, end), ...] 的工作日数，每个区间 O(1)"""
+        count = self.count_workdays
+        return [count(start, end) for start, end in ranges]
+
+    def workdays_in_month(self, year, month):
+        return self.year(year).count(date(year, month, 1), date(year, month, calendar.monthrange(year, month)[1]))
+
+
+_work_calendar = None
+
+
+def get_work_calendar():
+    """按 settings.WORK_CALENDAR 加载的全局工作日历 (首次使用时加载)"""
+    global _work_calendar
+    if _work_calendar is None:
+        calendar_settings = get_work_calendar_settings()
+        _work_calendar = WorkCalendar.from_file(calendar_settings['HOLIDAY_FILE'], calendar_settings['WEEKEND'])
+    return _work_calendar
+
+
+def reset_work_calendar(**kwargs):
+    """节假日文件更新后 (或 WORK_CALENDAR 设置变化时) 丢弃已加载的日历"""
+    global _work_calendar
+    if kwargs.get('setting', 'WORK_CALENDAR') == 'WORK_CALENDAR':
+        _work_calendar = None
+
+
+setting_changed.connect(reset_work_calendar)
+
+
+def leave_days(leave_type, start, end, work_calendar=None):
+    """请假天数：产假等按自然日，其余按工作日 (不含周末和节假日)"""
+    if leave_type in CALENDAR_DAY_LEAVE_TYPES:
+        return (end - start).days + 1
+    return (work_calendar or get_work_calendar()).count_workdays(start, end)
+
+
+def prorate_monthly_amount(amount, year, month, employed_from=None, employed_to=None, work_calendar=None):
+    """按当月在职期间的工作日占当月工作日的比例折算月薪，保留两位小数"""
+    work_calendar = work_calendar or get_work_calendar()
+    first = date(year, month, 1)
+    last = date(year, month, calendar.monthrange(year, month)[1])
+    total = work_calendar.count_workdays(first, last)
+    worked = work_calendar.count_workdays(max(first, employed_from or first), min(last, employed_to or last))
+    if not total:
+        return Decimal(amount)
+    return (Decimal(amount) * worked / total).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
@@ -30,6 +30,7 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles', # 确保这个应用已启用
     'myapp',
     'workflows',
+    'leave_api',
     'rest_framework'
 ]
 
@@ -130,4 +131,54 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # 认证系统设置 (如果需要覆盖默认值)
 # LOGIN_URL = 'myapp:login' # 示例：如果你的登录视图在 myapp 中，名称为 login
 # LOGIN_REDIRECT_URL = '/'   # 登录后重定向的默认 URL
-# LOGOUT_REDIRECT_URL = '/'  # 登出后重定向的默认 URL
\ No newline at end of file
+# LOGOUT_REDIRECT_URL = '/'  # 登出后重定向的默认 URL
+
+# 工作流异步作业 (服务任务 / 通知节点) 的执行配置，由 `python manage.py run_workflow_worker` 使用
+# 未列出的项使用 workflows/executors.py 中 DEFAULT_WORKER_SETTINGS 的默认值
+WORKFLOW_WORKER = {
+    'CONCURRENCY': 4,         # 线程池大小
+    'MAX_ATTEMPTS': 5,        # 默认最大尝试次数，节点配置 maxAttempts 可覆盖
+    'TIMEOUT': 30,            # 默认单次执行超时 (秒)，节点配置 timeoutSeconds 可覆盖
+    'RETRY_BACKOFF': 10,      # 首次重试延迟 (秒)，之后每次翻倍
+    'RETRY_BACKOFF_MAX': 600, # 重试延迟上限 (秒)
+}
+# 服务任务处理函数登记：节点配置 serviceName -> 导入路径，例如 {'sync_hr_record': 'myapp.services.sync_hr_record'}
+WORKFLOW_SERVICE_HANDLERS = {}
+
+# 任务超时 (SLA) 调度配置，由 `python manage.py run_sla_scheduler` 使用
+# 未列出的项使用 workflows/scheduler.py 中 DEFAULT_SCHEDULER_SETTINGS 的默认值
+WORKFLOW_SCHEDULER = {
+    'HORIZON': 600,           # 预读未来多少秒内到期的任务
+    'REFRESH_INTERVAL': 0.5,  # 增量刷新间隔 (秒)
+    'BATCH_SIZE': 200,        # 每批处理的到期任务数
+}
+
+# 工作流引擎指标，导出端点 /api/workflows/metrics/ (Prometheus) 和 /api/workflows/metrics/json/
+# 未列出的项使用 workflows/metrics.py 中 DEFAULT_METRICS_SETTINGS 的默认值
+WORKFLOW_METRICS = {
+    'ENABLED': False,         # 关闭时所有埋点都是空操作
+    'TOKEN': '',              # Prometheus 抓取使用的 Bearer 令牌；为空时只允许管理员访问
+}
+
+# 工作流引擎并发控制，未列出的项使用 workflows/services.py 中 DEFAULT_ENGINE_SETTINGS 的默认值
+WORKFLOW_ENGINE = {
+    'CONCURRENCY_MODE': 'pessimistic', # 'optimistic': 完成任务只锁任务行，实例按 lock_version 条件更新，冲突时重试
+}
+
+# 已结束实例的归档，由 `python manage.py archive_workflow_instances` 使用 (建议 cron 每天运行)
+# 未列出的项使用 workflows/archive.py 中 DEFAULT_ARCHIVE_SETTINGS 的默认值
+WORKFLOW_ARCHIVE = {
+    'AFTER_DAYS': 180,        # 结束多少天后从热表移到归档表
+}
+
+# 工作日历 (请假天数、考勤应出勤天数、月薪折算)，未列出的项使用 myapp/workcalendar.py 中 DEFAULT_WORK_CALENDAR_SETTINGS 的默认值
+WORK_CALENDAR = {
+    'HOLIDAY_FILE': BASE_DIR / 'myapp' / 'data' / 'holidays.json', # 每年法定节假日和调休安排，公布后更新此文件
+}
+
+# 年度假期发放，由 `python manage.py accrue_annual_leave --year <年份>` 使用 (建议每年 1 月 1 日运行)
+# 未列出的项使用 myapp/leave_accrual.py 中 DEFAULT_LEAVE_ACCRUAL_SETTINGS 的默认值
+LEAVE_ACCRUAL = {
+    'ANNUAL_TIERS': ((20, 15), (10, 10), (1, 5)), # (工龄满多少年, 年假天数)
+    'CARRY_OVER_MAX': 5,                          # 上年未休年假最多结转的天数
+}
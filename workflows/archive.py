@@ -0,0 +1,154 @@
+# workflows/archive.py
+"""
+已结束实例的归档。
+
+WorkflowInstance / WorkflowTask / WorkflowHistory 随时间无限增长，而运行时只关心未结束的实例。
+结束超过 AFTER_DAYS 天的实例 (默认 COMPLETED / CANCELED) 按块移出热表：
+每个实例连同任务 (含 assigned_users) 和全部历史序列化为一个 JSON 文档，zlib 压缩后写入
+ArchivedWorkflowInstance，随后在同一事务中删除热表中的实例、任务、收件箱行、历史、快照和作业。
+归档数据通过只读 API (/api/workflows/archived-instances/) 读取，见 decode_document。
+
+扫描走 (status, completed_at) 索引，每块一个事务，块与块之间不持有锁；
+已归档的行从热表删除，因此每次取下一块都是从索引起点开始的短范围扫描，无需 OFFSET。
+"""
+import json
+import zlib
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+
+from .models import (
+    ArchivedWorkflowInstance, WorkflowHistory, WorkflowInstance, WorkflowInstanceSnapshot, WorkflowJob, WorkflowTask,
+    WorkflowTaskCandidate,
+)
+
+# 可在 settings.WORKFLOW_ARCHIVE 中覆盖
+DEFAULT_ARCHIVE_SETTINGS = {
+    'AFTER_DAYS': 180,                        # 结束多少天后归档
+    'STATUSES': ('COMPLETED', 'CANCELED'),    # 归档哪些状态的实例
+    'CHUNK_SIZE': 500,                        # 每个事务归档的实例数
+}
+
+INSTANCE_FIELDS = (
+    'id', 'definition_id', 'status', 'payload', 'current_node_ids', 'join_counters',
+    'started_at', 'completed_at', 'content_type_id', 'object_id',
+)
+TASK_FIELDS = (
+    'id', 'node_id', 'task_type', 'status', 'assignee_type', 'assignee_identifier', 'due_date',
+    'outcome', 'completion_data', 'created_at', 'completed_at', 'completed_by_id', 'timed_out_at',
+)
+HISTORY_FIELDS = ('id', 'node_id', 'task_id', 'event_type', 'timestamp', 'user_id', 'details')
+
+
+def get_archive_settings():
+    return {**DEFAULT_ARCHIVE_SETTINGS, **getattr(settings, 'WORKFLOW_ARCHIVE', {})}
+
+
+def encode_document(document):
+    return zlib.compress(json.dumps(document, cls=DjangoJSONEncoder, ensure_ascii=False).encode())
+
+
+def decode_document(data):
+    """ArchivedWorkflowInstance.document -> {"instance": {...}, "tasks": [...], "history": [...]}"""
+    return json.loads(zlib.decompress(bytes(data)))
+
+
+def archivable_instances(cutoff, statuses):
+    return WorkflowInstance.objects.filter(status__in=statuses, completed_at__lt=cutoff)
+
+
+def _grouped(rows, key):
+    grouped = defaultdict(list)
+    for row in rows:
+        grouped[row.pop(key)].append(row)
+    return grouped
+
+
+@transaction.atomic
+def archive_chunk(instance_ids, cutoff, statuses):
+    """
+    在一个事务中归档一批实例 (加锁后按条件重新筛选)，返回归档文档列表。
+    每张相关表各一次读取和一次删除，与块内实例数无关。
+    """
+    instances = list(
+        archivable_instances(cutoff, statuses).filter(pk__in=instance_ids)
+        .select_for_update(of=('self',)).select_related('definition').order_by('pk')
+    )
+    if not instances:
+        return []
+    ids = [instance.pk for instance in instances]
+
+    tasks = _grouped(WorkflowTask.objects.filter(instance_id__in=ids).order_by('created_at').values('instance_id', *TASK_FIELDS), 'instance_id')
+    assigned = defaultdict(list)
+    for task_id, user_id in WorkflowTask.assigned_users.through.objects.filter(workflowtask__instance_id__in=ids).values_list('workflowtask_id', 'user_id'):
+        assigned[task_id].append(user_id)
+    history = _grouped(
+        WorkflowHistory.objects.filter(instance_id__in=ids).order_by('instance_id', 'timestamp', 'id').values('instance_id', *HISTORY_FIELDS),
+        'instance_id',
+    )
+
+    documents, archived = [], []
+    for instance in instances:
+        instance_tasks = tasks.get(instance.pk, [])
+        for task in instance_tasks:
+            task['assigned_user_ids'] = assigned.get(task['id'], [])
+        document = {
+            'instance': {
+                **{field: getattr(instance, field) for field in INSTANCE_FIELDS},
+                'definition_name': instance.definition.name,
+                'definition_version': instance.definition.version,
+            },
+            'tasks': instance_tasks,
+            'history': history.get(instance.pk, []),
+        }
+        documents.append(document)
+        archived.append(ArchivedWorkflowInstance(
+            id=instance.pk,
+            definition_id=instance.definition_id,
+            definition_name=instance.definition.name,
+            definition_version=instance.definition.version,
+            status=instance.status,
+            started_at=instance.started_at,
+            completed_at=instance.completed_at,
+            content_type_id=instance.content_type_id,
+            object_id=instance.object_id,
+            task_count=len(document['tasks']),
+            event_count=len(document['history']),
+            document=encode_document(document),
+        ))
+    ArchivedWorkflowInstance.objects.bulk_create(archived)
+
+    # 先删除引用任务和实例的行，最后的任务 / 实例删除就不必再逐行级联
+    WorkflowHistory.objects.filter(instance_id__in=ids).delete()
+    WorkflowInstanceSnapshot.objects.filter(instance_id__in=ids).delete()
+    WorkflowJob.objects.filter(instance_id__in=ids).delete()
+    WorkflowTaskCandidate.objects.filter(task__instance_id__in=ids).delete()
+    WorkflowTask.assigned_users.through.objects.filter(workflowtask__instance_id__in=ids).delete()
+    WorkflowTask.objects.filter(instance_id__in=ids).delete()
+    WorkflowInstance.objects.filter(pk__in=ids).delete()
+    return documents
+
+
+def archive_instances(after_days=None, statuses=None, chunk_size=None):
+    """
+    逐块归档结束超过 after_days 天的实例，每块产出归档文档列表 (可用于同时导出到文件)。
+    参数默认取自 WORKFLOW_ARCHIVE。
+    """
+    archive_settings = get_archive_settings()
+    after_days = archive_settings['AFTER_DAYS'] if after_days is None else after_days
+    statuses = tuple(statuses or archive_settings['STATUSES'])
+    chunk_size = chunk_size or archive_settings['CHUNK_SIZE']
+    cutoff = timezone.now() - timedelta(days=after_days)
+    while True:
+        instance_ids = list(archivable_instances(cutoff, statuses).order_by('completed_at').values_list('pk', flat=True)[:chunk_size])
+        if not instance_ids:
+            return
+        documents = archive_chunk(instance_ids, cutoff, statuses)
+        if documents:
+            yield documents
+        if len(instance_ids) < chunk_size:
+            return
@@ -0,0 +1,315 @@
+# workflows/executors.py
+"""
+服务任务 / 通知节点的异步执行。
+
+引擎进入 serviceTaskNode / notificationNode 时只在当前事务中写入一条 WorkflowJob (outbox)，
+节点保持活动。事务提交后，run_workflow_worker 命令从表中领取作业，在本地线程池中执行
+(不持有任何实例行锁)，成功后调用 advance_workflow 把结果合并进 payload 并继续推进；
+失败按指数退避重试，次数用尽后将实例标记为失败。不依赖 Celery 等外部消息队列。
+"""
+import os
+import re
+import socket
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .metrics import get_metrics
+from .models import WorkflowInstance, WorkflowJob
+
+# 可在 settings.WORKFLOW_WORKER 中覆盖
+DEFAULT_WORKER_SETTINGS = {
+    'CONCURRENCY': 4,           # 线程池大小
+    'BATCH_SIZE': 20,           # 每次最多领取的作业数
+    'POLL_INTERVAL': 1.0,       # 没有作业时的轮询间隔 (秒)
+    'MAX_ATTEMPTS': 5,          # 默认最大尝试次数 (节点配置 maxAttempts 可覆盖)
+    'TIMEOUT': 30,              # 默认单次执行超时秒数 (节点配置 timeoutSeconds 可覆盖)
+    'RETRY_BACKOFF': 10,        # 首次重试延迟 (秒)，之后每次翻倍
+    'RETRY_BACKOFF_MAX': 600,   # 重试延迟上限 (秒)
+    'LEASE_GRACE': 60,          # 租约在超时之外额外保留的秒数
+    'NOTIFICATION_BACKEND': 'workflows.executors.print_notification',
+}
+
+
+def get_worker_settings():
+    return {**DEFAULT_WORKER_SETTINGS, **getattr(settings, 'WORKFLOW_WORKER', {})}
+
+
+# --- 服务任务处理函数注册表 ---
+# 节点配置中的 serviceName 只能引用已注册的处理函数，不能指定任意导入路径。
+# 处理函数签名：handler(config, payload) -> 可 JSON 序列化的结果
+_service_handlers = {}
+
+
+def register_service_handler(name):
+    def decorator(func):
+        _service_handlers[name] = func
+        return func
+    return decorator
+
+
+def get_service_handler(name):
+    handler = _service_handlers.get(name)
+    if handler is None:
+        # 也允许在 settings.WORKFLOW_SERVICE_HANDLERS = {'名称': '导入路径'} 中登记
+        dotted_path = getattr(settings, 'WORKFLOW_SERVICE_HANDLERS', {}).get(name)
+        if dotted_path:
+            handler = _service_handlers[name] = import_string(dotted_path)
+    if handler is None:
+        raise LookupError(f"未注册的服务任务处理函数：{name}")
+    return handler
+
+
+@register_service_handler('noop')
+def noop_service(config, payload):
+    """什么都不做的服务任务，用于占位或测试"""
+    return {'ok': True}
+
+
+# --- 通知 ---
+_TEMPLATE_VARIABLE = re.compile(r'\{payload\.([\w.]+)\}')
+
+
+def render_message(template, payload):
+    """把消息模板中的 {payload.a.b} 替换为 payload 中对应的值，缺失的字段替换为空字符串"""
+    def replace(match):
+        value = payload
+        for key in match.group(1).split('.'):
+            value = value.get(key) if isinstance(value, dict) else None
+        return '' if value is None else str(value)
+    return _TEMPLATE_VARIABLE.sub(replace, template or '')
+
+
+def print_notification(job, recipient_type, recipient_identifier, message):
+    """
+    默认通知后端：仅打印。生产环境在 WORKFLOW_WORKER['NOTIFICATION_BACKEND'] 中替换。
+    job 是 WorkflowJob (通知节点) 或 WorkflowTask (任务超时提醒)，后端只应使用 instance_id / node_id。
+    """
+    print(f"通知：实例 {job.instance_id} 节点 {job.node_id} -> {recipient_type}:{recipient_identifier}：{message}")
+
+
+def execute_job(job, payload):
+    """在线程池中执行单个作业，返回要合并到 payload 的结果。不访问实例行锁。"""
+    config = job.config or {}
+    try:
+        if job.job_type == WorkflowJob.JobType.SERVICE_TASK:
+            handler = get_service_handler(config.get('serviceName', 'noop'))
+            return handler(config, payload)
+
+        recipient_type = config.get('recipientType', 'REQUESTER')
+        recipient_identifier = config.get('recipientIdentifier') or payload.get('requester_id')
+        message = render_message(config.get('messageTemplate', ''), payload)
+        backend = import_string(get_worker_settings()['NOTIFICATION_BACKEND'])
+        backend(job, recipient_type, recipient_identifier, message)
+        return {'sent': True, 'recipient': f"{recipient_type}:{recipient_identifier}"}
+    finally:
+        # 处理函数可能使用了 ORM，释放本线程的数据库连接
+        connection.close()
+
+
+# --- 作业状态流转 ---
+def build_job(instance, node_id, job_type, config):
+    """构造 (未保存的) 作业，由引擎在推进事务中写入 outbox"""
+    worker_settings = get_worker_settings()
+    return WorkflowJob(
+        instance=instance,
+        node_id=node_id,
+        job_type=job_type,
+        config=config,
+        max_attempts=int(config.get('maxAttempts') or worker_settings['MAX_ATTEMPTS']),
+        timeout_seconds=int(config.get('timeoutSeconds') or worker_settings['TIMEOUT']),
+    )
+
+
+def claim_jobs(worker_name, limit):
+    """领取最多 limit 个到期作业。SKIP LOCKED 使多个 worker 进程可以并行领取而互不阻塞。"""
+    if limit <= 0:
+        return []
+    worker_settings = get_worker_settings()
+    now = timezone.now()
+    with transaction.atomic():
+        jobs = list(
+            WorkflowJob.objects.select_for_update(skip_locked=True, of=('self',))
+            .select_related('instance')
+            .filter(status=WorkflowJob.Status.PENDING, available_at__lte=now)
+            .order_by('available_at')[:limit]
+        )
+        for job in jobs:
+            job.status = WorkflowJob.Status.RUNNING
+            job.attempts += 1
+            job.locked_by = worker_name
+            job.locked_until = now + timedelta(seconds=job.timeout_seconds + worker_settings['LEASE_GRACE'])
+        WorkflowJob.objects.bulk_update(jobs, ['status', 'attempts', 'locked_by', 'locked_until', 'updated_at'])
+    return jobs
+
+
+def requeue_expired_jobs():
+    """租约过期仍为 RUNNING 的作业 (执行者已退出) 重新放回队列"""
+    return WorkflowJob.objects.filter(
+        status=WorkflowJob.Status.RUNNING, locked_until__lt=timezone.now()
+    ).update(status=WorkflowJob.Status.PENDING, locked_by='', locked_until=None, updated_at=timezone.now())
+
+
+def _held_lease(job):
+    """
+    仍由本次领取持有的作业 (job 为 claim_jobs 返回的对象)。租约过期后作业被重新排队
+    (locked_by 清空) 或被再次领取 (attempts 递增)，条件不再匹配。
+    """
+    return WorkflowJob.objects.filter(
+        pk=job.pk, status=WorkflowJob.Status.RUNNING, locked_by=job.locked_by, attempts=job.attempts,
+    )
+
+
+def _lost_lease(job):
+    print(f"警告：作业 {job.id} 第 {job.attempts} 次执行的租约已失效 (已重新排队或被其他 worker 领取)，丢弃本次结果。")
+    return None
+
+
+def complete_job(job, result):
+    """
+    作业成功：在一个事务中标记作业完成并把结果交给引擎推进。
+    标记完成是以 locked_by 和领取时的 attempts 为条件的 UPDATE (同时锁定作业行)；
+    没有更新到行说明租约已失效，不应用结果并返回 None。
+    """
+    from .services import workflow_engine # 避免循环导入
+
+    with transaction.atomic():
+        if not _held_lease(job).update(
+            status=WorkflowJob.Status.DONE, result=result, locked_until=None, updated_at=timezone.now(),
+        ):
+            return _lost_lease(job)
+        instance = WorkflowInstance.objects.select_for_update().get(pk=job.instance_id)
+        if job.node_id in instance.current_node_ids:
+            workflow_engine.advance_workflow(instance, job.node_id, {f"{job.node_id}_result": result}, instance_locked=True)
+        else:
+            print(f"警告：作业 {job.id} 完成时节点 {job.node_id} 已不在实例 {instance.id} 的活动节点中，忽略结果。")
+    job.status = WorkflowJob.Status.DONE
+    job.result = result
+    job.locked_until = None
+    get_metrics().inc('workflow_jobs_total', status='done')
+    return job
+
+
+def fail_job_attempt(job, error):
+    """
+    作业失败：未超过次数则按指数退避重新排队，否则标记失败并使实例失败。
+    与 complete_job 相同，租约已失效时不做任何修改并返回 None。
+    """
+    from .services import workflow_engine
+
+    worker_settings = get_worker_settings()
+    last_error = f"{type(error).__name__}: {error}"[:2000]
+    available_at = job.available_at
+    if job.attempts >= job.max_attempts:
+        status = WorkflowJob.Status.FAILED
+    else:
+        delay = min(worker_settings['RETRY_BACKOFF'] * 2 ** (job.attempts - 1), worker_settings['RETRY_BACKOFF_MAX'])
+        status = WorkflowJob.Status.PENDING
+        available_at = timezone.now() + timedelta(seconds=delay)
+    with transaction.atomic():
+        if not _held_lease(job).update(
+            status=status, last_error=last_error, locked_until=None, available_at=available_at, updated_at=timezone.now(),
+        ):
+            return _lost_lease(job)
+        if status == WorkflowJob.Status.FAILED:
+            workflow_engine.fail_instance(job.instance_id, node_id=job.node_id, reason=last_error)
+    job.status, job.last_error, job.locked_until, job.available_at = status, last_error, None, available_at
+    get_metrics().inc('workflow_jobs_total', status='failed' if status == WorkflowJob.Status.FAILED else 'retry')
+    return job
+
+
+class WorkflowWorker:
+    """
+    单进程 worker：主线程负责领取作业、等待结果和写回数据库，线程池只执行处理函数。
+    超时的处理函数无法被强制终止：作业立即按失败处理并进入重试，处理函数所在线程
+    在返回前仍占用一个并发名额，其结果会被忽略。
+    """
+
+    def __init__(self, concurrency=None, batch_size=None, poll_interval=None, name=None, log=print):
+        worker_settings = get_worker_settings()
+        self.concurrency = concurrency or worker_settings['CONCURRENCY']
+        self.batch_size = batch_size or worker_settings['BATCH_SIZE']
+        self.poll_interval = poll_interval or worker_settings['POLL_INTERVAL']
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}"
+        self.log = log
+        self._stop = threading.Event()
+
+    def stop(self):
+        self._stop.set()
+
+    def _record_failure(self, job, error):
+        """记一次失败尝试；写入本身出错时只记录日志，作业留待租约过期后重新排队"""
+        try:
+            fail_job_attempt(job, error)
+        except Exception as e:
+            self.log(f"作业 {job.id} 记录失败时出错，等待租约过期后重试：{e}")
+
+    def _handle_finished(self, future, job):
+        try:
+            result = future.result()
+        except Exception as e:
+            self.log(f"作业 {job.id} 执行失败 (第 {job.attempts} 次)：{e}")
+            self._record_failure(job, e)
+            return
+        try:
+            complete_job(job, result)
+        except Exception as e:
+            # 推进实例失败 (例如死锁或引擎错误)：事务已回滚，按一次失败尝试重试，不能让 worker 退出
+            self.log(f"作业 {job.id} 提交结果失败 (第 {job.attempts} 次)：{e}")
+            self._record_failure(job, e)
+
+    def run(self, once=False):
+        """
+        持续领取并执行作业，直到 stop() 被调用。
+        once=True 时处理完当前所有到期作业即返回 (用于测试或定时任务)。返回处理的作业数。
+        """
+        processed = 0
+        running = {}      # future -> (job, 截止时间)
+        abandoned = set() # 已超时但线程仍在运行的 future
+        executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='workflow-worker')
+        try:
+            while True:
+                if not connection.in_atomic_block:
+                    close_old_connections() # 常驻进程中丢弃失效的数据库连接
+                abandoned = {future for future in abandoned if not future.done()}
+                if not self._stop.is_set():
+                    requeue_expired_jobs()
+                    free_slots = self.concurrency - len(running) - len(abandoned)
+                    for job in claim_jobs(self.name, min(free_slots, self.batch_size)):
+                        future = executor.submit(execute_job, job, dict(job.instance.payload))
+                        running[future] = (job, time.monotonic() + job.timeout_seconds)
+
+                if not running:
+                    if once or self._stop.is_set():
+                        break
+                    self._stop.wait(self.poll_interval)
+                    continue
+
+                nearest_deadline = min(deadline for _, deadline in running.values())
+                done, _ = wait(
+                    list(running),
+                    timeout=max(0, min(self.poll_interval, nearest_deadline - time.monotonic())),
+                    return_when=FIRST_COMPLETED,
+                )
+                for future in done:
+                    job, _ = running.pop(future)
+                    self._handle_finished(future, job)
+                    processed += 1
+
+                now = time.monotonic()
+                for future, (job, deadline) in list(running.items()):
+                    if deadline <= now:
+                        del running[future]
+                        abandoned.add(future)
+                        self.log(f"作业 {job.id} 执行超时 ({job.timeout_seconds} 秒)")
+                        self._record_failure(job, TimeoutError(f"执行超过 {job.timeout_seconds} 秒"))
+                        processed += 1
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+        return processed
@@ -0,0 +1,324 @@
+# workflows/graph.py
+"""
+工作流图的编译与进程内缓存。
+
+definition_json 来自前端设计器 (React Flow)，是节点列表 + 边列表。
+引擎每推进一步都要按 ID 找节点、找出边；在列表上线性扫描的代价是 O(节点数)。
+这里把定义一次性编译成带索引的只读结构，并按 (定义ID, 版本, 更新时间) 缓存在进程内。
+
+发布 (workflow_engine.publish_definition) 时先用 validate_definition 校验整个图，
+再把规范化的编译形式存入 WorkflowDefinition.compiled_json；运行时只载入编译形式。
+"""
+import threading
+from collections import OrderedDict
+from enum import Enum
+
+from .rules import RuleSyntaxError, rule_evaluator
+
+
+class NodeType(str, Enum):
+    """引擎识别的节点类型 (统一为小写，与前端的 startNode/approvalNode 等对应)"""
+    START = 'startnode'
+    END = 'endnode'
+    APPROVAL = 'approvalnode'
+    USER_TASK = 'usertasknode'
+    SERVICE_TASK = 'servicetasknode'
+    NOTIFICATION = 'notificationnode'
+    DECISION = 'decisionnode'
+    PARALLEL_SPLIT = 'parallelsplitnode'  # 并行拆分：同时进入所有出边
+    PARALLEL_JOIN = 'paralleljoinnode'    # 并行汇聚：所有入边都到达后才继续
+    OTHER = 'other'
+
+    @classmethod
+    def from_raw(cls, raw_type):
+        try:
+            return cls((raw_type or '').lower())
+        except ValueError:
+            return cls.OTHER
+
+    @property
+    def is_user_task(self):
+        return self in (NodeType.APPROVAL, NodeType.USER_TASK)
+
+
+class CompiledGraph:
+    """
+    definition_json 的编译结果：
+    - nodes / node_types: 节点 ID -> 节点定义 / NodeType
+    - outgoing / incoming: 邻接表 (出边列表 / 入边来源节点 ID 列表)
+    - start_node_id / end_node_ids: 预先计算的开始、结束节点
+    编译后视为只读，可在线程间共享。
+    """
+
+    def __init__(self, definition_json):
+        definition_json = definition_json or {}
+        self.nodes = {}
+        self.node_types = {}
+        self.outgoing = {}
+        self.incoming = {}
+        self.start_node_id = None
+        self.end_node_ids = []
+
+        for node in definition_json.get('nodes', []):
+            node_id = node.get('id')
+            if node_id is None or node_id in self.nodes:
+                continue # 与原先 _find_node_by_id 一致：同 ID 以第一个为准
+            node_type = NodeType.from_raw(node.get('type'))
+            self.nodes[node_id] = node
+            self.node_types[node_id] = node_type
+            self.outgoing[node_id] = []
+            self.incoming[node_id] = []
+            if node_type == NodeType.START and self.start_node_id is None:
+                self.start_node_id = node_id
+            elif node_type == NodeType.END:
+                self.end_node_ids.append(node_id)
+
+        for edge in definition_json.get('edges', []):
+            source, target = edge.get('source'), edge.get('target')
+            # 允许边指向不存在的节点，运行时再报错 (保持原有行为)
+            self.outgoing.setdefault(source, []).append(edge)
+            self.incoming.setdefault(target, []).append(source)
+
+    def join_arity(self, node_id):
+        """汇聚节点需要等待的到达次数 (入边数)"""
+        return len(self.incoming.get(node_id, ()))
+
+    def node(self, node_id):
+        return self.nodes.get(node_id)
+
+    def node_type(self, node_id):
+        return self.node_types.get(node_id, NodeType.OTHER)
+
+    def outgoing_edges(self, node_id):
+        return self.outgoing.get(node_id, [])
+
+    def incoming_sources(self, node_id):
+        return self.incoming.get(node_id, [])
+
+    @property
+    def start_node(self):
+        return self.nodes.get(self.start_node_id)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    # --- 发布时存储的编译形式 (WorkflowDefinition.compiled_json) ---
+    COMPILED_FORMAT = 1
+
+    def to_compiled(self):
+        """序列化为可存入 JSONField 的规范化结构 (只保留引擎使用的键，去掉设计器的位置、样式等)"""
+        return {
+            'format': self.COMPILED_FORMAT,
+            'start': self.start_node_id,
+            'ends': self.end_node_ids,
+            'nodes': {node_id: _normalize_node(node) for node_id, node in self.nodes.items()},
+            'types': {node_id: node_type.value for node_id, node_type in self.node_types.items()},
+            'outgoing': {node_id: [_normalize_edge(edge) for edge in edges] for node_id, edges in self.outgoing.items()},
+            'incoming': self.incoming,
+        }
+
+    @classmethod
+    def from_compiled(cls, compiled):
+        """直接载入编译形式，不再扫描原始节点/边列表"""
+        graph = cls.__new__(cls)
+        graph.nodes = compiled['nodes']
+        graph.node_types = {node_id: NodeType(node_type) for node_id, node_type in compiled['types'].items()}
+        graph.outgoing = compiled['outgoing']
+        graph.incoming = compiled['incoming']
+        graph.start_node_id = compiled['start']
+        graph.end_node_ids = compiled['ends']
+        return graph
+
+
+def _normalize_node(node):
+    normalized = {'id': node.get('id'), 'type': node.get('type')}
+    data = node.get('data') or {}
+    if data.get('config'):
+        normalized['data'] = {'config': data['config']}
+    return normalized
+
+
+def _normalize_edge(edge):
+    normalized = {'id': edge.get('id'), 'source': edge.get('source'), 'target': edge.get('target')}
+    data = {key: value for key, value in (edge.get('data') or {}).items() if key in ('condition', 'isDefault') and value}
+    if data:
+        normalized['data'] = data
+    return normalized
+
+
+# 引擎在这些节点上等待 (人工任务或异步作业)；环路中至少要有一个，否则会在一次推进中无限循环
+WAIT_NODE_TYPES = (NodeType.APPROVAL, NodeType.USER_TASK, NodeType.SERVICE_TASK, NodeType.NOTIFICATION)
+
+
+class DefinitionValidationError(ValueError):
+    """定义未通过发布校验，errors 为错误描述列表"""
+
+    def __init__(self, errors):
+        super().__init__('; '.join(errors))
+        self.errors = errors
+
+
+def _reachable(start_ids, adjacency):
+    seen = set(start_ids)
+    stack = list(start_ids)
+    while stack:
+        for next_id in adjacency.get(stack.pop(), ()):
+            if next_id not in seen:
+                seen.add(next_id)
+                stack.append(next_id)
+    return seen
+
+
+def _automatic_cycle(graph):
+    """返回一个只由自动节点组成的环 (节点 ID 列表)，没有则返回 None。迭代 DFS，三色标记"""
+    auto_successors = {
+        node_id: [edge.get('target') for edge in graph.outgoing_edges(node_id) if graph.node_type(edge.get('target')) not in WAIT_NODE_TYPES]
+        for node_id, node_type in graph.node_types.items() if node_type not in WAIT_NODE_TYPES
+    }
+    state = {} # 1: 在当前路径上, 2: 已完成
+    for root in auto_successors:
+        if root in state:
+            continue
+        path, iterators = [root], [iter(auto_successors[root])]
+        state[root] = 1
+        while iterators:
+            next_id = next(iterators[-1], None)
+            if next_id is None:
+                state[path.pop()] = 2
+                iterators.pop()
+            elif state.get(next_id) == 1:
+                return path[path.index(next_id):] + [next_id]
+            elif next_id not in state:
+                state[next_id] = 1
+                path.append(next_id)
+                iterators.append(iter(auto_successors[next_id]))
+    return None
+
+
+def validate_definition(definition_json):
+    """
+    发布前校验定义，返回 (编译图, 错误列表)。检查：
+    节点 ID 唯一、边两端存在、恰有一个开始节点、至少一个结束节点、
+    所有节点可从开始节点到达、每个节点都能到达某个结束节点、
+    边上的条件语法正确、决策节点有默认路径 (无条件边或 isDefault)、不存在只由自动节点组成的环
+    (经过审批/服务等等待节点的环是允许的，例如驳回后重新提交)。
+    """
+    definition_json = definition_json or {}
+    errors = []
+    graph = CompiledGraph(definition_json)
+
+    seen_ids = set()
+    for node in definition_json.get('nodes', []):
+        node_id = node.get('id')
+        if node_id is None:
+            errors.append('存在没有 ID 的节点')
+        elif node_id in seen_ids:
+            errors.append(f'节点 ID {node_id} 重复')
+        seen_ids.add(node_id)
+
+    for edge in definition_json.get('edges', []):
+        for end in ('source', 'target'):
+            if edge.get(end) not in graph.nodes:
+                errors.append(f"边 {edge.get('id')} 的{'起点' if end == 'source' else '终点'} {edge.get(end)} 不存在")
+        condition = (edge.get('data') or {}).get('condition')
+        if condition:
+            try:
+                rule_evaluator.validate(condition)
+            except RuleSyntaxError as e:
+                errors.append(f"边 {edge.get('id')} 的条件不合法: {e}")
+
+    start_ids = [node_id for node_id, node_type in graph.node_types.items() if node_type == NodeType.START]
+    if not start_ids:
+        errors.append('缺少开始节点')
+    elif len(start_ids) > 1:
+        errors.append(f"只能有一个开始节点，实际有 {len(start_ids)} 个: {', '.join(start_ids)}")
+    if not graph.end_node_ids:
+        errors.append('缺少结束节点')
+
+    successors = {node_id: [edge.get('target') for edge in edges] for node_id, edges in graph.outgoing.items()}
+    if graph.start_node_id is not None:
+        unreachable = [node_id for node_id in graph.nodes if node_id not in _reachable([graph.start_node_id], successors)]
+        if unreachable:
+            errors.append(f"以下节点无法从开始节点到达: {', '.join(unreachable)}")
+    if graph.end_node_ids:
+        can_finish = _reachable(graph.end_node_ids, graph.incoming)
+        dead_ends = [node_id for node_id in graph.nodes if node_id not in can_finish]
+        if dead_ends:
+            errors.append(f"以下节点无法到达任何结束节点: {', '.join(dead_ends)}")
+
+    for node_id, node_type in graph.node_types.items():
+        if node_type != NodeType.DECISION:
+            continue
+        has_default = any(
+            not (edge.get('data') or {}).get('condition') or (edge.get('data') or {}).get('isDefault')
+            for edge in graph.outgoing_edges(node_id)
+        )
+        if not has_default:
+            errors.append(f'决策节点 {node_id} 没有默认路径 (所有条件都不满足时实例会停在该节点)')
+
+    cycle = _automatic_cycle(graph)
+    if cycle:
+        errors.append(f"存在不经过任何任务节点的环: {' -> '.join(cycle)}")
+
+    return graph, errors
+
+
+def compile_definition(definition_json):
+    """校验并返回编译形式；未通过校验时抛出 DefinitionValidationError"""
+    graph, errors = validate_definition(definition_json)
+    if errors:
+        raise DefinitionValidationError(errors)
+    return graph.to_compiled()
+
+
+class GraphCache:
+    """
+    进程内 LRU 缓存。键包含 updated_at，其他进程修改定义后本进程读取到的新行会自然失效，
+    本进程内保存定义时由 WorkflowDefinition.save() 主动清除。
+    """
+
+    def __init__(self, max_size=256):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(definition):
+        return (definition.pk, definition.version, definition.updated_at)
+
+    def get(self, definition):
+        key = self._key(definition)
+        with self._lock:
+            graph = self._entries.get(key)
+            if graph is not None:
+                self._entries.move_to_end(key)
+                return graph
+        # 编译放在锁外，避免大定义阻塞其他线程；重复编译的结果是等价的。
+        # 已发布的定义直接载入发布时校验过的编译形式，未发布的 (旧数据) 才编译原始 JSON
+        if definition.compiled_json:
+            graph = CompiledGraph.from_compiled(definition.compiled_json)
+        else:
+            graph = CompiledGraph(definition.definition_json)
+        with self._lock:
+            self._entries[key] = graph
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return graph
+
+    def invalidate(self, definition_id):
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == definition_id]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+graph_cache = GraphCache()
+
+
+def get_compiled_graph(definition):
+    """返回 WorkflowDefinition 对应的编译图 (带缓存)"""
+    return graph_cache.get(definition)
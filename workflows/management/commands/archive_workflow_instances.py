@@ -0,0 +1,59 @@
+# workflows/management/commands/archive_workflow_instances.py
+"""
+把结束已久的工作流实例 (连同任务和历史) 移出热表，压缩保存到 ArchivedWorkflowInstance。
+
+用法:
+    python manage.py archive_workflow_instances                    # 参数取自 settings.WORKFLOW_ARCHIVE
+    python manage.py archive_workflow_instances --days 365 --status COMPLETED CANCELED FAILED
+    python manage.py archive_workflow_instances --dry-run          # 只统计可归档的实例数
+    python manage.py archive_workflow_instances --export archive-2025.jsonl.gz   # 同时追加导出为 gzip 压缩的 JSONL
+可以由 cron 每天运行；每块一个事务，中途中断不影响已完成的块。
+"""
+import gzip
+import json
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+from workflows.archive import archivable_instances, archive_instances, get_archive_settings
+from workflows.models import WorkflowInstance
+
+
+class Command(BaseCommand):
+    help = '归档结束超过指定天数的工作流实例及其任务和历史'
+
+    def add_arguments(self, parser):
+        archive_settings = get_archive_settings()
+        parser.add_argument('--days', type=int, default=archive_settings['AFTER_DAYS'], help='结束多少天后归档')
+        parser.add_argument(
+            '--status', nargs='+', choices=WorkflowInstance.Status.values, default=list(archive_settings['STATUSES']),
+            help='归档哪些状态的实例',
+        )
+        parser.add_argument('--chunk-size', type=int, default=archive_settings['CHUNK_SIZE'], help='每个事务归档的实例数')
+        parser.add_argument('--export', help='同时把归档文档追加写入此 gzip 压缩的 JSONL 文件')
+        parser.add_argument('--dry-run', action='store_true', help='只统计，不归档')
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            cutoff = timezone.now() - timedelta(days=options['days'])
+            count = archivable_instances(cutoff, options['status']).count()
+            self.stdout.write(f"可归档的实例：{count} 个 (状态 {', '.join(options['status'])}，结束于 {cutoff:%Y-%m-%d %H:%M} 之前)")
+            return
+
+        export = gzip.open(options['export'], 'at', encoding='utf-8') if options['export'] else None
+        archived = 0
+        begin = time.perf_counter()
+        try:
+            for documents in archive_instances(options['days'], options['status'], options['chunk_size']):
+                if export is not None:
+                    for document in documents:
+                        export.write(json.dumps(document, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n')
+                archived += len(documents)
+                self.stdout.write(f"已归档 {archived} 个实例")
+        finally:
+            if export is not None:
+                export.close()
+        self.stdout.write(self.style.SUCCESS(f"完成：归档 {archived} 个实例，用时 {time.perf_counter() - begin:.1f} 秒"))
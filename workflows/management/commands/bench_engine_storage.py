@@ -0,0 +1,80 @@
+# workflows/management/commands/bench_engine_storage.py
+"""
+基准测试：同一引擎分别使用 OrmStorage 与 InMemoryStorage 时的吞吐量。
+内存后端的结果是引擎本身 (推进、规则求值、任务构造、历史缓冲) 的开销上限，
+两者之差即数据库往返和写入的开销。
+
+用法 (ORM 部分会向当前数据库写入测试数据，结束后删除；请只在开发/测试库上运行):
+    python manage.py bench_engine_storage --count 2000 --storage both
+每个实例走 “开始 -> 审批 a -> 审批 b -> 结束”，先逐个启动，再依次完成全部任务。
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from workflows.models import WorkflowDefinition, WorkflowInstance, WorkflowTask
+from workflows.services import WorkflowEngineService
+from workflows.storage import InMemoryStorage, OrmStorage
+
+BENCH_NAME = '__bench_engine_storage__'
+
+
+def build_definition():
+    def approval(node_id):
+        return {'id': node_id, 'type': 'approvalNode', 'data': {'config': {'assigneeType': 'ROLE', 'assigneeIdentifier': 'hr'}}}
+    return {
+        'nodes': [{'id': 'start', 'type': 'startNode'}, approval('a'), approval('b'), {'id': 'end', 'type': 'endNode'}],
+        'edges': [
+            {'id': 'e1', 'source': 'start', 'target': 'a'},
+            {'id': 'e2', 'source': 'a', 'target': 'b'},
+            {'id': 'e3', 'source': 'b', 'target': 'end'},
+        ],
+    }
+
+
+def open_task_ids(storage, instance_ids):
+    if isinstance(storage, InMemoryStorage):
+        return [task.id for instance_id in instance_ids for task in storage.get_tasks(instance_id, WorkflowTask.Status.PENDING)]
+    return list(WorkflowTask.objects.filter(instance_id__in=instance_ids, status=WorkflowTask.Status.PENDING).values_list('id', flat=True))
+
+
+class Command(BaseCommand):
+    help = '比较 ORM 与内存存储后端下工作流引擎的启动和完成任务吞吐量'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=2000, help='启动的实例数')
+        parser.add_argument('--storage', choices=('orm', 'memory', 'both'), default='both')
+
+    def handle(self, *args, **options):
+        backends = ('orm', 'memory') if options['storage'] == 'both' else (options['storage'],)
+        self.stdout.write(f"{'存储':<8} {'实例数':>8} {'启动/秒':>10} {'完成任务/秒':>12}")
+        for backend in backends:
+            if backend == 'memory':
+                storage = InMemoryStorage()
+                definition = storage.add_definition(WorkflowDefinition(name=BENCH_NAME, definition_json=build_definition()))
+                self.run(backend, storage, definition, options['count'])
+            else:
+                definition = WorkflowDefinition.objects.create(name=BENCH_NAME, definition_json=build_definition())
+                try:
+                    self.run(backend, OrmStorage(), definition, options['count'])
+                finally:
+                    WorkflowInstance.objects.filter(definition=definition).delete()
+                    definition.delete()
+
+    def run(self, backend, storage, definition, count):
+        engine = WorkflowEngineService(storage=storage)
+        begin = time.perf_counter()
+        instance_ids = [engine.start_instance(definition.id, {'employee_id': i}).pk for i in range(count)]
+        start_seconds = time.perf_counter() - begin
+
+        completed = 0
+        complete_seconds = 0.0
+        for _round in range(2): # 先完成 a，再完成 b
+            task_ids = open_task_ids(storage, instance_ids)
+            begin = time.perf_counter()
+            for task_id in task_ids:
+                engine.complete_task(task_id, None, 'approved')
+            complete_seconds += time.perf_counter() - begin
+            completed += len(task_ids)
+
+        self.stdout.write(f"{backend:<8} {count:>8} {count / start_seconds:>10.1f} {completed / complete_seconds:>12.1f}")
@@ -0,0 +1,148 @@
+# workflows/management/commands/bench_task_inbox.py
+"""
+基准测试：“我的待办”查询在原 OR + JOIN + distinct 写法与 WorkflowTaskCandidate 收件箱索引下的延迟。
+
+用法 (会向当前数据库写入大量测试数据，请只在开发/测试库上运行):
+    python manage.py bench_task_inbox --tasks 1000000 --users 10000
+默认规模较小，便于快速验证。运行结束后删除生成的数据 (--keep 保留)。
+"""
+import random
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from workflows.models import WorkflowDefinition, WorkflowInstance, WorkflowTask, WorkflowTaskCandidate
+from workflows.services import workflow_engine
+
+BENCH_PREFIX = '__bench_inbox__'
+CHUNK_SIZE = 5000
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class Command(BaseCommand):
+    help = '比较待办收件箱查询在 1M 级任务量下的 p50/p95 延迟'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tasks', type=int, default=100000, help='生成的任务数')
+        parser.add_argument('--users', type=int, default=1000, help='生成的用户数')
+        parser.add_argument('--roles', type=int, default=50, help='生成的角色 (Group) 数')
+        parser.add_argument('--samples', type=int, default=200, help='采样查询的用户数')
+        parser.add_argument('--page-size', type=int, default=50, help='每次查询取回的任务数')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--keep', action='store_true', help='保留生成的数据')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        try:
+            users, roles = self._populate(rng, options)
+            self._measure(rng, users, roles, options)
+        finally:
+            if not options['keep']:
+                self._cleanup()
+
+    def _populate(self, rng, options):
+        User = get_user_model()
+        self.stdout.write(f"生成 {options['users']} 个用户、{options['roles']} 个角色、{options['tasks']} 个任务...")
+        begin = time.perf_counter()
+
+        User.objects.bulk_create(
+            [User(username=f"{BENCH_PREFIX}{i}") for i in range(options['users'])], batch_size=CHUNK_SIZE
+        )
+        users = list(User.objects.filter(username__startswith=BENCH_PREFIX).values_list('pk', flat=True))
+        Group.objects.bulk_create([Group(name=f"{BENCH_PREFIX}role_{i}") for i in range(options['roles'])])
+        groups = list(Group.objects.filter(name__startswith=BENCH_PREFIX).values_list('pk', 'name'))
+        Membership = User.groups.through
+        Membership.objects.bulk_create(
+            [
+                Membership(user_id=user_id, group_id=group_id)
+                for user_id in users
+                for group_id, _ in rng.sample(groups, min(2, len(groups)))
+            ],
+            batch_size=CHUNK_SIZE,
+        )
+        roles = {user_id: [] for user_id in users}
+        for user_id, name in Membership.objects.filter(user_id__in=users).values_list('user_id', 'group__name'):
+            roles[user_id].append(name)
+
+        definition = WorkflowDefinition.objects.create(name=BENCH_PREFIX, definition_json={'nodes': [], 'edges': []})
+        instance_count = max(1, options['tasks'] // 5)
+        for start in range(0, instance_count, CHUNK_SIZE):
+            WorkflowInstance.objects.bulk_create(
+                [WorkflowInstance(definition=definition, status=WorkflowInstance.Status.RUNNING)
+                 for _ in range(min(CHUNK_SIZE, instance_count - start))]
+            )
+        instances = list(WorkflowInstance.objects.filter(definition=definition).values_list('pk', flat=True))
+
+        for start in range(0, options['tasks'], CHUNK_SIZE):
+            tasks = []
+            for _ in range(min(CHUNK_SIZE, options['tasks'] - start)):
+                if rng.random() < 0.7:
+                    assignee_type, identifier = WorkflowTask.AssigneeType.USER, str(rng.choice(users))
+                else:
+                    assignee_type, identifier = WorkflowTask.AssigneeType.ROLE, rng.choice(groups)[1]
+                status = WorkflowTask.Status.PENDING if rng.random() < 0.2 else WorkflowTask.Status.COMPLETED
+                tasks.append(WorkflowTask(
+                    instance_id=rng.choice(instances), node_id='approval', status=status,
+                    assignee_type=assignee_type, assignee_identifier=identifier,
+                ))
+            WorkflowTask.objects.bulk_create(tasks)
+            WorkflowTaskCandidate.objects.bulk_create([
+                WorkflowTaskCandidate(
+                    task=task, principal=next(iter(workflow_engine._task_principals(task))),
+                    status=task.status, created_at=task.created_at,
+                )
+                for task in tasks
+            ])
+        self.stdout.write(f"数据生成完成，用时 {time.perf_counter() - begin:.1f} 秒")
+        return users, roles
+
+    def _legacy_query(self, user, role_names, page_size):
+        # 优化前 WorkflowTaskViewSet 中 ?assignee=me&status=PENDING 的写法
+        return list(
+            WorkflowTask.objects.filter(status=WorkflowTask.Status.PENDING)
+            .filter(
+                Q(assignee_identifier=str(user.pk)) | Q(assigned_users=user)
+                | Q(assignee_type=WorkflowTask.AssigneeType.ROLE, assignee_identifier__in=role_names, status=WorkflowTask.Status.PENDING)
+            )
+            .distinct().order_by('created_at')[:page_size]
+        )
+
+    def _inbox_query(self, user, role_names, page_size):
+        return list(
+            WorkflowTask.objects.filter(id__in=workflow_engine.inbox_task_ids(user, role_names, status=WorkflowTask.Status.PENDING))
+            .order_by('created_at')[:page_size]
+        )
+
+    def _measure(self, rng, users, roles, options):
+        User = get_user_model()
+        sample_ids = rng.sample(users, min(options['samples'], len(users)))
+        sample_users = User.objects.in_bulk(sample_ids)
+        results = {}
+        for label, query in (('优化前 (OR + JOIN + distinct)', self._legacy_query), ('收件箱索引', self._inbox_query)):
+            timings = []
+            for user_id in sample_ids:
+                begin = time.perf_counter()
+                query(sample_users[user_id], roles[user_id], options['page_size'])
+                timings.append((time.perf_counter() - begin) * 1000)
+            results[label] = timings
+
+        self.stdout.write(f"{'查询':<28} {'p50(ms)':>10} {'p95(ms)':>10} {'平均(ms)':>10}")
+        for label, timings in results.items():
+            self.stdout.write(
+                f"{label:<28} {percentile(timings, 0.5):>10.2f} {percentile(timings, 0.95):>10.2f} {statistics.mean(timings):>10.2f}"
+            )
+
+    def _cleanup(self):
+        User = get_user_model()
+        WorkflowInstance.objects.filter(definition__name=BENCH_PREFIX).delete()
+        WorkflowDefinition.objects.filter(name=BENCH_PREFIX).delete()
+        Group.objects.filter(name__startswith=BENCH_PREFIX).delete()
+        User.objects.filter(username__startswith=BENCH_PREFIX).delete()
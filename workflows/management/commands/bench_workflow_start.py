@@ -0,0 +1,54 @@
+# workflows/management/commands/bench_workflow_start.py
+"""
+基准测试：逐个 start_instance 与 start_instances_bulk 的启动吞吐量 (实例/秒)。
+
+用法 (会向当前数据库写入测试数据，结束后删除；请只在开发/测试库上运行):
+    python manage.py bench_workflow_start --count 2000 --chunk-size 500
+使用“开始 -> 审批 -> 结束”的定义，审批节点指派给一个角色，与年度考核类流程的形状一致。
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from workflows.models import WorkflowDefinition, WorkflowInstance
+from workflows.services import workflow_engine
+
+BENCH_NAME = '__bench_workflow_start__'
+
+
+def build_definition():
+    approval = {'id': 'review', 'type': 'approvalNode', 'data': {'config': {'assigneeType': 'ROLE', 'assigneeIdentifier': 'hr'}}}
+    return {
+        'nodes': [{'id': 'start', 'type': 'startNode'}, approval, {'id': 'end', 'type': 'endNode'}],
+        'edges': [{'id': 'e1', 'source': 'start', 'target': 'review'}, {'id': 'e2', 'source': 'review', 'target': 'end'}],
+    }
+
+
+class Command(BaseCommand):
+    help = '比较逐个启动与批量启动工作流实例的吞吐量'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=2000, help='每种方式启动的实例数')
+        parser.add_argument('--chunk-size', type=int, default=workflow_engine.BULK_START_CHUNK_SIZE, help='批量启动每个事务的实例数')
+
+    def handle(self, *args, **options):
+        count = options['count']
+        definition = WorkflowDefinition.objects.create(name=BENCH_NAME, definition_json=build_definition())
+        payloads = [{'employee_id': i, 'year': 2025} for i in range(count)]
+        try:
+            begin = time.perf_counter()
+            for payload in payloads:
+                workflow_engine.start_instance(definition.id, payload)
+            single_seconds = time.perf_counter() - begin
+
+            begin = time.perf_counter()
+            results = list(workflow_engine.start_instances_bulk(definition.id, payloads, chunk_size=options['chunk_size']))
+            bulk_seconds = time.perf_counter() - begin
+            failed = sum(1 for result in results if 'error' in result)
+
+            self.stdout.write(f"{'方式':<12} {'实例数':>8} {'用时(秒)':>10} {'实例/秒':>10}")
+            self.stdout.write(f"{'逐个启动':<12} {count:>8} {single_seconds:>10.2f} {count / single_seconds:>10.1f}")
+            self.stdout.write(f"{'批量启动':<12} {count - failed:>8} {bulk_seconds:>10.2f} {(count - failed) / bulk_seconds:>10.1f}")
+        finally:
+            WorkflowInstance.objects.filter(definition=definition).delete()
+            definition.delete()
@@ -0,0 +1,69 @@
+# workflows/management/commands/repair_stuck_instances.py
+"""
+查找并修复卡住的工作流实例 (RUNNING，但没有任何活动节点在等待任务或作业，见 workflows/repair.py)。
+
+用法:
+    python manage.py repair_stuck_instances                       # 只报告
+    python manage.py repair_stuck_instances --action retry        # 重新创建缺失的任务/作业、重新求值决策节点
+    python manage.py repair_stuck_instances --action suspend      # 暂停，等待人工处理
+    python manage.py repair_stuck_instances --action fail --reason "定义已下线"
+按 (status, id) 分块扫描，每块处理完再读取下一块，可以在百万级实例上运行。
+"""
+import time
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+
+from workflows.models import WorkflowInstance
+from workflows.repair import DEFAULT_CHUNK_SIZE, StuckReason, iter_stuck_instances
+from workflows.services import workflow_engine
+
+
+class Command(BaseCommand):
+    help = '报告卡住的工作流实例，并可批量暂停、重试或标记失败'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--action', choices=('report', 'suspend', 'retry', 'fail'), default='report', help='对卡住的实例执行的操作')
+        parser.add_argument('--reason', default='', help='暂停或失败的原因 (写入历史)')
+        parser.add_argument('--definition', help='只检查此定义 ID 的实例')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='每块扫描的实例数')
+        parser.add_argument('--show', type=int, default=50, help='最多逐条列出的实例数')
+
+    def handle(self, *args, **options):
+        action = options['action']
+        scanned = found = repaired = shown = 0
+        reason_counts = Counter()
+        begin = time.perf_counter()
+
+        for chunk_scanned, stuck in iter_stuck_instances(chunk_size=options['chunk_size'], definition_id=options['definition']):
+            scanned += chunk_scanned
+            found += len(stuck)
+            for instance_id, reasons in stuck.items():
+                reason_counts.update(reasons.values())
+                if shown < options['show']:
+                    shown += 1
+                    details = ', '.join(f"{node_id or '-'}: {StuckReason.labels[reason]}" for node_id, reason in reasons.items())
+                    self.stdout.write(f"{instance_id}  {details}")
+            if stuck and action != 'report':
+                repaired += self._repair(action, list(stuck), options['reason'])
+
+        seconds = time.perf_counter() - begin
+        self.stdout.write(f"扫描 {scanned} 个实例，发现 {found} 个卡住，用时 {seconds:.2f} 秒")
+        for reason, count in reason_counts.most_common():
+            self.stdout.write(f"  {StuckReason.labels[reason]}: {count} 个节点")
+        if action != 'report':
+            self.stdout.write(self.style.SUCCESS(f"已{dict(suspend='暂停', retry='重试', fail='标记失败')[action]} {repaired} 个实例"))
+
+    def _repair(self, action, instance_ids, reason):
+        if action == 'suspend':
+            return len(workflow_engine.close_stuck_instances(instance_ids, WorkflowInstance.Status.SUSPENDED, reason))
+        if action == 'fail':
+            return len(workflow_engine.close_stuck_instances(instance_ids, WorkflowInstance.Status.FAILED, reason))
+        repaired = 0
+        for instance_id in instance_ids: # 每个实例一个事务，一个实例出错不影响其他实例
+            try:
+                if workflow_engine.retry_stuck_instance(instance_id) is not None:
+                    repaired += 1
+            except Exception as e:
+                self.stderr.write(f"实例 {instance_id} 重试失败：{e}")
+        return repaired
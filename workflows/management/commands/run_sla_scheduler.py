@@ -0,0 +1,42 @@
+# workflows/management/commands/run_sla_scheduler.py
+"""
+检测到期的用户任务并执行节点配置的超时动作 (提醒 / 自动批准 / 自动驳回 / 上报)。
+
+用法:
+    python manage.py run_sla_scheduler            # 常驻运行
+    python manage.py run_sla_scheduler --once     # 处理当前已到期的任务后退出 (可由 cron 调用)
+"""
+import signal
+
+from django.core.management.base import BaseCommand
+
+from workflows.scheduler import SlaScheduler
+
+
+class Command(BaseCommand):
+    help = '按截止时间调度工作流任务的超时动作'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--horizon', type=int, help='预读未来多少秒内到期的任务 (默认取 WORKFLOW_SCHEDULER["HORIZON"])')
+        parser.add_argument('--refresh-interval', type=float, help='增量刷新间隔 (秒)')
+        parser.add_argument('--batch-size', type=int, help='每批处理的到期任务数')
+        parser.add_argument('--once', action='store_true', help='处理当前已到期的任务后退出')
+
+    def handle(self, *args, **options):
+        scheduler = SlaScheduler(
+            horizon=options['horizon'],
+            refresh_interval=options['refresh_interval'],
+            batch_size=options['batch_size'],
+            log=self.stdout.write,
+        )
+
+        def request_stop(signum, frame):
+            self.stdout.write('收到停止信号，处理完当前批次后退出...')
+            scheduler.stop()
+
+        signal.signal(signal.SIGTERM, request_stop)
+        signal.signal(signal.SIGINT, request_stop)
+
+        self.stdout.write(f"SLA 调度器启动，预读窗口 {scheduler.horizon}，刷新间隔 {scheduler.refresh_interval} 秒")
+        processed = scheduler.run(once=options['once'])
+        self.stdout.write(self.style.SUCCESS(f"SLA 调度器退出，共处理 {processed} 个超时任务"))
@@ -0,0 +1,44 @@
+# workflows/management/commands/run_workflow_worker.py
+"""
+执行服务任务 / 通知节点的异步作业 (WorkflowJob outbox)。
+
+用法:
+    python manage.py run_workflow_worker                  # 常驻运行
+    python manage.py run_workflow_worker --once           # 处理完当前到期作业后退出
+    python manage.py run_workflow_worker --concurrency 8
+可同时启动多个进程，作业通过 SELECT ... FOR UPDATE SKIP LOCKED 领取，不会重复执行。
+"""
+import signal
+
+from django.core.management.base import BaseCommand
+
+from workflows.executors import WorkflowWorker
+
+
+class Command(BaseCommand):
+    help = '领取并执行工作流服务任务 / 通知节点的异步作业'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, help='线程池大小 (默认取 WORKFLOW_WORKER["CONCURRENCY"])')
+        parser.add_argument('--batch-size', type=int, help='每次最多领取的作业数')
+        parser.add_argument('--poll-interval', type=float, help='没有作业时的轮询间隔 (秒)')
+        parser.add_argument('--once', action='store_true', help='处理完当前所有到期作业后退出')
+
+    def handle(self, *args, **options):
+        worker = WorkflowWorker(
+            concurrency=options['concurrency'],
+            batch_size=options['batch_size'],
+            poll_interval=options['poll_interval'],
+            log=self.stdout.write,
+        )
+
+        def request_stop(signum, frame):
+            self.stdout.write('收到停止信号，等待执行中的作业结束...')
+            worker.stop()
+
+        signal.signal(signal.SIGTERM, request_stop)
+        signal.signal(signal.SIGINT, request_stop)
+
+        self.stdout.write(f"工作流 worker {worker.name} 启动，并发 {worker.concurrency}")
+        processed = worker.run(once=options['once'])
+        self.stdout.write(self.style.SUCCESS(f"worker 退出，共处理 {processed} 个作业"))
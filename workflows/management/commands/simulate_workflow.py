@@ -0,0 +1,100 @@
+# workflows/management/commands/simulate_workflow.py
+"""
+在内存中模拟运行工作流定义 (不读写实例、任务、历史)，报告节点访问次数、决策分支概率和各指派对象的任务量。
+
+用法:
+    python manage.py simulate_workflow <定义ID> --instances 10000 --payloads samples.json
+    python manage.py simulate_workflow --file definition.json --outcomes '{"review": {"approved": 8, "rejected": 2}}' --json
+--payloads 为 JSON 数组文件，每个元素是一个实例的初始负载，按顺序循环使用。
+模拟的是定义当前的 definition_json (草稿)，因此可以在发布前运行。
+"""
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from workflows.graph import DefinitionValidationError
+from workflows.models import WorkflowDefinition
+from workflows.simulation import DEFAULT_MAX_STEPS, simulate_definition
+
+
+def _load_json(value, option):
+    try:
+        return json.loads(value)
+    except ValueError as e:
+        raise CommandError(f'{option} 不是合法的 JSON：{e}')
+
+
+def _read_json_file(path, option):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return _load_json(f.read(), option)
+    except OSError as e:
+        raise CommandError(f'无法读取 {option} 文件：{e}')
+
+
+class Command(BaseCommand):
+    help = '在内存中模拟运行工作流定义，估算路径长度、分支概率和任务量'
+
+    def add_arguments(self, parser):
+        parser.add_argument('definition_id', nargs='?', help='要模拟的定义 ID')
+        parser.add_argument('--file', help='从 JSON 文件读取定义 (nodes / edges)，代替定义 ID')
+        parser.add_argument('--instances', type=int, default=1000, help='模拟的实例数')
+        parser.add_argument('--payloads', help='样本初始负载 (JSON 数组文件)')
+        parser.add_argument('--outcomes', default='{}', help='用户任务结果的权重，如 {"review": {"approved": 8, "rejected": 2}}')
+        parser.add_argument('--job-results', default='{}', help='服务任务 / 通知节点的结果，如 {"sync": {"ok": true}}')
+        parser.add_argument('--seed', type=int, help='随机种子 (结果抽样可复现)')
+        parser.add_argument('--max-steps', type=int, default=DEFAULT_MAX_STEPS, help='每个实例最多完成的任务 / 作业数')
+        parser.add_argument('--json', action='store_true', help='以 JSON 输出完整报告')
+
+    def handle(self, *args, **options):
+        if options['file']:
+            definition_json = _read_json_file(options['file'], '--file')
+        elif options['definition_id']:
+            try:
+                definition_json = WorkflowDefinition.objects.get(pk=options['definition_id']).definition_json
+            except (WorkflowDefinition.DoesNotExist, ValueError):
+                raise CommandError(f"定义 {options['definition_id']} 不存在")
+        else:
+            raise CommandError('请指定定义 ID 或使用 --file')
+        payloads = _read_json_file(options['payloads'], '--payloads') if options['payloads'] else [{}]
+        if not isinstance(payloads, list) or not all(isinstance(payload, dict) for payload in payloads):
+            raise CommandError('--payloads 必须是 JSON 对象数组')
+
+        try:
+            report = simulate_definition(
+                definition_json, payloads, options['instances'],
+                outcomes=_load_json(options['outcomes'], '--outcomes'),
+                job_results=_load_json(options['job_results'], '--job-results'),
+                seed=options['seed'], max_steps=options['max_steps'],
+            ).as_dict()
+        except DefinitionValidationError as e:
+            raise CommandError('定义无法模拟：' + '；'.join(e.errors))
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, ensure_ascii=False, indent=2))
+            return
+        self.write_report(report)
+
+    def write_report(self, report):
+        for error in report['errors']:
+            self.stdout.write(self.style.WARNING(f'校验错误：{error}'))
+        self.stdout.write(
+            f"{report['instances']} 个实例，用时 {report['seconds']:.2f} 秒 ({report['instances_per_second']} 实例/秒)；"
+            f"结束状态 {report['statuses']}，截断 {report['truncated']}"
+        )
+        path = report['path_length']
+        self.stdout.write(f"路径长度 (进入的节点数)：min {path['min']} / 平均 {path['mean']} / p50 {path['p50']} / p95 {path['p95']} / max {path['max']}")
+
+        self.stdout.write(f"\n{'节点':<24} {'进入次数':>10} {'每实例':>8}")
+        for node_id, visits in report['node_visits'].items():
+            self.stdout.write(f"{node_id:<24} {visits['count']:>10} {visits['per_instance']:>8.3f}")
+        if report['branch_probabilities']:
+            self.stdout.write(f"\n{'决策节点':<24} {'目标节点':<24} {'概率':>8}")
+            for decision, targets in report['branch_probabilities'].items():
+                for target, probability in targets.items():
+                    self.stdout.write(f"{decision:<24} {target:<24} {probability:>8.3f}")
+        self.stdout.write(f"\n{'指派对象':<32} {'任务数':>10} {'每实例':>8}")
+        for assignee, load in report['task_load'].items():
+            self.stdout.write(f"{assignee:<32} {load['tasks']:>10} {load['per_instance']:>8.3f}")
+        if report['stalled_nodes']:
+            self.stdout.write(self.style.WARNING(f"\n停在以下节点无法继续的实例：{report['stalled_nodes']}"))
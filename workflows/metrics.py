@@ -0,0 +1,250 @@
+# workflows/metrics.py
+"""
+工作流引擎的运行指标。
+
+引擎在关键路径上记录计数器和耗时直方图：
+- workflow_operation_seconds{operation=start|advance|complete_task|timeouts}  入口方法耗时 (含提交)
+- workflow_lock_wait_seconds{table=instance|task}                               select_for_update 等待行锁的时间
+- workflow_rule_evaluation_seconds                                              决策条件求值耗时
+- workflow_instances_started_total / workflow_instances_finished_total{status}
+- workflow_tasks_created_total / workflow_tasks_completed_total
+- workflow_jobs_total{status=done|retry|failed}
+实例和任务计数在对应的历史事件所在事务提交后累加 (回滚或乐观重试中丢弃的事件不计入)。
+队列深度 (待执行作业、待办任务、已超时任务、运行中实例) 在导出时按需查询，见 queue_depths()。
+
+后端可插拔 (settings.WORKFLOW_METRICS['BACKEND'])，默认 InMemoryMetrics 在进程内聚合，
+由 /metrics (Prometheus 文本格式) 和 /metrics/json 导出；多进程部署时每个进程各自统计，
+需要汇总时请换成写入共享存储的后端。ENABLED 为 False (默认) 时使用 NullMetrics，
+每个埋点只是一次空方法调用。
+"""
+import bisect
+import functools
+import threading
+import time
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import WorkflowInstance, WorkflowJob, WorkflowTask
+from .scheduler import OPEN_TASK_STATUSES
+
+# 可在 settings.WORKFLOW_METRICS 中覆盖
+DEFAULT_METRICS_SETTINGS = {
+    'ENABLED': False,
+    'BACKEND': 'workflows.metrics.InMemoryMetrics',
+    # 直方图桶上界 (秒)
+    'BUCKETS': (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+    # 访问导出端点需要的令牌 (Authorization: Bearer <TOKEN>)；为空时只允许管理员登录访问
+    'TOKEN': '',
+}
+
+HELP = {
+    'workflow_operation_seconds': '工作流引擎入口方法耗时',
+    'workflow_lock_wait_seconds': '等待实例/任务行锁的时间',
+    'workflow_rule_evaluation_seconds': '决策条件求值耗时',
+    'workflow_instances_started_total': '已启动的实例数',
+    'workflow_instances_finished_total': '已结束的实例数',
+    'workflow_tasks_created_total': '已创建的任务数',
+    'workflow_tasks_completed_total': '已完成的任务数',
+    'workflow_jobs_total': '已执行的异步作业数',
+    'workflow_queue_depth': '队列深度 (导出时查询)',
+}
+
+
+def get_metrics_settings():
+    return {**DEFAULT_METRICS_SETTINGS, **getattr(settings, 'WORKFLOW_METRICS', {})}
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items())) if labels else ()
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class NullMetrics:
+    """未启用指标时的后端：所有操作都是空操作"""
+    enabled = False
+
+    def inc(self, name, value=1, **labels):
+        pass
+
+    def observe(self, name, seconds, **labels):
+        pass
+
+    def timer(self, name, **labels):
+        return _NULL_TIMER
+
+    def snapshot(self):
+        return {'counters': [], 'histograms': []}
+
+
+class _Timer:
+    __slots__ = ('backend', 'name', 'labels', 'begin')
+
+    def __init__(self, backend, name, labels):
+        self.backend = backend
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.begin = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.backend.observe(self.name, time.perf_counter() - self.begin, **self.labels)
+        return False
+
+
+class InMemoryMetrics:
+    """进程内聚合的计数器和直方图 (线程安全)"""
+    enabled = True
+
+    def __init__(self, buckets=None):
+        self.buckets = tuple(buckets or DEFAULT_METRICS_SETTINGS['BUCKETS'])
+        self._lock = threading.Lock()
+        self._counters = {}   # (名称, 标签) -> 值
+        self._histograms = {} # (名称, 标签) -> [各桶计数 (最后一个为 +Inf), 总和, 次数]
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, _label_key(labels))
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            histogram[0][index] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
+
+    def timer(self, name, **labels):
+        return _Timer(self, name, labels)
+
+    def snapshot(self):
+        """当前值的拷贝：{'counters': [...], 'histograms': [...]}，直方图的桶为累计计数"""
+        with self._lock:
+            counters = [(name, labels, value) for (name, labels), value in self._counters.items()]
+            histograms = [(name, labels, list(h[0]), h[1], h[2]) for (name, labels), h in self._histograms.items()]
+        return {
+            'counters': [{'name': name, 'labels': dict(labels), 'value': value} for name, labels, value in sorted(counters)],
+            'histograms': [
+                {
+                    'name': name,
+                    'labels': dict(labels),
+                    'buckets': dict(zip([*map(str, self.buckets), '+Inf'], _cumulative(counts))),
+                    'sum': total,
+                    'count': count,
+                }
+                for name, labels, counts, total, count in sorted(histograms, key=lambda h: (h[0], h[1]))
+            ],
+        }
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+
+def _cumulative(counts):
+    total, result = 0, []
+    for count in counts:
+        total += count
+        result.append(total)
+    return result
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_metrics():
+    """当前进程的指标后端 (首次调用时按配置创建)"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                metrics_settings = get_metrics_settings()
+                if metrics_settings['ENABLED']:
+                    _backend = import_string(metrics_settings['BACKEND'])(buckets=metrics_settings['BUCKETS'])
+                else:
+                    _backend = NullMetrics()
+    return _backend
+
+
+@receiver(setting_changed)
+def _reset_backend(setting, **kwargs):
+    global _backend
+    if setting == 'WORKFLOW_METRICS':
+        _backend = None
+
+
+def timed(operation):
+    """记录被装饰的引擎入口方法的耗时 (workflow_operation_seconds{operation=...})"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with get_metrics().timer('workflow_operation_seconds', operation=operation):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def queue_depths():
+    """导出时查询的队列深度，均为索引上的 COUNT"""
+    open_tasks = WorkflowTask.objects.filter(status__in=OPEN_TASK_STATUSES)
+    return {
+        'jobs_pending': WorkflowJob.objects.filter(status=WorkflowJob.Status.PENDING).count(),
+        'tasks_open': open_tasks.count(),
+        'tasks_overdue': open_tasks.filter(timed_out_at__isnull=True, due_date__lte=timezone.now()).count(),
+        'instances_running': WorkflowInstance.objects.filter(status=WorkflowInstance.Status.RUNNING).count(),
+    }
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+
+def render_prometheus(snapshot, depths):
+    """Prometheus 文本格式 (0.0.4)"""
+    lines = []
+    described = set()
+
+    def describe(name, metric_type):
+        if name not in described:
+            described.add(name)
+            lines.append(f'# HELP {name} {HELP.get(name, name)}')
+            lines.append(f'# TYPE {name} {metric_type}')
+
+    for counter in snapshot['counters']:
+        describe(counter['name'], 'counter')
+        lines.append(f"{counter['name']}{_format_labels(counter['labels'])} {counter['value']}")
+    for histogram in snapshot['histograms']:
+        name, labels = histogram['name'], histogram['labels']
+        describe(name, 'histogram')
+        for bound, count in histogram['buckets'].items():
+            lines.append(f"{name}_bucket{_format_labels({**labels, 'le': bound})} {count}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {histogram['sum']}")
+        lines.append(f"{name}_count{_format_labels(labels)} {histogram['count']}")
+    describe('workflow_queue_depth', 'gauge')
+    for queue, depth in depths.items():
+        lines.append(f"workflow_queue_depth{_format_labels({'queue': queue})} {depth}")
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.7 on 2026-10-18 04:27
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workflows', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='workflowhistory',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='时间戳'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.1.7 on 2026-10-18 04:30
+
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workflows', '0002_history_timestamp_default'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WorkflowJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('node_id', models.CharField(max_length=255, verbose_name='节点 ID')),
+                ('job_type', models.CharField(choices=[('SERVICE_TASK', '服务任务'), ('NOTIFICATION', '通知')], max_length=20, verbose_name='作业类型')),
+                ('status', models.CharField(choices=[('PENDING', '待执行'), ('RUNNING', '执行中'), ('DONE', '已完成'), ('FAILED', '失败')], default='PENDING', max_length=20, verbose_name='状态')),
+                ('config', models.JSONField(blank=True, default=dict, verbose_name='节点配置')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='已尝试次数')),
+                ('max_attempts', models.PositiveIntegerField(default=5, verbose_name='最大尝试次数')),
+                ('timeout_seconds', models.PositiveIntegerField(default=30, verbose_name='单次执行超时 (秒)')),
+                ('available_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='可执行时间')),
+                ('locked_until', models.DateTimeField(blank=True, null=True, verbose_name='租约到期')),
+                ('locked_by', models.CharField(blank=True, default='', max_length=100, verbose_name='执行者')),
+                ('result', models.JSONField(blank=True, null=True, verbose_name='执行结果')),
+                ('last_error', models.TextField(blank=True, default='', verbose_name='最近错误')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+                ('instance', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='jobs', to='workflows.workflowinstance', verbose_name='关联实例')),
+            ],
+            options={
+                'verbose_name': '工作流异步作业',
+                'verbose_name_plural': '工作流异步作业',
+                'ordering': ('available_at',),
+                'indexes': [models.Index(fields=['status', 'available_at'], name='wf_job_status_available_idx'), models.Index(fields=['instance', 'node_id'], name='wf_job_instance_node_idx')],
+            },
+        ),
+    ]
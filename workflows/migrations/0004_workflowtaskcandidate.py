@@ -0,0 +1,58 @@
+# Generated by Django 5.1.7 on 2026-10-18 04:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_candidates(apps, schema_editor):
+    """为已有任务生成收件箱行：直接指派的用户 / 角色，以及 assigned_users 中的用户"""
+    WorkflowTask = apps.get_model('workflows', 'WorkflowTask')
+    WorkflowTaskCandidate = apps.get_model('workflows', 'WorkflowTaskCandidate')
+    AssignedUser = WorkflowTask.assigned_users.through
+
+    def flush(batch):
+        WorkflowTaskCandidate.objects.bulk_create(batch, ignore_conflicts=True)
+        batch.clear()
+
+    batch = []
+    tasks = WorkflowTask.objects.values_list('id', 'status', 'assignee_type', 'assignee_identifier', 'created_at')
+    for task_id, status, assignee_type, identifier, created_at in tasks.iterator(chunk_size=2000):
+        if assignee_type in ('USER', 'ROLE'):
+            principal = f"{assignee_type.lower()}:{identifier}"
+            batch.append(WorkflowTaskCandidate(task_id=task_id, principal=principal, status=status, created_at=created_at))
+        if len(batch) >= 2000:
+            flush(batch)
+
+    assigned = AssignedUser.objects.values_list('workflowtask_id', 'user_id', 'workflowtask__status', 'workflowtask__created_at')
+    for task_id, user_id, status, created_at in assigned.iterator(chunk_size=2000):
+        batch.append(WorkflowTaskCandidate(task_id=task_id, principal=f"user:{user_id}", status=status, created_at=created_at))
+        if len(batch) >= 2000:
+            flush(batch)
+    flush(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workflows', '0003_workflowjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WorkflowTaskCandidate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('principal', models.CharField(max_length=300, verbose_name='候选主体')),
+                ('status', models.CharField(choices=[('PENDING', '待处理'), ('ASSIGNED', '已分配'), ('COMPLETED', '已完成'), ('CANCELED', '已取消')], default='PENDING', max_length=20, verbose_name='任务状态')),
+                ('created_at', models.DateTimeField(verbose_name='任务创建时间')),
+                ('task', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='candidates', to='workflows.workflowtask', verbose_name='关联任务')),
+            ],
+            options={
+                'verbose_name': '任务候选处理人',
+                'verbose_name_plural': '任务候选处理人',
+                'indexes': [models.Index(fields=['principal', 'status', 'created_at'], name='wf_candidate_inbox_idx')],
+                'constraints': [models.UniqueConstraint(fields=('task', 'principal'), name='wf_task_candidate_unique')],
+            },
+        ),
+        migrations.RunPython(backfill_candidates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.1.7 on 2026-10-18 04:38
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workflows', '0004_workflowtaskcandidate'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='workflowtask',
+            name='timed_out_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='超时处理时间'),
+        ),
+        migrations.AddIndex(
+            model_name='workflowtask',
+            index=models.Index(fields=['status', 'timed_out_at', 'due_date'], name='wf_task_sla_queue_idx'),
+        ),
+    ]
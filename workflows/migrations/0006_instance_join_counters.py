@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-18 04:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workflows', '0005_task_sla_queue'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='workflowinstance',
+            name='join_counters',
+            field=models.JSONField(blank=True, default=dict, help_text='并行汇聚节点 ID -> 已到达的分支数', verbose_name='汇聚计数'),
+        ),
+    ]
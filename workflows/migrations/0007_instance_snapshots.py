@@ -0,0 +1,59 @@
+# Generated by Django 5.1.7 on 2026-10-18 04:47
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workflows', '0006_instance_join_counters'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WorkflowInstanceSnapshot',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('status', models.CharField(choices=[('PENDING', '待处理'), ('RUNNING', '运行中'), ('COMPLETED', '已完成'), ('FAILED', '失败'), ('CANCELED', '已取消'), ('SUSPENDED', '已暂停')], max_length=20, verbose_name='状态')),
+                ('payload', models.JSONField(default=dict, verbose_name='数据负载')),
+                ('current_node_ids', models.JSONField(default=list, verbose_name='当前节点ID')),
+                ('join_counters', models.JSONField(default=dict, verbose_name='汇聚计数')),
+                ('history_sequence', models.PositiveIntegerField(verbose_name='历史序号')),
+                ('last_event_timestamp', models.DateTimeField(blank=True, null=True, verbose_name='最后事件时间')),
+                ('last_event_id', models.UUIDField(blank=True, null=True, verbose_name='最后事件ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+            ],
+            options={
+                'verbose_name': '工作流实例快照',
+                'verbose_name_plural': '工作流实例快照',
+                'ordering': ('-history_sequence',),
+            },
+        ),
+        migrations.AddField(
+            model_name='workflowinstance',
+            name='events_since_snapshot',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='快照后事件数'),
+        ),
+        migrations.AlterField(
+            model_name='workflowhistory',
+            name='event_type',
+            field=models.CharField(choices=[('INSTANCE_STARTED', '实例已启动'), ('INSTANCE_COMPLETED', '实例已完成'), ('INSTANCE_FAILED', '实例失败'), ('INSTANCE_CANCELED', '实例已取消'), ('NODE_ENTERED', '进入节点'), ('NODE_EXITED', '离开节点'), ('TASK_CREATED', '任务已创建'), ('TASK_ASSIGNED', '任务已分配/认领'), ('TASK_COMPLETED', '任务已完成'), ('TASK_TIMED_OUT', '任务超时'), ('JOIN_ARRIVED', '分支到达汇聚节点'), ('COMMENT_ADDED', '评论已添加')], max_length=30, verbose_name='事件类型'),
+        ),
+        migrations.AddIndex(
+            model_name='workflowhistory',
+            index=models.Index(fields=['instance', 'timestamp', 'id'], name='wf_history_instance_ts_idx'),
+        ),
+        migrations.AddField(
+            model_name='workflowinstancesnapshot',
+            name='instance',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='workflows.workflowinstance', verbose_name='关联实例'),
+        ),
+        migrations.AddIndex(
+            model_name='workflowinstancesnapshot',
+            index=models.Index(fields=['instance', '-history_sequence'], name='wf_snapshot_latest_idx'),
+        ),
+    ]
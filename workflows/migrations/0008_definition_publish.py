@@ -0,0 +1,23 @@
+# Generated by Django 5.1.7 on 2026-10-18 04:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workflows', '0007_instance_snapshots'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='workflowdefinition',
+            name='compiled_json',
+            field=models.JSONField(blank=True, editable=False, null=True, verbose_name='编译形式'),
+        ),
+        migrations.AddField(
+            model_name='workflowdefinition',
+            name='published_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='发布时间'),
+        ),
+    ]
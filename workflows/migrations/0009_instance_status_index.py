@@ -0,0 +1,23 @@
+# Generated by Django 5.1.7 on 2026-10-18 04:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('workflows', '0008_definition_publish'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='workflowhistory',
+            name='event_type',
+            field=models.CharField(choices=[('INSTANCE_STARTED', '实例已启动'), ('INSTANCE_COMPLETED', '实例已完成'), ('INSTANCE_FAILED', '实例失败'), ('INSTANCE_CANCELED', '实例已取消'), ('INSTANCE_SUSPENDED', '实例已暂停'), ('NODE_ENTERED', '进入节点'), ('NODE_EXITED', '离开节点'), ('TASK_CREATED', '任务已创建'), ('TASK_ASSIGNED', '任务已分配/认领'), ('TASK_COMPLETED', '任务已完成'), ('TASK_TIMED_OUT', '任务超时'), ('JOIN_ARRIVED', '分支到达汇聚节点'), ('COMMENT_ADDED', '评论已添加')], max_length=30, verbose_name='事件类型'),
+        ),
+        migrations.AddIndex(
+            model_name='workflowinstance',
+            index=models.Index(fields=['status', 'id'], name='wf_instance_status_idx'),
+        ),
+    ]
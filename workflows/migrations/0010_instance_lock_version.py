@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-18 04:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workflows', '0009_instance_status_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='workflowinstance',
+            name='lock_version',
+            field=models.PositiveBigIntegerField(default=0, editable=False, verbose_name='版本号'),
+        ),
+    ]
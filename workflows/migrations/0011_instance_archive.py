@@ -0,0 +1,68 @@
+# Generated by Django 5.1.7 on 2026-10-18 05:06
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('workflows', '0010_instance_lock_version'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedWorkflowInstance',
+            fields=[
+                ('id', models.UUIDField(editable=False, primary_key=True, serialize=False)),
+                ('definition_name', models.CharField(max_length=255, verbose_name='定义名称')),
+                ('definition_version', models.PositiveIntegerField(verbose_name='定义版本')),
+                ('status', models.CharField(choices=[('PENDING', '待处理'), ('RUNNING', '运行中'), ('COMPLETED', '已完成'), ('FAILED', '失败'), ('CANCELED', '已取消'), ('SUSPENDED', '已暂停')], max_length=20, verbose_name='状态')),
+                ('started_at', models.DateTimeField(verbose_name='开始时间')),
+                ('completed_at', models.DateTimeField(blank=True, null=True, verbose_name='完成时间')),
+                ('object_id', models.UUIDField(blank=True, null=True, verbose_name='触发对象ID')),
+                ('task_count', models.PositiveIntegerField(default=0, verbose_name='任务数')),
+                ('event_count', models.PositiveIntegerField(default=0, verbose_name='历史事件数')),
+                ('document', models.BinaryField(verbose_name='归档文档')),
+                ('archived_at', models.DateTimeField(auto_now_add=True, verbose_name='归档时间')),
+            ],
+            options={
+                'verbose_name': '已归档工作流实例',
+                'verbose_name_plural': '已归档工作流实例',
+                'ordering': ('-started_at',),
+            },
+        ),
+        migrations.AddIndex(
+            model_name='workflowhistory',
+            index=models.Index(fields=['timestamp'], name='wf_history_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='workflowinstance',
+            index=models.Index(fields=['-started_at'], name='wf_instance_started_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='workflowinstance',
+            index=models.Index(fields=['status', 'completed_at'], name='wf_instance_archive_idx'),
+        ),
+        migrations.AddField(
+            model_name='archivedworkflowinstance',
+            name='content_type',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='contenttypes.contenttype', verbose_name='触发对象类型'),
+        ),
+        migrations.AddField(
+            model_name='archivedworkflowinstance',
+            name='definition',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='workflows.workflowdefinition', verbose_name='关联定义'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedworkflowinstance',
+            index=models.Index(fields=['-started_at'], name='wf_archived_started_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedworkflowinstance',
+            index=models.Index(fields=['content_type', 'object_id'], name='wf_archived_object_idx'),
+        ),
+    ]
@@ -1,12 +1,15 @@
 # workflows/models.py
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
 # from django.contrib.auth.models import User # 使用 settings.AUTH_USER_MODEL 代替
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 from django.utils.translation import gettext_lazy as _ # 用于模型字段的国际化
 import uuid
 
+from .graph import graph_cache
+
 # --- 工作流定义 ---
 class WorkflowDefinition(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -16,6 +19,11 @@ class WorkflowDefinition(models.Model):
     definition_json = models.JSONField(help_text=_("工作流图的 JSON 表示"))
     version = models.PositiveIntegerField(default=1, verbose_name=_("版本"))
     is_active = models.BooleanField(default=True, help_text=_("此定义是否可用于启动新实例"))
+    # 发布时校验并生成的编译形式 (见 graph.CompiledGraph.to_compiled)；运行时只使用它，
+    # 发布后对 definition_json 的修改在再次发布前不影响新启动或运行中的实例。
+    # 还有未结束的实例时不允许重新发布 (见 WorkflowEngine.publish_definition)
+    compiled_json = models.JSONField(null=True, blank=True, editable=False, verbose_name=_("编译形式"))
+    published_at = models.DateTimeField(null=True, blank=True, editable=False, verbose_name=_("发布时间"))
     created_at = models.DateTimeField(auto_now_add=True, verbose_name=_("创建时间"))
     updated_at = models.DateTimeField(auto_now=True, verbose_name=_("更新时间"))
 
@@ -28,6 +36,17 @@ class WorkflowDefinition(models.Model):
     def __str__(self):
         return f"{self.name} (v{self.version})"
 
+    def save(self, *args, **kwargs):
+        """保存后清除该定义在本进程中的编译图缓存"""
+        super().save(*args, **kwargs)
+        graph_cache.invalidate(self.pk)
+
+    def delete(self, *args, **kwargs):
+        definition_id = self.pk
+        result = super().delete(*args, **kwargs)
+        graph_cache.invalidate(definition_id)
+        return result
+
 # --- 工作流实例 ---
 class WorkflowInstance(models.Model):
     class Status(models.TextChoices):
@@ -46,6 +65,12 @@ class WorkflowInstance(models.Model):
     # 存储 definition_json 中当前活动节点的 ID 列表
     # 如果工作流具有并行路径，则可以是列表
     current_node_ids = models.JSONField(default=list, help_text=_("定义中活动节点的 ID 列表"), verbose_name=_("当前节点ID"))
+    # 并行汇聚节点的到达计数：{汇聚节点ID: 已到达的分支数}，随实例行一起在 select_for_update 下更新
+    join_counters = models.JSONField(default=dict, blank=True, help_text=_("并行汇聚节点 ID -> 已到达的分支数"), verbose_name=_("汇聚计数"))
+    # 上次快照之后记录的历史事件数 (近似值，只用于决定何时生成下一个快照)
+    events_since_snapshot = models.PositiveIntegerField(default=0, editable=False, verbose_name=_("快照后事件数"))
+    # 每次写入递增；乐观并发完成任务时以 UPDATE ... WHERE lock_version = 读取时的值 检测并发修改
+    lock_version = models.PositiveBigIntegerField(default=0, editable=False, verbose_name=_("版本号"))
     started_at = models.DateTimeField(auto_now_add=True, verbose_name=_("开始时间"))
     completed_at = models.DateTimeField(null=True, blank=True, verbose_name=_("完成时间"))
     # 可选：链接到触发此工作流的对象 (例如，一个 LeaveRequest)
@@ -57,10 +82,26 @@ class WorkflowInstance(models.Model):
         verbose_name = _("工作流实例")
         verbose_name_plural = _("工作流实例")
         ordering = ('-started_at',)
+        indexes = [
+            # 按状态分块扫描 (卡住实例检测等)：WHERE status = ? AND id > ? ORDER BY id
+            models.Index(fields=['status', 'id'], name='wf_instance_status_idx'),
+            # 列表的默认排序
+            models.Index(fields=['-started_at'], name='wf_instance_started_idx'),
+            # 归档扫描：WHERE status IN (...) AND completed_at < ?
+            models.Index(fields=['status', 'completed_at'], name='wf_instance_archive_idx'),
+        ]
 
     def __str__(self):
         return f"实例 {self.id} ({self.definition.name} v{self.definition.version}) - {self.get_status_display()}"
 
+    def save(self, *args, **kwargs):
+        """每次保存递增 lock_version，使读取了旧版本的乐观并发写入失败重试"""
+        self.lock_version += 1
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'lock_version'}
+        super().save(*args, **kwargs)
+
 # --- 工作流任务 (用户任务，如审批) ---
 class WorkflowTask(models.Model):
     class Status(models.TextChoices):
@@ -97,16 +138,61 @@ class WorkflowTask(models.Model):
     created_at = models.DateTimeField(auto_now_add=True, verbose_name=_("创建时间"))
     completed_at = models.DateTimeField(null=True, blank=True, verbose_name=_("完成时间"))
     completed_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name='+', verbose_name=_("完成人"))
+    # 超时动作触发的时间，为空表示尚未超时 (每个任务最多触发一次，见 workflows/scheduler.py)
+    timed_out_at = models.DateTimeField(null=True, blank=True, verbose_name=_("超时处理时间"))
 
     class Meta:
         verbose_name = _("工作流任务")
         verbose_name_plural = _("工作流任务")
         ordering = ('created_at',)
+        indexes = [
+            # SLA 调度队列：未完成且未超时的任务按截止时间范围扫描
+            models.Index(fields=['status', 'timed_out_at', 'due_date'], name='wf_task_sla_queue_idx'),
+        ]
 
     def __str__(self):
         return f"任务 {self.id} (实例 {self.instance.id}, 节点 {self.node_id}) - {self.get_status_display()}"
 
 
+# --- 任务候选处理人 (待办收件箱索引) ---
+class WorkflowTaskCandidate(models.Model):
+    """
+    WorkflowTask 的反规范化收件箱：每个可处理该任务的“主体”一行。
+    主体键为 'user:<用户ID>' 或 'role:<角色名>'，状态和创建时间与任务同步，
+    使“我的待办”成为 (principal, status, created_at) 复合索引上的范围扫描，
+    而不必在 WorkflowTask 上 OR 多个条件并 JOIN assigned_users。
+    由 WorkflowEngineService 在创建 / 分配 / 完成任务时维护。
+    """
+    USER_PREFIX = 'user:'
+    ROLE_PREFIX = 'role:'
+
+    task = models.ForeignKey(WorkflowTask, on_delete=models.CASCADE, related_name='candidates', verbose_name=_("关联任务"))
+    principal = models.CharField(max_length=300, verbose_name=_("候选主体"))
+    status = models.CharField(max_length=20, choices=WorkflowTask.Status.choices, default=WorkflowTask.Status.PENDING, verbose_name=_("任务状态"))
+    created_at = models.DateTimeField(verbose_name=_("任务创建时间"))
+
+    class Meta:
+        verbose_name = _("任务候选处理人")
+        verbose_name_plural = _("任务候选处理人")
+        constraints = [
+            models.UniqueConstraint(fields=['task', 'principal'], name='wf_task_candidate_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['principal', 'status', 'created_at'], name='wf_candidate_inbox_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.principal} -> 任务 {self.task_id} ({self.get_status_display()})"
+
+    @classmethod
+    def user_key(cls, user_id):
+        return f"{cls.USER_PREFIX}{user_id}"
+
+    @classmethod
+    def role_key(cls, role_name):
+        return f"{cls.ROLE_PREFIX}{role_name}"
+
+
 # --- 工作流历史记录 (可选但推荐用于审计) ---
 class WorkflowHistory(models.Model):
     class EventType(models.TextChoices):
@@ -114,12 +200,14 @@ class WorkflowHistory(models.Model):
         INSTANCE_COMPLETED = 'INSTANCE_COMPLETED', _('实例已完成')
         INSTANCE_FAILED = 'INSTANCE_FAILED', _('实例失败')
         INSTANCE_CANCELED = 'INSTANCE_CANCELED', _('实例已取消')
+        INSTANCE_SUSPENDED = 'INSTANCE_SUSPENDED', _('实例已暂停')
         NODE_ENTERED = 'NODE_ENTERED', _('进入节点')
         NODE_EXITED = 'NODE_EXITED', _('离开节点') # 通常在移动到下一个节点时
         TASK_CREATED = 'TASK_CREATED', _('任务已创建')
         TASK_ASSIGNED = 'TASK_ASSIGNED', _('任务已分配/认领')
         TASK_COMPLETED = 'TASK_COMPLETED', _('任务已完成')
         TASK_TIMED_OUT = 'TASK_TIMED_OUT', _('任务超时')
+        JOIN_ARRIVED = 'JOIN_ARRIVED', _('分支到达汇聚节点') # 汇聚节点尚未触发时的到达记录
         COMMENT_ADDED = 'COMMENT_ADDED', _('评论已添加') # 通用目的评论
 
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -127,7 +215,8 @@ class WorkflowHistory(models.Model):
     node_id = models.CharField(max_length=255, null=True, blank=True, help_text=_("相关的节点 ID，如果适用"), verbose_name=_("节点 ID"))
     task = models.ForeignKey(WorkflowTask, on_delete=models.SET_NULL, null=True, blank=True, related_name='history_logs', verbose_name=_("关联任务"))
     event_type = models.CharField(max_length=30, choices=EventType.choices, verbose_name=_("事件类型"))
-    timestamp = models.DateTimeField(auto_now_add=True, verbose_name=_("时间戳"))
+    # 不使用 auto_now_add：历史记录在事务内缓冲后批量写入，时间戳需在事件发生时确定
+    timestamp = models.DateTimeField(default=timezone.now, verbose_name=_("时间戳"))
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, help_text=_("触发事件的用户，如果适用"), verbose_name=_("用户"))
     # 存储额外细节，如评论、结果、评估的条件、错误消息
     details = models.JSONField(null=True, blank=True, verbose_name=_("详情"))
@@ -136,6 +225,127 @@ class WorkflowHistory(models.Model):
         verbose_name = _("工作流历史")
         verbose_name_plural = _("工作流历史")
         ordering = ('timestamp',)
+        indexes = [
+            # 按实例读取历史 (快照之后的尾部、游标分页) 都是此索引上的范围扫描
+            models.Index(fields=['instance', 'timestamp', 'id'], name='wf_history_instance_ts_idx'),
+            # 不限实例时的默认排序
+            models.Index(fields=['timestamp'], name='wf_history_ts_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.timestamp} - {self.instance.id} - {self.get_event_type_display()}"
+
+
+# --- 实例状态快照 ---
+class WorkflowInstanceSnapshot(models.Model):
+    """
+    实例运行状态的定期快照。重建状态时读取最新快照，再按 (timestamp, id) 顺序
+    折叠它之后的历史事件 (见 workflows/snapshots.py)，代价与快照后的事件数成正比，而不是实例的全部历史。
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    instance = models.ForeignKey(WorkflowInstance, on_delete=models.CASCADE, related_name='snapshots', verbose_name=_("关联实例"))
+    status = models.CharField(max_length=20, choices=WorkflowInstance.Status.choices, verbose_name=_("状态"))
+    payload = models.JSONField(default=dict, verbose_name=_("数据负载"))
+    current_node_ids = models.JSONField(default=list, verbose_name=_("当前节点ID"))
+    join_counters = models.JSONField(default=dict, verbose_name=_("汇聚计数"))
+    # 快照覆盖的历史事件序号 (该实例的第几条事件) 及最后一条事件的位置
+    history_sequence = models.PositiveIntegerField(verbose_name=_("历史序号"))
+    last_event_timestamp = models.DateTimeField(null=True, blank=True, verbose_name=_("最后事件时间"))
+    last_event_id = models.UUIDField(null=True, blank=True, verbose_name=_("最后事件ID"))
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name=_("创建时间"))
+
+    class Meta:
+        verbose_name = _("工作流实例快照")
+        verbose_name_plural = _("工作流实例快照")
+        ordering = ('-history_sequence',)
+        indexes = [
+            models.Index(fields=['instance', '-history_sequence'], name='wf_snapshot_latest_idx'),
+        ]
+
+    def __str__(self):
+        return f"实例 {self.instance_id} 快照 #{self.history_sequence}"
+
+# --- 异步作业 (outbox) ---
+class WorkflowJob(models.Model):
+    """
+    服务任务 / 通知节点的待执行作业。
+    引擎在推进实例的同一事务中写入，事务提交后由 run_workflow_worker 命令领取执行，
+    执行结果再通过 advance_workflow 回写实例，避免慢速外部调用占用实例行锁。
+    """
+    class JobType(models.TextChoices):
+        SERVICE_TASK = 'SERVICE_TASK', _('服务任务')
+        NOTIFICATION = 'NOTIFICATION', _('通知')
+
+    class Status(models.TextChoices):
+        PENDING = 'PENDING', _('待执行') # 等待领取 (含等待重试)
+        RUNNING = 'RUNNING', _('执行中')
+        DONE = 'DONE', _('已完成')
+        FAILED = 'FAILED', _('失败') # 重试次数用尽
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    instance = models.ForeignKey(WorkflowInstance, on_delete=models.CASCADE, related_name='jobs', verbose_name=_("关联实例"))
+    node_id = models.CharField(max_length=255, verbose_name=_("节点 ID"))
+    job_type = models.CharField(max_length=20, choices=JobType.choices, verbose_name=_("作业类型"))
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.PENDING, verbose_name=_("状态"))
+    # 入队时节点的配置快照，执行时不再读取定义
+    config = models.JSONField(default=dict, blank=True, verbose_name=_("节点配置"))
+    attempts = models.PositiveIntegerField(default=0, verbose_name=_("已尝试次数"))
+    max_attempts = models.PositiveIntegerField(default=5, verbose_name=_("最大尝试次数"))
+    timeout_seconds = models.PositiveIntegerField(default=30, verbose_name=_("单次执行超时 (秒)"))
+    # 下次可被领取的时间 (用于重试退避)
+    available_at = models.DateTimeField(default=timezone.now, verbose_name=_("可执行时间"))
+    # 领取后的租约到期时间，过期仍为 RUNNING 说明执行者已崩溃，可被重新领取
+    locked_until = models.DateTimeField(null=True, blank=True, verbose_name=_("租约到期"))
+    locked_by = models.CharField(max_length=100, blank=True, default='', verbose_name=_("执行者"))
+    result = models.JSONField(null=True, blank=True, verbose_name=_("执行结果"))
+    last_error = models.TextField(blank=True, default='', verbose_name=_("最近错误"))
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name=_("创建时间"))
+    updated_at = models.DateTimeField(auto_now=True, verbose_name=_("更新时间"))
+
+    class Meta:
+        verbose_name = _("工作流异步作业")
+        verbose_name_plural = _("工作流异步作业")
+        ordering = ('available_at',)
+        indexes = [
+            # 领取待执行作业：WHERE status = 'PENDING' AND available_at <= now ORDER BY available_at
+            models.Index(fields=['status', 'available_at'], name='wf_job_status_available_idx'),
+            models.Index(fields=['instance', 'node_id'], name='wf_job_instance_node_idx'),
+        ]
+
+    def __str__(self):
+        return f"作业 {self.id} ({self.get_job_type_display()}, 实例 {self.instance_id}, 节点 {self.node_id}) - {self.get_status_display()}"
+
+
+# --- 已归档的实例 ---
+class ArchivedWorkflowInstance(models.Model):
+    """
+    已结束实例的归档 (见 workflows/archive.py)：实例、任务和历史从热表中删除，
+    整体序列化为一个 zlib 压缩的 JSON 文档存在 document 中；列表需要的字段单独存放并建立索引。
+    主键沿用原实例 ID。
+    """
+    id = models.UUIDField(primary_key=True, editable=False)
+    definition = models.ForeignKey(WorkflowDefinition, on_delete=models.SET_NULL, null=True, blank=True, related_name='+', verbose_name=_("关联定义"))
+    definition_name = models.CharField(max_length=255, verbose_name=_("定义名称"))
+    definition_version = models.PositiveIntegerField(verbose_name=_("定义版本"))
+    status = models.CharField(max_length=20, choices=WorkflowInstance.Status.choices, verbose_name=_("状态"))
+    started_at = models.DateTimeField(verbose_name=_("开始时间"))
+    completed_at = models.DateTimeField(null=True, blank=True, verbose_name=_("完成时间"))
+    content_type = models.ForeignKey(ContentType, on_delete=models.SET_NULL, null=True, blank=True, related_name='+', verbose_name=_("触发对象类型"))
+    object_id = models.UUIDField(null=True, blank=True, verbose_name=_("触发对象ID"))
+    task_count = models.PositiveIntegerField(default=0, verbose_name=_("任务数"))
+    event_count = models.PositiveIntegerField(default=0, verbose_name=_("历史事件数"))
+    # {"instance": {...}, "tasks": [...], "history": [...]} 的 zlib 压缩 JSON
+    document = models.BinaryField(verbose_name=_("归档文档"))
+    archived_at = models.DateTimeField(auto_now_add=True, verbose_name=_("归档时间"))
+
+    class Meta:
+        verbose_name = _("已归档工作流实例")
+        verbose_name_plural = _("已归档工作流实例")
+        ordering = ('-started_at',)
+        indexes = [
+            models.Index(fields=['-started_at'], name='wf_archived_started_idx'),
+            models.Index(fields=['content_type', 'object_id'], name='wf_archived_object_idx'),
+        ]
 
     def __str__(self):
-        return f"{self.timestamp} - {self.instance.id} - {self.get_event_type_display()}"
\ No newline at end of file
+        return f"已归档实例 {self.id} ({self.definition_name} v{self.definition_version}) - {self.get_status_display()}"
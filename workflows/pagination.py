@@ -0,0 +1,94 @@
+# workflows/pagination.py
+"""
+实例历史的键集 (keyset) 游标分页，以及已归档实例列表的游标分页。
+
+历史按 (timestamp, id) 排序，游标记录上一页最后一条事件的 (timestamp, id)，
+下一页是 (instance, timestamp, id) 索引上从该位置开始的范围扫描：
+与 OFFSET 不同，翻到第几页的代价都一样，也不会因为翻页期间新写入事件而重复或遗漏。
+"""
+import base64
+import binascii
+import uuid
+
+from django.utils.dateparse import parse_datetime
+from django.utils.translation import gettext as _
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, CursorPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from .snapshots import events_after
+
+
+def encode_cursor(timestamp, event_id):
+    raw = f"{timestamp.isoformat()}|{event_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """解析游标为 (timestamp, id)；格式不正确时抛出 ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        timestamp, event_id = raw.split('|')
+        timestamp = parse_datetime(timestamp)
+        event_id = uuid.UUID(event_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError) as e:
+        raise ValueError(cursor) from e
+    if timestamp is None:
+        raise ValueError(cursor)
+    return timestamp, event_id
+
+
+class HistoryCursorPagination(BasePagination):
+    """
+    ?cursor=<上一页返回的 next 中的游标>&page_size=<条数>
+    响应 {"next": 下一页 URL 或 null, "results": [...]}
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    page_size = 100
+    max_page_size = 1000
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def get_position(self, request):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None
+        try:
+            return decode_cursor(cursor)
+        except ValueError:
+            raise NotFound(_("无效的游标"))
+
+    def paginate_instance_history(self, instance_id, request):
+        """返回本页的 WorkflowHistory 列表"""
+        self.request = request
+        page_size = self.get_page_size(request)
+        events = events_after(instance_id, self.get_position(request)).select_related('user')
+        page = list(events[:page_size + 1]) # 多取一条判断是否还有下一页
+        self.has_next = len(page) > page_size
+        self.page = page[:page_size]
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        last = self.page[-1]
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, encode_cursor(last.timestamp, last.id))
+
+    def get_paginated_response(self, data):
+        return Response({'next': self.get_next_link(), 'results': data})
+
+
+class ArchivedInstanceCursorPagination(CursorPagination):
+    """已归档实例列表：按开始时间倒序，走 (-started_at) 索引的游标分页"""
+    ordering = '-started_at'
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
@@ -0,0 +1,122 @@
+# workflows/repair.py
+"""
+卡住的实例检测。
+
+实例处于 RUNNING，但 current_node_ids 中没有任何一个节点在等待可推进它的东西：
+- 用户任务节点：没有未完成的 WorkflowTask；
+- 服务任务 / 通知节点：没有待执行或执行中的 WorkflowJob；
+- 决策等自动节点停留在活动节点中 (没有满足条件的路径且无默认路径)；
+- 活动节点已不在定义中 (定义被修改)，或者根本没有活动节点。
+这样的实例不会再被任何任务、作业或调度器推进。
+
+扫描按 (status, id) 索引分块进行，每块只读取实例的 ID、定义 ID 和活动节点，
+再各用一条 IN 查询取出这块实例的未完成任务和待执行作业，内存占用与总行数无关。
+修复 (暂停 / 重试 / 失败) 由 workflow_engine 在加锁后重新判定，见 services.py。
+"""
+from .graph import NodeType, get_compiled_graph
+from .models import WorkflowDefinition, WorkflowInstance, WorkflowJob, WorkflowTask
+from .scheduler import OPEN_TASK_STATUSES
+
+DEFAULT_CHUNK_SIZE = 1000
+OPEN_JOB_STATUSES = (WorkflowJob.Status.PENDING, WorkflowJob.Status.RUNNING)
+
+
+class StuckReason:
+    NO_ACTIVE_NODES = 'NO_ACTIVE_NODES'   # 没有活动节点
+    MISSING_NODE = 'MISSING_NODE'         # 活动节点不在定义中
+    MISSING_TASK = 'MISSING_TASK'         # 用户任务节点没有未完成的任务
+    MISSING_JOB = 'MISSING_JOB'           # 服务任务 / 通知节点没有待执行的作业
+    STALLED_NODE = 'STALLED_NODE'         # 决策等自动节点停在活动节点中
+
+    labels = {
+        NO_ACTIVE_NODES: '没有活动节点',
+        MISSING_NODE: '活动节点不在定义中',
+        MISSING_TASK: '缺少未完成的任务',
+        MISSING_JOB: '缺少待执行的作业',
+        STALLED_NODE: '自动节点无法继续 (例如决策节点没有可走的路径)',
+    }
+
+
+class _GraphLoader:
+    """一次扫描中按定义 ID 缓存编译图，每块只查询尚未加载的定义"""
+
+    def __init__(self):
+        self._graphs = {}
+
+    def load(self, definition_ids):
+        missing = set(definition_ids) - set(self._graphs)
+        if missing:
+            for definition in WorkflowDefinition.objects.filter(pk__in=missing):
+                self._graphs[definition.pk] = get_compiled_graph(definition)
+        return self._graphs
+
+
+def _node_reason(graph, node_id, waiting):
+    node_type = graph.node_type(node_id)
+    if graph.node(node_id) is None:
+        return StuckReason.MISSING_NODE
+    if node_type.is_user_task:
+        return None if waiting else StuckReason.MISSING_TASK
+    if node_type in (NodeType.SERVICE_TASK, NodeType.NOTIFICATION):
+        return None if waiting else StuckReason.MISSING_JOB
+    return StuckReason.STALLED_NODE
+
+
+def classify_instances(rows, graph_loader=None):
+    """
+    rows 为 (实例ID, 定义ID, current_node_ids) 序列。
+    返回 {实例ID: {节点ID 或 None: 原因}}，只包含卡住的实例：
+    只要有一个活动节点还在等待任务或作业，实例就不算卡住。
+    """
+    rows = list(rows)
+    if not rows:
+        return {}
+    instance_ids = [row[0] for row in rows]
+    waiting = set(
+        WorkflowTask.objects.filter(instance_id__in=instance_ids, status__in=OPEN_TASK_STATUSES)
+        .values_list('instance_id', 'node_id').distinct()
+    )
+    waiting.update(
+        WorkflowJob.objects.filter(instance_id__in=instance_ids, status__in=OPEN_JOB_STATUSES)
+        .values_list('instance_id', 'node_id').distinct()
+    )
+    graphs = (graph_loader or _GraphLoader()).load({row[1] for row in rows})
+
+    stuck = {}
+    for instance_id, definition_id, current_node_ids in rows:
+        if not current_node_ids:
+            stuck[instance_id] = {None: StuckReason.NO_ACTIVE_NODES}
+            continue
+        graph = graphs.get(definition_id)
+        reasons = {}
+        for node_id in current_node_ids:
+            reason = _node_reason(graph, node_id, (instance_id, node_id) in waiting)
+            if reason is None:
+                break # 仍在等待任务或作业，不算卡住
+            reasons[node_id] = reason
+        else:
+            stuck[instance_id] = reasons
+    return stuck
+
+
+def iter_stuck_instances(chunk_size=DEFAULT_CHUNK_SIZE, statuses=(WorkflowInstance.Status.RUNNING,), definition_id=None):
+    """
+    按 (status, id) 键集分块扫描，逐块产出 (本块扫描的实例数, {实例ID: {节点ID: 原因}})。
+    调用方可以在两块之间处理上一块的结果。
+    """
+    graph_loader = _GraphLoader()
+    for status in statuses:
+        last_id = None
+        while True:
+            rows = WorkflowInstance.objects.filter(status=status)
+            if definition_id is not None:
+                rows = rows.filter(definition_id=definition_id)
+            if last_id is not None:
+                rows = rows.filter(pk__gt=last_id)
+            rows = list(rows.order_by('pk').values_list('id', 'definition_id', 'current_node_ids')[:chunk_size])
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            yield len(rows), classify_instances(rows, graph_loader)
+            if len(rows) < chunk_size:
+                break
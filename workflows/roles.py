@@ -0,0 +1,68 @@
+# workflows/roles.py
+"""
+用户角色集合缓存。
+
+工作流中的“角色”即 Django Group 名称。权限检查和待办查询每个请求都需要当前用户的角色集合，
+这里把它缓存在 Django cache 中 (默认 LocMemCache，多进程部署时请配置共享缓存)。
+
+失效策略:
+- 用户一侧修改 user.groups (add/remove/clear)：只删除该用户的缓存项；
+- 组一侧修改 group.user_set、重命名或删除组：递增全局代号，所有用户的缓存项随之失效。
+"""
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+ROLE_CACHE_TIMEOUT = 300 # 秒，兜底过期时间 (例如绕过 ORM 直接改库的情况)
+_GENERATION_KEY = 'workflows:roles:generation'
+
+
+def _generation():
+    return cache.get_or_set(_GENERATION_KEY, 1, None)
+
+
+def _cache_key(user_id):
+    return f"workflows:roles:{_generation()}:{user_id}"
+
+
+def get_user_role_names(user):
+    """返回用户所属角色名称的 frozenset，命中缓存时不查询数据库"""
+    if user is None or not user.is_authenticated:
+        return frozenset()
+    key = _cache_key(user.pk)
+    role_names = cache.get(key)
+    if role_names is None:
+        role_names = frozenset(user.groups.values_list('name', flat=True))
+        cache.set(key, role_names, ROLE_CACHE_TIMEOUT)
+    return role_names
+
+
+def invalidate_user_roles(user_id):
+    cache.delete(_cache_key(user_id))
+
+
+def invalidate_all_user_roles():
+    try:
+        cache.incr(_GENERATION_KEY)
+    except ValueError: # 代号已被淘汰
+        cache.set(_GENERATION_KEY, 2, None)
+
+
+@receiver(m2m_changed, sender=get_user_model().groups.through)
+def user_groups_changed(sender, instance, action, reverse, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        # instance 是 Group，受影响的用户可能很多 (post_clear 时甚至拿不到用户 ID)
+        invalidate_all_user_roles()
+    else:
+        invalidate_user_roles(instance.pk)
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def group_changed(sender, instance, created=False, **kwargs):
+    if not created: # 新建的组还没有成员
+        invalidate_all_user_roles()
@@ -0,0 +1,311 @@
+# workflows/rules.py
+"""
+决策节点连接线条件的编译与求值。
+
+条件是一个受限的表达式语言，例如:
+    payload.leave.days > 3 and payload.leave_type in ['annual', 'sick']
+    not (payload.amount * 1.1 >= 1000 or payload.status == 'urgent')
+
+支持: and / or / not、括号、比较 (== != < <= > >=，可链式)、in / not in、
+四则运算 (+ - * / // %)、数字/字符串/布尔/空值字面量、列表/元组、
+payload 的嵌套路径 (payload.a.b 或 payload['a']['b'])。
+
+实现上借用 Python 的 ast 解析，再按白名单把语法树编译成闭包；
+任何不在白名单中的语法 (函数调用、属性访问非 payload 路径、lambda 等) 都会被拒绝，不会执行任意代码。
+编译结果按条件字符串做 LRU 缓存，热路径上只有一次字典查找加一次函数调用。
+"""
+import ast
+import operator
+from functools import lru_cache
+
+
+class RuleSyntaxError(ValueError):
+    """条件表达式不合法"""
+
+
+_MISSING = None # 路径不存在时的取值
+
+_LITERAL_NAMES = {
+    'True': True, 'true': True,
+    'False': False, 'false': False,
+    'None': None, 'null': None,
+}
+
+
+def _as_number(value):
+    """数字或数字字符串转为数字，否则返回 None (布尔值不参与数字转换)"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, str):
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return None
+
+
+def _coerce_pair(left, right):
+    """
+    相等比较的类型转换，与旧版求值器一致：两边都能转成数字时按数字比较 ('5' == 5 为真)，
+    否则若一边是字符串，则按字符串比较。
+    """
+    num_left, num_right = _as_number(left), _as_number(right)
+    if num_left is not None and num_right is not None:
+        return num_left, num_right
+    if isinstance(left, str) and right is not None and not isinstance(right, (list, tuple, dict)):
+        return left, str(right)
+    if isinstance(right, str) and left is not None and not isinstance(left, (list, tuple, dict)):
+        return str(left), right
+    return left, right
+
+
+def _eq(left, right):
+    left, right = _coerce_pair(left, right)
+    return left == right
+
+
+def _not_eq(left, right):
+    """与旧版求值器一致：任一边为空值 (包括 payload 中缺失的字段) 时不等比较也不成立"""
+    if left is None or right is None:
+        return False
+    return not _eq(left, right)
+
+
+def _ordering(op):
+    """
+    大小比较只在两边都能转成数字 (按数字比较) 或都是字符串时进行，
+    否则不成立 ('high' > 3、'10,000' > 5000 均为假；旧版对非数字的大小比较恒为假)
+    """
+    def compare(left, right):
+        num_left, num_right = _as_number(left), _as_number(right)
+        if num_left is not None and num_right is not None:
+            return op(num_left, num_right)
+        if isinstance(left, str) and isinstance(right, str):
+            return op(left, right)
+        return False
+    return compare
+
+
+def _contains(item, container):
+    if container is None:
+        return False
+    if isinstance(container, str):
+        return isinstance(item, str) and item in container
+    try:
+        return item in container
+    except TypeError:
+        return False
+
+
+_COMPARE_OPS = {
+    ast.Eq: _eq,
+    ast.NotEq: _not_eq,
+    ast.Lt: _ordering(operator.lt),
+    ast.LtE: _ordering(operator.le),
+    ast.Gt: _ordering(operator.gt),
+    ast.GtE: _ordering(operator.ge),
+    ast.In: _contains,
+    ast.NotIn: lambda item, container: not _contains(item, container),
+}
+
+
+def _arithmetic(op, symbol):
+    def apply(left, right):
+        num_left, num_right = _as_number(left), _as_number(right)
+        if num_left is None or num_right is None:
+            raise TypeError(f"运算符 {symbol} 只支持数字：{left!r} {symbol} {right!r}")
+        return op(num_left, num_right)
+    return apply
+
+
+_BINARY_OPS = {
+    ast.Add: _arithmetic(operator.add, '+'),
+    ast.Sub: _arithmetic(operator.sub, '-'),
+    ast.Mult: _arithmetic(operator.mul, '*'),
+    ast.Div: _arithmetic(operator.truediv, '/'),
+    ast.FloorDiv: _arithmetic(operator.floordiv, '//'),
+    ast.Mod: _arithmetic(operator.mod, '%'),
+}
+
+
+def _path_of(node):
+    """把 payload.a.b / payload['a'][0] 解析为 ('a', 'b') / ('a', 0)，非 payload 路径返回 None"""
+    keys = []
+    while True:
+        if isinstance(node, ast.Attribute):
+            if node.attr.startswith('__'):
+                raise RuleSyntaxError(f"不允许访问双下划线属性：{node.attr}")
+            keys.append(node.attr)
+            node = node.value
+        elif isinstance(node, ast.Subscript):
+            key = node.slice
+            if not isinstance(key, ast.Constant) or not isinstance(key.value, (str, int)) or isinstance(key.value, bool):
+                raise RuleSyntaxError("payload 下标只能是字符串或整数常量")
+            keys.append(key.value)
+            node = node.value
+        elif isinstance(node, ast.Name) and node.id == 'payload':
+            return tuple(reversed(keys))
+        else:
+            return None
+
+
+def _compile_path(keys):
+    def resolve(payload):
+        value = payload
+        for key in keys:
+            if isinstance(value, dict):
+                value = value.get(key, _MISSING)
+            elif isinstance(value, (list, tuple)) and isinstance(key, int):
+                value = value[key] if -len(value) <= key < len(value) else _MISSING
+            else:
+                return _MISSING
+            if value is _MISSING:
+                return _MISSING
+        return value
+    return resolve
+
+
+def _compile_node(node):
+    if isinstance(node, ast.Expression):
+        return _compile_node(node.body)
+
+    if isinstance(node, ast.Constant):
+        if not isinstance(node.value, (str, int, float, bool, type(None))):
+            raise RuleSyntaxError(f"不支持的字面量：{node.value!r}")
+        value = node.value
+        return lambda payload: value
+
+    if isinstance(node, ast.Name):
+        if node.id == 'payload':
+            return lambda payload: payload
+        if node.id in _LITERAL_NAMES:
+            value = _LITERAL_NAMES[node.id]
+            return lambda payload: value
+        raise RuleSyntaxError(f"未知名称 '{node.id}'，字段请写作 payload.{node.id}，字符串请加引号")
+
+    if isinstance(node, (ast.Attribute, ast.Subscript)):
+        keys = _path_of(node)
+        if keys is None:
+            raise RuleSyntaxError("只允许访问 payload 下的字段")
+        return _compile_path(keys)
+
+    if isinstance(node, (ast.List, ast.Tuple, ast.Set)):
+        items = [_compile_node(elt) for elt in node.elts]
+        if all(isinstance(elt, ast.Constant) for elt in node.elts):
+            constant = tuple(elt.value for elt in node.elts)
+            return lambda payload: constant
+        return lambda payload: tuple(item(payload) for item in items)
+
+    if isinstance(node, ast.BoolOp):
+        operands = [_compile_node(value) for value in node.values]
+        if isinstance(node.op, ast.And):
+            def evaluate_and(payload):
+                result = True
+                for operand in operands:
+                    result = operand(payload)
+                    if not result:
+                        return result
+                return result
+            return evaluate_and
+
+        def evaluate_or(payload):
+            result = False
+            for operand in operands:
+                result = operand(payload)
+                if result:
+                    return result
+            return result
+        return evaluate_or
+
+    if isinstance(node, ast.UnaryOp):
+        operand = _compile_node(node.operand)
+        if isinstance(node.op, ast.Not):
+            return lambda payload: not operand(payload)
+        if isinstance(node.op, (ast.USub, ast.UAdd)):
+            sign = -1 if isinstance(node.op, ast.USub) else 1
+
+            def evaluate_sign(payload):
+                value = _as_number(operand(payload))
+                if value is None:
+                    raise TypeError("正负号只能用于数字")
+                return sign * value
+            return evaluate_sign
+        raise RuleSyntaxError(f"不支持的一元运算符：{type(node.op).__name__}")
+
+    if isinstance(node, ast.BinOp):
+        apply = _BINARY_OPS.get(type(node.op))
+        if apply is None:
+            raise RuleSyntaxError(f"不支持的运算符：{type(node.op).__name__}")
+        left, right = _compile_node(node.left), _compile_node(node.right)
+        return lambda payload: apply(left(payload), right(payload))
+
+    if isinstance(node, ast.Compare):
+        first = _compile_node(node.left)
+        steps = []
+        for op, comparator in zip(node.ops, node.comparators):
+            compare = _COMPARE_OPS.get(type(op))
+            if compare is None:
+                raise RuleSyntaxError(f"不支持的比较运算符：{type(op).__name__}")
+            steps.append((compare, _compile_node(comparator)))
+
+        def evaluate_compare(payload):
+            left = first(payload)
+            for compare, right_fn in steps:
+                right = right_fn(payload)
+                if not compare(left, right):
+                    return False
+                left = right
+            return True
+        return evaluate_compare
+
+    raise RuleSyntaxError(f"不支持的语法：{type(node).__name__}")
+
+
+def parse_condition(condition_string):
+    """
+    严格编译条件字符串，语法错误时抛出 RuleSyntaxError (不缓存)。
+    返回 callable(payload) -> bool。空条件恒为真。
+    """
+    if condition_string is None or not condition_string.strip():
+        return lambda payload: True
+    try:
+        tree = ast.parse(condition_string.strip(), mode='eval')
+    except SyntaxError as e:
+        raise RuleSyntaxError(f"条件 '{condition_string}' 语法错误：{e.msg}") from e
+    evaluate = _compile_node(tree)
+    return lambda payload: bool(evaluate(payload if payload is not None else {}))
+
+
+def _always_false(payload):
+    return False
+
+
+@lru_cache(maxsize=2048)
+def compile_condition(condition_string):
+    """
+    编译并缓存条件。非法条件只在首次编译时告警一次，之后恒为假 (与旧版“不支持的格式返回 False”一致)。
+    """
+    try:
+        return parse_condition(condition_string)
+    except RuleSyntaxError as e:
+        print(f"警告：{e}")
+        return _always_false
+
+
+# --- 规则评估器 ---
+class RuleEvaluator:
+    def evaluate(self, condition_string, payload):
+        try:
+            return compile_condition(condition_string)(payload)
+        except Exception as e:
+            # 运行期错误 (例如对非数字做算术) 视为条件不满足
+            print(f"错误：评估条件 '{condition_string}' 时出错：{e}")
+            return False
+
+    def validate(self, condition_string):
+        """检查条件是否可编译，不合法时抛出 RuleSyntaxError"""
+        parse_condition(condition_string)
+
+rule_evaluator = RuleEvaluator()
@@ -0,0 +1,189 @@
+# workflows/scheduler.py
+"""
+用户任务的超时 (SLA) 调度。
+
+审批节点配置 timeoutDuration 后，_create_task 据此计算 WorkflowTask.due_date。
+run_sla_scheduler 命令常驻运行 SlaScheduler：
+- 按 (status, timed_out_at, due_date) 索引只读取“未来 HORIZON 秒内到期”的任务，放入按截止时间排序的最小堆；
+- 主循环睡到堆顶截止时间 (或下一次刷新) 为止，到期后成批交给 workflow_engine.handle_task_timeouts；
+- 每 REFRESH_INTERVAL 秒做一次增量刷新：把时间窗口向后推进，并补上刚创建、截止时间已落在窗口内的任务。
+任务被提前完成不需要通知调度器：堆中的过期条目在处理时由数据库条件过滤掉。
+
+超时动作 (节点配置 timeoutAction)：NOTIFY 提醒、AUTO_APPROVE 自动批准、AUTO_REJECT 自动驳回、
+ESCALATE 上报 (改派给 escalateToType / escalateToIdentifier)。每个任务最多触发一次超时动作。
+"""
+import heapq
+import re
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+from django.utils import timezone
+
+from .models import WorkflowTask
+
+# 可在 settings.WORKFLOW_SCHEDULER 中覆盖
+DEFAULT_SCHEDULER_SETTINGS = {
+    'HORIZON': 600,             # 预读未来多少秒内到期的任务
+    'REFRESH_INTERVAL': 0.5,    # 增量刷新间隔 (秒)，决定新建短时限任务的最大发现延迟
+    'BATCH_SIZE': 200,          # 每批处理的到期任务数
+    'CATCH_UP_GRACE': 5,        # 增量刷新按创建时间回看的冗余秒数 (容忍事务提交延迟)
+}
+
+OPEN_TASK_STATUSES = (WorkflowTask.Status.PENDING, WorkflowTask.Status.ASSIGNED)
+
+
+class TimeoutAction:
+    NOTIFY = 'NOTIFY'
+    AUTO_APPROVE = 'AUTO_APPROVE'
+    AUTO_REJECT = 'AUTO_REJECT'
+    ESCALATE = 'ESCALATE'
+
+    choices = (NOTIFY, AUTO_APPROVE, AUTO_REJECT, ESCALATE)
+
+
+def get_scheduler_settings():
+    return {**DEFAULT_SCHEDULER_SETTINGS, **getattr(settings, 'WORKFLOW_SCHEDULER', {})}
+
+
+_DURATION_PATTERN = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*([smhd]?)\s*$', re.IGNORECASE)
+_DURATION_UNITS = {'': 1, 's': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_duration(value):
+    """
+    解析节点配置中的 timeoutDuration：数字表示秒 (与设计器一致)，
+    也接受 '30m'、'4h'、'2d' 这样的写法。0 或空值表示不限时，返回 None。
+    """
+    if value in (None, '', 0):
+        return None
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        seconds = float(value)
+    else:
+        match = _DURATION_PATTERN.match(str(value))
+        if not match:
+            print(f"警告：无法解析超时时长 '{value}'，忽略。")
+            return None
+        seconds = float(match.group(1)) * _DURATION_UNITS[match.group(2).lower()]
+    return timedelta(seconds=seconds) if seconds > 0 else None
+
+
+def compute_due_date(config, start=None):
+    duration = parse_duration(config.get('timeoutDuration'))
+    if duration is None:
+        return None
+    return (start or timezone.now()) + duration
+
+
+class SlaScheduler:
+    """
+    单进程调度器。堆中元素为 (due_date, task_id)；已完成或已被其他调度进程处理的任务
+    在 handle_task_timeouts 中按数据库状态过滤，因此堆中的过期条目无害。
+    """
+
+    def __init__(self, horizon=None, refresh_interval=None, batch_size=None, log=print):
+        scheduler_settings = get_scheduler_settings()
+        self.horizon = timedelta(seconds=horizon or scheduler_settings['HORIZON'])
+        self.refresh_interval = refresh_interval or scheduler_settings['REFRESH_INTERVAL']
+        self.batch_size = batch_size or scheduler_settings['BATCH_SIZE']
+        self.catch_up_grace = timedelta(seconds=scheduler_settings['CATCH_UP_GRACE'])
+        self.log = log
+        self._heap = []
+        self._queued = set()
+        self._loaded_until = None   # 堆中已覆盖到的截止时间上界
+        self._last_refresh = None   # 上次刷新开始的时间 (增量补漏的起点)
+        self._stop = threading.Event()
+
+    def stop(self):
+        self._stop.set()
+
+    def _open_tasks(self):
+        return WorkflowTask.objects.filter(status__in=OPEN_TASK_STATUSES, timed_out_at__isnull=True, due_date__isnull=False)
+
+    def _push(self, rows):
+        for task_id, due_date in rows:
+            if task_id not in self._queued:
+                self._queued.add(task_id)
+                heapq.heappush(self._heap, (due_date, task_id))
+
+    def refresh(self, now=None):
+        """把 (loaded_until, now + horizon] 内到期的任务和刚创建的短时限任务加入堆，返回新增数量"""
+        now = now or timezone.now()
+        window_end = now + self.horizon
+        before = len(self._heap)
+        if self._loaded_until is None:
+            # 首次加载：包括所有已经过期但尚未处理的任务
+            self._push(self._open_tasks().filter(due_date__lte=window_end).values_list('id', 'due_date').iterator())
+        else:
+            self._push(
+                self._open_tasks().filter(due_date__gt=self._loaded_until, due_date__lte=window_end)
+                .values_list('id', 'due_date').iterator()
+            )
+            # 上次刷新之后新建、截止时间已在已加载窗口内的任务 (范围扫描被限制在窗口内)
+            self._push(
+                self._open_tasks().filter(
+                    due_date__lte=self._loaded_until, created_at__gte=self._last_refresh - self.catch_up_grace
+                ).values_list('id', 'due_date').iterator()
+            )
+        self._loaded_until = window_end
+        self._last_refresh = now
+        return len(self._heap) - before
+
+    def pop_due(self, now=None):
+        """弹出最多 batch_size 个已到期的任务 ID"""
+        now = now or timezone.now()
+        due = []
+        while self._heap and self._heap[0][0] <= now and len(due) < self.batch_size:
+            _, task_id = heapq.heappop(self._heap)
+            self._queued.discard(task_id)
+            due.append(task_id)
+        return due
+
+    def seconds_until_next(self, now=None):
+        if not self._heap:
+            return None
+        now = now or timezone.now()
+        return max(0.0, (self._heap[0][0] - now).total_seconds())
+
+    def run_pending(self, now=None):
+        """处理所有当前已到期的任务，返回实际触发超时动作的任务数"""
+        from .services import workflow_engine # 避免循环导入
+
+        handled = 0
+        while True:
+            task_ids = self.pop_due(now)
+            if not task_ids:
+                return handled
+            try:
+                handled += len(workflow_engine.handle_task_timeouts(task_ids, now=now))
+            except Exception as e:
+                # 整批回滚后逐个重试，避免一个任务的错误拖累同批其他任务
+                self.log(f"批量处理超时任务失败：{e}，改为逐个处理")
+                for task_id in task_ids:
+                    try:
+                        handled += len(workflow_engine.handle_task_timeouts([task_id], now=now))
+                    except Exception as e:
+                        self.log(f"任务 {task_id} 超时处理失败：{e}")
+
+    def run(self, once=False):
+        """
+        常驻运行直到 stop()。once=True 时只加载并处理当前已到期的任务后返回。返回处理的任务数。
+        """
+        processed = 0
+        next_refresh = 0.0
+        while not self._stop.is_set():
+            if not connection.in_atomic_block:
+                close_old_connections()
+            if time.monotonic() >= next_refresh:
+                self.refresh()
+                next_refresh = time.monotonic() + self.refresh_interval
+            processed += self.run_pending()
+            if once:
+                break
+            # 睡到堆顶任务到期或下一次刷新，取较早者
+            until_refresh = max(0.0, next_refresh - time.monotonic())
+            until_due = self.seconds_until_next()
+            self._stop.wait(until_refresh if until_due is None else min(until_due, until_refresh))
+        return processed
@@ -1,15 +1,36 @@
 # workflows/serializers.py
 from rest_framework import serializers
 from django.utils.translation import gettext_lazy as _
-from .models import WorkflowDefinition, WorkflowInstance, WorkflowTask, WorkflowHistory
+from .models import ArchivedWorkflowInstance, WorkflowDefinition, WorkflowInstance, WorkflowTask, WorkflowHistory
+
+def requested_fields(request):
+    """?fields=a,b,c 稀疏字段集；未指定时返回 None"""
+    if request is None:
+        return None
+    value = request.query_params.get('fields')
+    if not value:
+        return None
+    return {name.strip() for name in value.split(',') if name.strip()}
+
+
+class SparseFieldsetMixin:
+    """按请求的 ?fields= 只输出部分字段 (未知字段名忽略)"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        fields = requested_fields(self.context.get('request'))
+        if fields:
+            for name in set(self.fields) - fields:
+                self.fields.pop(name)
+
 
 class WorkflowDefinitionSerializer(serializers.ModelSerializer):
     class Meta:
         model = WorkflowDefinition
-        fields = ('id', 'name', 'description', 'definition_json', 'version', 'is_active', 'created_at', 'updated_at')
-        read_only_fields = ('id', 'version', 'created_at', 'updated_at') # 版本可能由内部管理
+        fields = ('id', 'name', 'description', 'definition_json', 'version', 'is_active', 'published_at', 'created_at', 'updated_at')
+        read_only_fields = ('id', 'version', 'published_at', 'created_at', 'updated_at') # 版本由发布操作递增
 
-class WorkflowInstanceSerializer(serializers.ModelSerializer):
+class WorkflowInstanceSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     definition_name = serializers.CharField(source='definition.name', read_only=True, label=_("定义名称"))
     definition_version = serializers.IntegerField(source='definition.version', read_only=True, label=_("定义版本"))
     status_display = serializers.CharField(source='get_status_display', read_only=True, label=_("状态显示"))
@@ -19,7 +40,19 @@ class WorkflowInstanceSerializer(serializers.ModelSerializer):
         fields = ('id', 'definition', 'definition_name', 'definition_version', 'status', 'status_display', 'payload', 'current_node_ids', 'started_at', 'completed_at', 'content_type', 'object_id')
         read_only_fields = ('id', 'definition_name', 'definition_version', 'status', 'status_display', 'current_node_ids', 'started_at', 'completed_at')
 
-class WorkflowTaskSerializer(serializers.ModelSerializer):
+# 任务列表中展示的实例 payload 摘要：(显示名, payload 键)
+TASK_PAYLOAD_SUMMARY_KEYS = (
+    (_('申请人'), 'requester_name'),
+    (_('类型'), 'leave_type'), # 假设是请假流程
+    (_('开始日期'), 'start_date'),
+)
+
+
+def payload_summary_annotation(key):
+    return f"summary_{key}"
+
+
+class WorkflowTaskSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     instance_id = serializers.UUIDField(source='instance.id', read_only=True, label=_("实例ID"))
     status_display = serializers.CharField(source='get_status_display', read_only=True, label=_("状态显示"))
     assignee_type_display = serializers.CharField(source='get_assignee_type_display', read_only=True, label=_("指派类型显示"))
@@ -33,14 +66,13 @@ class WorkflowTaskSerializer(serializers.ModelSerializer):
         read_only_fields = ('id', 'instance_id', 'node_id', 'task_type', 'status', 'status_display', 'assignee_type', 'assignee_type_display', 'assignee_identifier', 'assigned_users', 'due_date', 'created_at', 'completed_at', 'completed_by', 'instance_payload_summary', 'outcome') # 结果通过完成动作设置
 
     def get_instance_payload_summary(self, obj):
-        # 示例：为列表视图返回实例 payload 的子集
+        # 为列表视图返回实例 payload 的子集。
+        # 列表查询集在数据库中只提取这几个键 (WorkflowTaskViewSet.get_queryset 的注解)，不读取整个 payload；
+        # 没有注解时 (例如完成任务后返回) 退回读取实例的 payload。显示名是惰性翻译，作为 JSON 键须先转成 str
+        if hasattr(obj, payload_summary_annotation(TASK_PAYLOAD_SUMMARY_KEYS[0][1])):
+            return {str(label): getattr(obj, payload_summary_annotation(key)) for label, key in TASK_PAYLOAD_SUMMARY_KEYS}
         payload = obj.instance.payload
-        # 根据你的 payload 结构调整
-        return {
-            _('申请人'): payload.get('requester_name'),
-            _('类型'): payload.get('leave_type'), # 假设是请假流程
-            _('开始日期'): payload.get('start_date'),
-        }
+        return {str(label): payload.get(key) for label, key in TASK_PAYLOAD_SUMMARY_KEYS}
 
 class WorkflowHistorySerializer(serializers.ModelSerializer):
     user_email = serializers.EmailField(source='user.email', read_only=True, allow_null=True, label=_("用户邮箱")) # 示例
@@ -49,7 +81,18 @@ class WorkflowHistorySerializer(serializers.ModelSerializer):
     class Meta:
         model = WorkflowHistory
         fields = ('id', 'instance', 'node_id', 'task', 'event_type', 'event_type_display', 'timestamp', 'user', 'user_email', 'details')
-        read_only_fields = '__all__'
+        read_only_fields = fields # 历史记录只读 (DRF 不接受 '__all__')
+
+class ArchivedWorkflowInstanceSerializer(serializers.ModelSerializer):
+    status_display = serializers.CharField(source='get_status_display', read_only=True, label=_("状态显示"))
+
+    class Meta:
+        model = ArchivedWorkflowInstance
+        fields = (
+            'id', 'definition', 'definition_name', 'definition_version', 'status', 'status_display',
+            'started_at', 'completed_at', 'content_type', 'object_id', 'task_count', 'event_count', 'archived_at',
+        )
+        read_only_fields = fields # 归档只读
 
 # --- 特定动作的序列化器 ---
 class StartWorkflowSerializer(serializers.Serializer):
@@ -59,6 +102,21 @@ class StartWorkflowSerializer(serializers.Serializer):
     trigger_content_type_id = serializers.IntegerField(required=False, allow_null=True, label=_("触发对象内容类型ID"))
     trigger_object_id = serializers.UUIDField(required=False, allow_null=True, label=_("触发对象ID"))
 
+class StartBulkWorkflowSerializer(serializers.Serializer):
+    definition_id = serializers.UUIDField(required=True, label=_("工作流定义ID"))
+    # 每个元素是一个实例的初始数据负载；单个元素不合法只影响该项，在结果流中返回错误
+    payloads = serializers.ListField(child=serializers.JSONField(), allow_empty=False, max_length=20000, label=_("初始数据负载列表"))
+    chunk_size = serializers.IntegerField(required=False, min_value=1, max_value=5000, label=_("每个事务启动的实例数"))
+
+class SimulateDefinitionSerializer(serializers.Serializer):
+    # 样本初始负载，按顺序循环使用
+    payloads = serializers.ListField(child=serializers.DictField(), required=False, default=list, max_length=10000, label=_("样本初始数据负载"))
+    instances = serializers.IntegerField(required=False, default=1000, min_value=1, max_value=50000, label=_("模拟实例数"))
+    # {节点ID: {结果: 权重}}，未列出的用户任务节点结果为 approved
+    outcomes = serializers.DictField(child=serializers.DictField(child=serializers.FloatField(min_value=0)), required=False, default=dict, label=_("任务结果权重"))
+    job_results = serializers.DictField(required=False, default=dict, label=_("服务任务结果"))
+    seed = serializers.IntegerField(required=False, allow_null=True, default=None, label=_("随机种子"))
+
 class CompleteTaskSerializer(serializers.Serializer):
     outcome = serializers.CharField(required=True, max_length=100, label=_("任务结果")) # 例如 "approved", "rejected"
     completion_data = serializers.JSONField(required=False, default=dict, label=_("完成数据")) # 例如评论
\ No newline at end of file
@@ -1,141 +1,239 @@
 # workflows/services.py
+import functools
+import random
+import threading
+import time
+from collections import Counter, deque
+from datetime import timedelta
+
+from django.conf import settings
 from django.utils import timezone
 from django.db import transaction
-from django.contrib.auth import get_user_model
+from django.db.models import F, Q
 from django.contrib.contenttypes.models import ContentType
+from django.utils.module_loading import import_string
 from django.utils.translation import gettext as _ # 用于服务层中的字符串
 
-from .models import WorkflowDefinition, WorkflowInstance, WorkflowTask, WorkflowHistory
+from .models import WorkflowDefinition, WorkflowInstance, WorkflowTask, WorkflowHistory, WorkflowJob, WorkflowTaskCandidate
 # 修正导入路径，确保它们指向你的模型
 from .models import WorkflowTask as TaskStatusModel # 重命名以避免与常量冲突
 from .models import WorkflowInstance as InstanceStatusModel
 from .models import WorkflowTask as AssigneeTypeModel
-
-# 假设用户/角色/组织逻辑可用 (例如，在 'accounts' 应用中)
-# from accounts.services import get_user_manager, get_users_in_role
-
-# --- 用户/组织服务的占位符 ---
-# 用你实际的用户/角色查找逻辑替换
-class OrgChartService:
-    def get_user_manager(self, user):
-        # 实现查找用户经理的逻辑
-        print(f"警告：OrgChartService.get_user_manager 未为用户 {user.id} 实现")
-        return None # 占位符
-
-    def get_users_in_role(self, role_name):
-        # 实现查找属于某个角色/组的用户的逻辑
-        print(f"警告：OrgChartService.get_users_in_role 未为角色 {role_name} 实现")
-        User = get_user_model()
-        # 示例：return User.objects.filter(groups__name=role_name)
-        return [] # 占位符
-
-org_chart_service = OrgChartService() # 实例化或获取服务
-
-# --- 规则评估器 ---
-class RuleEvaluator:
-    def evaluate(self, condition_string, payload):
-        # 警告：评估任意字符串是危险的！
-        # 使用安全的评估库 (如 'asteval' 或构建简单的解析器)
-        # 为简单起见，这里只做基本检查。请替换为健壮的实现。
-        print(f"正在评估条件：'{condition_string}' 使用 payload：{payload}")
+from .graph import DefinitionValidationError, NodeType, compile_definition, get_compiled_graph
+from .rules import RuleEvaluator, rule_evaluator
+from .executors import build_job, get_worker_settings, render_message
+from .scheduler import TimeoutAction, compute_due_date
+from .repair import StuckReason, classify_instances
+from .roles import get_user_role_names
+from .metrics import get_metrics, timed
+from .storage import OrgChartService, org_chart_service # noqa: F401 兼容原先从 services 导入
+
+# 未结束的实例状态：这些实例仍会按定义的编译形式推进
+UNFINISHED_INSTANCE_STATUSES = (
+    InstanceStatusModel.Status.PENDING, InstanceStatusModel.Status.RUNNING, InstanceStatusModel.Status.SUSPENDED,
+)
+
+# 写入这些历史事件 (事务提交后) 累加的计数器：事件类型 -> (指标名, 标签)
+_EVENT_COUNTERS = {
+    WorkflowHistory.EventType.INSTANCE_STARTED: ('workflow_instances_started_total', {}),
+    WorkflowHistory.EventType.INSTANCE_COMPLETED: ('workflow_instances_finished_total', {'status': 'COMPLETED'}),
+    WorkflowHistory.EventType.INSTANCE_FAILED: ('workflow_instances_finished_total', {'status': 'FAILED'}),
+    WorkflowHistory.EventType.INSTANCE_CANCELED: ('workflow_instances_finished_total', {'status': 'CANCELED'}),
+    WorkflowHistory.EventType.TASK_CREATED: ('workflow_tasks_created_total', {}),
+    WorkflowHistory.EventType.TASK_COMPLETED: ('workflow_tasks_completed_total', {}),
+}
+
+# --- 历史记录缓冲 ---
+class HistoryBuffer(threading.local):
+    """
+    每个线程一个缓冲区：引擎入口方法 (start_instance / advance_workflow / complete_task)
+    在各自的事务内收集历史事件，最外层入口结束时一次 bulk_create 写入。
+    """
+    def __init__(self):
+        self.depth = 0
+        self.entries = []
+        self.last_timestamp = None
+        self.snapshot_due = {} # 实例 ID -> 实例，历史写入后为其生成快照
+
+    def add(self, entry):
+        # 同一微秒内的多条事件向后错开 1 微秒，保证按 timestamp 排序时顺序不变
+        if self.last_timestamp is not None and entry.timestamp <= self.last_timestamp:
+            entry.timestamp = self.last_timestamp + timedelta(microseconds=1)
+        self.last_timestamp = entry.timestamp
+        self.entries.append(entry)
+
+    def take(self):
+        entries, self.entries = self.entries, []
+        self.last_timestamp = None
+        return entries
+
+    def take_snapshot_due(self):
+        due, self.snapshot_due = self.snapshot_due, {}
+        return list(due.values())
+
+
+def batches_history(method):
+    """
+    装饰引擎入口方法，须放在 @transaction.atomic 之下，使写入发生在同一事务提交之前。
+    嵌套调用 (例如 complete_task -> advance_workflow) 只在最外层写入一次；出现异常时丢弃缓冲。
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        buffer = self._history_buffer
+        buffer.depth += 1
         try:
-            # 示例简单条件："payload.leave_days <= 3"
-            if condition_string is None or condition_string.strip() == '':
-                return True # 无条件视为真
-            if 'payload.' in condition_string:
-                parts = condition_string.split(' ')
-                if len(parts) == 3:
-                    key = parts[0].replace('payload.', '')
-                    op = parts[1]
-                    value_str = parts[2]
-                    payload_value = payload.get(key)
-
-                    if payload_value is None: return False
-
-                    # 基本比较 (生产环境中需要显著扩展)
-                    try:
-                        # 尝试数字比较
-                        num_payload = float(payload_value)
-                        num_value = float(value_str)
-                        if op == '<=': return num_payload <= num_value
-                        if op == '>': return num_payload > num_value
-                        if op == '==': return num_payload == num_value
-                        if op == '!=': return num_payload != num_value
-                        if op == '<': return num_payload < num_value
-                        if op == '>=': return num_payload >= num_value
-                    except ValueError:
-                         # 如果转换数字失败，尝试字符串比较
-                         str_value = value_str.strip("'\"") # 去除引号
-                         str_payload = str(payload_value)
-                         if op == '==': return str_payload == str_value
-                         if op == '!=': return str_payload != str_value
-                         # 对字符串的其他比较意义不大，除非有特殊需求
-
-                    # 添加更多操作符和类型检查
-            print(f"警告：不支持的条件格式：{condition_string}")
-            return False # 条件未知或格式错误时默认为 false
-        except Exception as e:
-            print(f"错误：评估条件 '{condition_string}' 时出错：{e}")
-            return False
+            result = method(self, *args, **kwargs)
+        except BaseException:
+            buffer.depth -= 1
+            if buffer.depth == 0:
+                buffer.take()
+                buffer.take_snapshot_due()
+            raise
+        buffer.depth -= 1
+        if buffer.depth == 0:
+            self.flush_history()
+            # 快照需要读取刚写入的历史，因此在写入之后、事务提交之前生成
+            for instance in buffer.take_snapshot_due():
+                self._take_snapshot(instance)
+        return result
+    return wrapper
+
+
+def storage_atomic(method):
+    """在引擎存储后端的事务中执行 (OrmStorage 即 transaction.atomic)，须放在 @batches_history 之上"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.storage.atomic():
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+class BulkStartWriter:
+    """
+    批量启动 (以及乐观并发完成任务) 时替代 _create_task / _enqueue_job：在内存中收集要写入的任务、指派关系和作业，
+    flush 时一次交给存储后端 (OrmStorage 每张表一次 bulk_create)。非规则指派的解析结果在分块内按 (类型, 标识) 复用。
+    """
+    def __init__(self, engine):
+        self.engine = engine
+        self.tasks = [] # (任务, 解析出的用户 ID 列表)
+        self.jobs = []
+        self._resolved = {}
+
+    def create_task(self, instance, node_definition):
+        task = self.engine._build_task(instance, node_definition)
+        key = (task.assignee_type, task.assignee_identifier)
+        if task.assignee_type == AssigneeTypeModel.AssigneeType.RULE or key not in self._resolved:
+            user_ids = self.engine._assigned_user_ids(task.assignee_type, task.assignee_identifier, instance)
+            if task.assignee_type != AssigneeTypeModel.AssigneeType.RULE:
+                self._resolved[key] = user_ids
+        else:
+            user_ids = self._resolved[key]
+        self.tasks.append((task, user_ids))
+        self.engine._log_task_created(task)
+        return task
+
+    def enqueue_job(self, instance, node_definition, node_type):
+        job = self.engine._build_job(instance, node_definition, node_type)
+        self.jobs.append(job)
+        return job
+
+    def flush(self, instances=()):
+        storage = self.engine.storage
+        if instances:
+            storage.create_instances(instances)
+        storage.create_tasks([(task, user_ids, self.engine._build_task_candidates(task, user_ids)) for task, user_ids in self.tasks])
+        storage.create_jobs(self.jobs)
+
+
+# 可在 settings.WORKFLOW_ENGINE 中覆盖
+DEFAULT_ENGINE_SETTINGS = {
+    # 'pessimistic': complete_task 锁定任务和实例行直到提交；
+    # 'optimistic': 只锁任务行，实例以 lock_version 条件更新写回，并行分支的完成互不阻塞计算
+    'CONCURRENCY_MODE': 'pessimistic',
+    'OPTIMISTIC_RETRIES': 5,      # 版本冲突后的最大重试次数，用尽后退回加锁完成
+    'OPTIMISTIC_BACKOFF': 0.005,  # 首次重试的最大随机退避 (秒)，之后每次翻倍
+    # 存储后端 (见 workflows/storage.py)，在创建 WorkflowEngineService 时读取
+    'STORAGE': 'workflows.storage.OrmStorage',
+}
+
+
+def get_engine_settings():
+    return {**DEFAULT_ENGINE_SETTINGS, **getattr(settings, 'WORKFLOW_ENGINE', {})}
+
+
+class InstanceVersionConflict(Exception):
+    """乐观并发写回实例时 lock_version 已被其他事务修改"""
 
-rule_evaluator = RuleEvaluator()
 
 # --- 工作流引擎服务 ---
 class WorkflowEngineService:
 
+    def __init__(self, storage=None):
+        self._history_buffer = HistoryBuffer()
+        self.storage = storage or import_string(get_engine_settings()['STORAGE'])()
+
     def _log_history(self, instance, event_type, node_id=None, task=None, user=None, details=None):
-        WorkflowHistory.objects.create(
+        entry = WorkflowHistory(
             instance=instance,
             node_id=node_id,
             task=task,
             event_type=event_type,
             user=user,
-            details=details or {}
+            details=details or {},
+            timestamp=timezone.now(),
         )
-
-    def _find_node_by_id(self, definition_json, node_id):
-        nodes = definition_json.get('nodes', [])
-        for node in nodes:
-            if node.get('id') == node_id:
-                return node
-        return None
-
-    def _find_outgoing_edges(self, definition_json, source_node_id):
-        edges = definition_json.get('edges', [])
-        return [edge for edge in edges if edge.get('source') == source_node_id]
+        instance.events_since_snapshot += 1
+        if self._history_buffer.depth:
+            self._history_buffer.add(entry)
+        else:
+            self._write_history([entry]) # 不在引擎入口方法内调用时直接写入
+
+    def flush_history(self):
+        """把当前线程缓冲的历史事件一次性写入数据库"""
+        self._write_history(self._history_buffer.take())
+
+    def _write_history(self, entries):
+        """写入历史事件；对应的计数器在事务提交后才累加，回滚或乐观重试中丢弃的事件不计入"""
+        self.storage.add_history(entries)
+        counts = Counter(entry.event_type for entry in entries if entry.event_type in _EVENT_COUNTERS)
+        if counts:
+            def count_events():
+                metrics = get_metrics()
+                for event_type, count in counts.items():
+                    name, labels = _EVENT_COUNTERS[event_type]
+                    metrics.inc(name, count, **labels)
+            self.storage.on_commit(count_events)
+
+    def _take_snapshot(self, instance):
+        self.storage.take_snapshot(instance)
+
+    def _get_graph(self, definition):
+        # 编译后的图按 (定义ID, 版本, 更新时间) 缓存，节点/出边查找为 O(1)
+        return get_compiled_graph(definition)
 
     def _resolve_assignees(self, assignee_type, identifier, instance):
-        User = get_user_model()
-        users = []
-        if assignee_type == AssigneeTypeModel.AssigneeType.USER:
-            try:
-                # 假设 identifier 是用户 ID
-                users.append(User.objects.get(pk=identifier)) # 使用 pk 更通用
-            except User.DoesNotExist:
-                print(f"错误：指派人用户 ID {identifier} 未找到。")
-        elif assignee_type == AssigneeTypeModel.AssigneeType.ROLE:
-             # 假设 identifier 是角色名称
-            users.extend(org_chart_service.get_users_in_role(identifier))
-        elif assignee_type == AssigneeTypeModel.AssigneeType.RULE:
-            if identifier == 'RequesterManager':
-                 # 假设 payload 中有 'requester_id'
-                 requester_id = instance.payload.get('requester_id')
-                 if requester_id:
-                     try:
-                        requester = User.objects.get(pk=requester_id)
-                        manager = org_chart_service.get_user_manager(requester)
-                        if manager:
-                            users.append(manager)
-                        else:
-                            print(f"警告：用户 {requester_id} 的经理未找到。")
-                     except User.DoesNotExist:
-                         print(f"错误：申请人用户 ID {requester_id} 未找到。")
-                 else:
-                     print("错误：无法解析 'RequesterManager'，payload 中缺少 'requester_id'。")
-            # 根据需要添加更多规则
-        return users
-
-    def _create_task(self, instance, node_definition):
+        """把指派配置解析为用户 ID 列表 (由存储后端查找，OrmStorage 每种类型只做一两次按主键/索引的查询)"""
+        return self.storage.resolve_assignees(assignee_type, identifier, instance)
+
+    def _assigned_user_ids(self, assignee_type, identifier, instance):
+        """
+        需要写入 assigned_users 的用户：只有 USER / RULE 指派在创建时解析。
+        ROLE 任务不展开成员，can_complete_task 实时检查角色成员资格 (离开角色的用户随即失去权限)。
+        """
+        if assignee_type == AssigneeTypeModel.AssigneeType.ROLE:
+            return []
+        return self._resolve_assignees(assignee_type, identifier, instance)
+
+    def _build_assignments(self, task, user_ids):
+        Assignment = WorkflowTask.assigned_users.through
+        return [Assignment(workflowtask_id=task.pk, user_id=user_id) for user_id in user_ids]
+
+    def _assign_users(self, task, user_ids):
+        """一次批量插入 assigned_users 关联行"""
+        WorkflowTask.assigned_users.through.objects.bulk_create(self._build_assignments(task, user_ids), ignore_conflicts=True)
+
+    def _build_task(self, instance, node_definition):
+        """根据节点配置构造 (未保存的) 任务"""
         node_id = node_definition.get('id')
         # 假设配置嵌套在节点数据的 'data' 字段下
         config = node_definition.get('data', {}).get('config', {})
@@ -143,7 +241,7 @@ class WorkflowEngineService:
         assignee_type = config.get('assigneeType', AssigneeTypeModel.AssigneeType.ROLE)
         assignee_identifier = config.get('assigneeIdentifier', 'DefaultRole') # 需要一个有意义的默认值或使其必需
 
-        task = WorkflowTask.objects.create(
+        return WorkflowTask(
             instance=instance,
             node_id=node_id,
             # 使用节点类型或配置中的 taskType
@@ -151,284 +249,600 @@ class WorkflowEngineService:
             status=TaskStatusModel.Status.PENDING,
             assignee_type=assignee_type,
             assignee_identifier=assignee_identifier,
-            # due_date= # 如果存在 config.timeoutDuration，则计算得出
+            due_date=compute_due_date(config), # 由 config.timeoutDuration 计算，run_sla_scheduler 负责超时处理
         )
-        # 可选：如果 assignee_type 是 USER 或 ROLE 分配是立即的，则立即解析并链接用户
-        # resolved_users = self._resolve_assignees(assignee_type, assignee_identifier, instance)
-        # if resolved_users:
-        #     task.assigned_users.set(resolved_users)
-        #     task.status = TaskStatusModel.Status.ASSIGNED # 或者保持 PENDING 直到被认领？取决于逻辑。
-        #     task.save()
-
-        self._log_history(instance, WorkflowHistory.EventType.TASK_CREATED, node_id=node_id, task=task, details={'指派给': f"{assignee_type}:{assignee_identifier}"})
+
+    def _create_task(self, instance, node_definition):
+        task = self._build_task(instance, node_definition)
+        # 创建时一次性解析 USER / RULE 指派人并批量写入 assigned_users，之后的权限检查只需一次 EXISTS 查询。
+        # 状态保持 PENDING：角色任务仍对角色内所有成员可见，直到被完成。
+        resolved_user_ids = self._assigned_user_ids(task.assignee_type, task.assignee_identifier, instance)
+        self.storage.create_tasks([(task, resolved_user_ids, self._build_task_candidates(task, resolved_user_ids))])
+        self._log_task_created(task)
         # TODO: 向潜在的指派人发送通知
-        # TODO: 如果 config.timeoutDuration 存在，使用 Celery 安排超时检查
         return task
 
+    def _log_task_created(self, task):
+        self._log_history(
+            task.instance, WorkflowHistory.EventType.TASK_CREATED, node_id=task.node_id, task=task,
+            details={'指派给': f"{task.assignee_type}:{task.assignee_identifier}"},
+        )
+
+    # --- 待办收件箱 (WorkflowTaskCandidate) 维护 ---
+    def _task_principals(self, task, user_ids=()):
+        principals = set()
+        if task.assignee_type == AssigneeTypeModel.AssigneeType.USER:
+            principals.add(WorkflowTaskCandidate.user_key(task.assignee_identifier))
+        elif task.assignee_type == AssigneeTypeModel.AssigneeType.ROLE:
+            principals.add(WorkflowTaskCandidate.role_key(task.assignee_identifier))
+        # RULE 类型以及认领/分配后的具体用户
+        principals.update(WorkflowTaskCandidate.user_key(user_id) for user_id in user_ids)
+        return principals
+
+    def _build_task_candidates(self, task, resolved_user_ids=()):
+        # 角色任务在收件箱中按角色索引 (成员变化后仍然正确)，规则任务按解析出的具体用户索引
+        user_ids = resolved_user_ids if task.assignee_type == AssigneeTypeModel.AssigneeType.RULE else ()
+        return [
+            WorkflowTaskCandidate(task=task, principal=principal, status=task.status, created_at=task.created_at)
+            for principal in self._task_principals(task, user_ids)
+        ]
+
+    def _index_task_candidates(self, task, resolved_user_ids=()):
+        """为任务写入候选主体行 (已存在的忽略)"""
+        WorkflowTaskCandidate.objects.bulk_create(self._build_task_candidates(task, resolved_user_ids), ignore_conflicts=True)
+
+    def _sync_candidate_status(self, task):
+        """任务状态变化后同步到收件箱，一条 UPDATE"""
+        WorkflowTaskCandidate.objects.filter(task=task).update(status=task.status)
+
+    def can_complete_task(self, user, task):
+        """
+        判断用户是否是任务的合法处理人，查询次数与角色人数无关：
+        角色集合走缓存，assigned_users 用 EXISTS 判断而不加载整个 M2M。
+        """
+        if not user or not user.is_authenticated:
+            return False
+        # 1. 直接分配给用户
+        if task.assignee_type == AssigneeTypeModel.AssigneeType.USER and task.assignee_identifier == str(user.pk):
+            return True
+        # 2. 分配给用户所在的角色/组
+        if task.assignee_type == AssigneeTypeModel.AssigneeType.ROLE and task.assignee_identifier in get_user_role_names(user):
+            return True
+        # 3. 规则指派 (创建时已解析) 或认领后分配的用户；角色任务只在认领后才有 assigned_users
+        return WorkflowTask.assigned_users.through.objects.filter(workflowtask_id=task.pk, user_id=user.pk).exists()
+
+    def inbox_task_ids(self, user, role_names, status=None):
+        """
+        返回用户可见任务 ID 的子查询，供 WorkflowTask.objects.filter(id__in=...) 使用。
+        与原先的 OR 查询语义一致：直接指派 / 已分配给用户的任务不限状态 (除非指定 status)，
+        角色任务只包含待处理的。
+        """
+        user_key = WorkflowTaskCandidate.user_key(user.pk)
+        role_keys = [WorkflowTaskCandidate.role_key(name) for name in role_names]
+        candidates = WorkflowTaskCandidate.objects.all()
+        if status:
+            principals = [user_key, *role_keys] if status == TaskStatusModel.Status.PENDING else [user_key]
+            candidates = candidates.filter(principal__in=principals, status=status)
+        else:
+            candidates = candidates.filter(
+                Q(principal=user_key) | Q(principal__in=role_keys, status=TaskStatusModel.Status.PENDING)
+            )
+        return candidates.values('task_id')
+
+    # --- 定义发布 ---
     @transaction.atomic
+    def publish_definition(self, definition_id):
+        """
+        校验定义并保存编译形式，版本号加一 (首次发布保持当前版本)。
+        未通过校验时抛出 DefinitionValidationError (errors 为错误列表)，定义保持不变。
+        编译形式按定义行保存、运行中的实例读取的就是它，因此还有未结束的实例时拒绝发布
+        (同样抛出 DefinitionValidationError)，避免正在运行的实例中途换成新的图。
+        """
+        definition = WorkflowDefinition.objects.select_for_update().get(pk=definition_id)
+        compiled_json = compile_definition(definition.definition_json)
+        unfinished = definition.instances.filter(status__in=UNFINISHED_INSTANCE_STATUSES).count()
+        if unfinished:
+            raise DefinitionValidationError([f'还有 {unfinished} 个未结束的实例使用当前版本，结束或取消后才能重新发布'])
+        definition.compiled_json = compiled_json
+        if definition.published_at is not None:
+            definition.version += 1
+        definition.published_at = timezone.now()
+        definition.save(update_fields=['compiled_json', 'version', 'published_at', 'updated_at'])
+        return definition
+
+    @timed('start')
+    @storage_atomic
+    @batches_history
     def start_instance(self, definition_id, initial_payload, triggered_by_object=None, user=None):
         try:
-            # 优先选择最新的 active 版本
-            definition = WorkflowDefinition.objects.filter(
-                # 如果 name 是唯一的，可以直接用 name 查找最新 active 版本
-                # name=definition_name,
-                id=definition_id, # 如果传入的是特定版本的 ID
-                is_active=True
-            ).latest('version') # 或者根据你的逻辑选择版本
+            definition = self.get_startable_definition(definition_id)
         except WorkflowDefinition.DoesNotExist:
             print(f"错误：活动的工作流定义 {definition_id} 未找到。")
             # 或者引发异常
             return None
 
-        instance = WorkflowInstance.objects.create(
+        instance = WorkflowInstance(
             definition=definition,
             status=InstanceStatusModel.Status.RUNNING, # 开始时即为运行中
             payload=initial_payload,
             current_node_ids=[], # 将通过查找开始节点来设置
             triggered_by_object=triggered_by_object
         )
+        self.storage.create_instance(instance)
         self._log_history(instance, WorkflowHistory.EventType.INSTANCE_STARTED, user=user, details={'初始负载': initial_payload})
 
-        # 查找 'start' 节点 (假设来自 React Flow 的类型是 'startNode')
-        start_node = None
-        for node in definition.definition_json.get('nodes', []):
-             # 根据你的前端开始事件节点类型调整 'startNode'
-            if node.get('type') == 'startNode':
-                start_node = node
-                break
+        # 开始节点在编译图时已预先确定
+        graph = self._get_graph(definition)
+        start_node = graph.start_node
 
         if not start_node:
             instance.status = InstanceStatusModel.Status.FAILED
             instance.completed_at = timezone.now()
-            instance.save()
+            self.storage.save_instance(instance)
             self._log_history(instance, WorkflowHistory.EventType.INSTANCE_FAILED, details={'错误': '定义中未找到开始节点'})
             print(f"错误：定义 {definition.id} 未找到开始节点")
             return instance # 返回失败的实例
 
-        # 立即从开始节点推进
-        self.advance_workflow(instance, start_node.get('id'))
+        # 立即从开始节点推进 (实例刚在本事务中创建，其他事务不可见，无需再次加锁读取)
+        self.advance_workflow(instance, start_node.get('id'), graph=graph, instance_locked=True)
         return instance
 
-    @transaction.atomic
-    def advance_workflow(self, instance, completed_node_id, completion_data=None):
-        # completion_data 通常包含任务结果等信息，会合并到实例 payload 中或用于条件判断
-
-        # 重新获取实例以确保状态最新，并锁定行以防并发问题
+    # --- 批量启动 ---
+    BULK_START_CHUNK_SIZE = 500
+
+    def get_startable_definition(self, definition_id):
+        """start_instance / start_instances_bulk 使用的定义，找不到时抛出 WorkflowDefinition.DoesNotExist"""
+        return self.storage.get_startable_definition(definition_id)
+
+    def start_instances_bulk(self, definition_id, payloads, user=None, chunk_size=None):
+        """
+        用同一个定义批量启动实例，逐项产出结果字典：
+        {'index': i, 'id': 实例ID, 'status': 状态} 或 {'index': i, 'error': 原因}。
+        定义只查找、编译一次；每个分块在一个事务中推进完所有实例，再按表各一次 bulk_create
+        (实例、任务、assigned_users、收件箱、作业、历史)，实例以推进后的最终状态插入，不再 UPDATE。
+        某个分块失败只影响该分块内的实例。定义不存在时在产出任何结果之前抛出 WorkflowDefinition.DoesNotExist。
+        """
+        definition = self.get_startable_definition(definition_id)
+        graph = self._get_graph(definition)
+        chunk_size = chunk_size or self.BULK_START_CHUNK_SIZE
+        return self._iter_bulk_start(definition, graph, payloads, user, chunk_size)
+
+    def _iter_bulk_start(self, definition, graph, payloads, user, chunk_size):
+        chunk = []
+        for index, payload in enumerate(payloads):
+            if not isinstance(payload, dict):
+                yield {'index': index, 'error': _("初始数据负载必须是 JSON 对象")}
+                continue
+            chunk.append((index, payload))
+            if len(chunk) >= chunk_size:
+                yield from self._start_chunk_results(definition, graph, chunk, user)
+                chunk = []
+        if chunk:
+            yield from self._start_chunk_results(definition, graph, chunk, user)
+
+    def _start_chunk_results(self, definition, graph, chunk, user):
         try:
-            instance = WorkflowInstance.objects.select_for_update().get(pk=instance.pk)
-        except WorkflowInstance.DoesNotExist:
-            print(f"错误：实例 {instance.pk} 在推进时丢失。")
+            instances = self._start_chunk(definition, graph, [payload for _, payload in chunk], user)
+        except Exception as e:
+            print(f"错误：批量启动分块 (第 {chunk[0][0]}-{chunk[-1][0]} 项) 失败：{e}")
+            for index, _payload in chunk:
+                yield {'index': index, 'error': str(e)}
             return
+        for (index, _payload), instance in zip(chunk, instances):
+            yield {'index': index, 'id': str(instance.id), 'status': instance.status}
+
+    @storage_atomic
+    @batches_history
+    def _start_chunk(self, definition, graph, payloads, user):
+        writer = BulkStartWriter(self)
+        start_node = graph.start_node
+        instances = []
+        for payload in payloads:
+            instance = WorkflowInstance(
+                definition=definition,
+                status=InstanceStatusModel.Status.RUNNING,
+                payload=payload,
+                current_node_ids=[],
+            )
+            instances.append(instance)
+            self._log_history(instance, WorkflowHistory.EventType.INSTANCE_STARTED, user=user, details={'初始负载': payload})
+            if not start_node:
+                instance.status = InstanceStatusModel.Status.FAILED
+                instance.completed_at = timezone.now()
+                self._log_history(instance, WorkflowHistory.EventType.INSTANCE_FAILED, details={'错误': '定义中未找到开始节点'})
+                continue
+            self._advance_in_memory(
+                instance, graph, start_node.get('id'),
+                create_task=writer.create_task, enqueue_job=writer.enqueue_job,
+            )
+        writer.flush(instances)
+        return instances
+
+    # 自动推进的节点 (开始、决策、结束及未知类型) 在一次推进中最多连续处理的步数，防止定义中的环导致死循环
+    MAX_AUTO_STEPS = 10000
+    # 实例每累计约这么多条历史事件生成一个状态快照 (见 workflows/snapshots.py)
+    SNAPSHOT_EVERY_EVENTS = 200
+
+    @timed('advance')
+    @storage_atomic
+    @batches_history
+    def advance_workflow(self, instance, completed_node_id, completion_data=None, graph=None, instance_locked=False):
+        # completion_data 通常包含任务结果等信息，会合并到实例 payload 中或用于条件判断
+        # graph 可由调用方传入已编译的图，省去再次加载定义
+        # instance_locked=True 表示调用方已在当前事务中 select_for_update 过该实例 (例如 complete_task)
+
+        if not instance_locked:
+            # 重新获取实例以确保状态最新，并锁定行以防并发问题
+            try:
+                instance = self.storage.lock_instance(instance.pk)
+            except WorkflowInstance.DoesNotExist:
+                print(f"错误：实例 {instance.pk} 在推进时丢失。")
+                return
 
         if instance.status not in [InstanceStatusModel.Status.RUNNING, InstanceStatusModel.Status.SUSPENDED]:
              print(f"警告：尝试推进非运行中的实例 {instance.id} (状态: {instance.status})")
              return
 
-        definition_json = instance.definition.definition_json
-        completed_node = self._find_node_by_id(definition_json, completed_node_id)
+        if graph is None:
+            graph = self._get_graph(instance.definition)
 
-        if not completed_node:
+        if graph.node(completed_node_id) is None:
             # 如果调用正确，这不应该发生
             print(f"错误：完成的节点 ID {completed_node_id} 在实例 {instance.id} 中未找到")
-            # 考虑将实例标记为 FAILED
             instance.status = InstanceStatusModel.Status.FAILED
-            instance.save()
+            self.storage.save_instance(instance)
             self._log_history(instance, WorkflowHistory.EventType.INSTANCE_FAILED, node_id=completed_node_id, details={'错误': f'完成的节点 {completed_node_id} 在定义中未找到'})
             return
 
+        self._advance_in_memory(instance, graph, completed_node_id, completion_data)
+        self.storage.save_instance(instance) # 一次性保存 payload、current_node_ids 和状态
+        if instance.events_since_snapshot >= self.SNAPSHOT_EVERY_EVENTS:
+            self._history_buffer.snapshot_due[instance.pk] = instance
+
+    def _advance_in_memory(self, instance, graph, completed_node_id, completion_data=None, create_task=None, enqueue_job=None):
+        """
+        advance_workflow 的推进循环：只修改内存中的 instance (payload / current_node_ids / status)，不保存实例。
+        新进入的用户任务和异步作业分别交给 create_task / enqueue_job (默认立即写库)；
+        批量启动时传入收集器，由调用方统一 bulk_create。
+        """
+        create_task = create_task or self._create_task
+        enqueue_job = enqueue_job or self._enqueue_job
+
         # 更新 payload（例如合并任务的完成数据）
         if isinstance(completion_data, dict):
             instance.payload.update(completion_data) # 合并结果到 payload
 
-        # 记录离开已完成的节点
-        self._log_history(instance, WorkflowHistory.EventType.NODE_EXITED, node_id=completed_node_id, details=completion_data)
-
-        # 更新当前节点 (移除刚完成的节点)
-        current_nodes = list(instance.current_node_ids)
-        if completed_node_id in current_nodes:
-            current_nodes.remove(completed_node_id)
-
-        next_node_ids_to_activate = []
+        # 在内存中用工作队列推进：所有可自动推进的节点在这一次加锁内走完，
+        # current_node_ids / payload / status 只在最后写回一次
+        # 活动节点用有序字典当作集合：成员判断和移除都是 O(1)，保存时保持原有顺序
+        active_nodes = dict.fromkeys(instance.current_node_ids)
+        work_queue = deque([(completed_node_id, completion_data)])
+        auto_steps = 0
+
+        while work_queue:
+            node_id, exit_data = work_queue.popleft()
+
+            transitions = self._select_next_nodes(instance, graph, node_id)
+            if transitions is None:
+                # 决策节点没有可走的路径：节点保持活动，实例停留在此等待人工处理
+                active_nodes.setdefault(node_id)
+                continue
+
+            # 记录离开节点，并从活动节点中移除
+            self._log_history(instance, WorkflowHistory.EventType.NODE_EXITED, node_id=node_id, details=exit_data)
+            active_nodes.pop(node_id, None)
+
+            for next_node_id, enter_details in transitions:
+                next_node_type = graph.node_type(next_node_id)
+                if next_node_type == NodeType.PARALLEL_JOIN:
+                    # 并行汇聚：到达计数存在实例行上 (调用方已锁定该实例)，最后一个分支到达时恰好触发一次
+                    arrived = instance.join_counters.get(next_node_id, 0) + 1
+                    expected = graph.join_arity(next_node_id)
+                    if arrived < expected:
+                        instance.join_counters[next_node_id] = arrived
+                        self._log_history(
+                            instance, WorkflowHistory.EventType.JOIN_ARRIVED, node_id=next_node_id,
+                            details={**enter_details, '已到达': arrived, '需要': expected},
+                        )
+                        continue
+                    instance.join_counters.pop(next_node_id, None) # 清零，环路中可再次汇聚
+                    enter_details = {**enter_details, '汇聚分支数': expected}
+
+                next_node = graph.node(next_node_id)
+                if next_node is None:
+                    print(f"错误：下一个节点 ID {next_node_id} 在定义中未找到。")
+                    instance.status = InstanceStatusModel.Status.FAILED
+                    self._log_history(instance, WorkflowHistory.EventType.INSTANCE_FAILED, details={'错误': f'下一个节点 {next_node_id} 未找到'})
+                    continue
+                self._log_history(instance, WorkflowHistory.EventType.NODE_ENTERED, node_id=next_node_id, details=enter_details)
+                if next_node_id in active_nodes: # 未声明为汇聚节点的多入边节点：避免重复添加
+                    continue
+                active_nodes[next_node_id] = None
+
+                # 为 *新进入* 的节点执行逻辑
+                if next_node_type.is_user_task:
+                    create_task(instance, next_node)
+                    # 路径在此暂停，等待任务完成
+
+                elif next_node_type in (NodeType.SERVICE_TASK, NodeType.NOTIFICATION):
+                    # 不在持有实例行锁的事务中执行外部调用：只写入 outbox，
+                    # 事务提交后由 run_workflow_worker 执行，完成时以 {节点ID}_result 回调 advance_workflow
+                    enqueue_job(instance, next_node, next_node_type)
+
+                else:
+                    # 开始、决策 (在离开时根据当前 payload 评估条件)、并行拆分/汇聚、结束及其他中间节点：自动推进。
+                    # 结束节点没有出边，离开后即从活动节点中移除，表示此路径完成。
+                    auto_steps += 1
+                    if auto_steps > self.MAX_AUTO_STEPS:
+                        print(f"错误：实例 {instance.id} 自动推进超过 {self.MAX_AUTO_STEPS} 步，定义中可能存在无任务的环。")
+                        instance.status = InstanceStatusModel.Status.FAILED
+                        self._log_history(instance, WorkflowHistory.EventType.INSTANCE_FAILED, node_id=next_node_id, details={'错误': '自动推进步数超限'})
+                        work_queue.clear()
+                        break
+                    work_queue.append((next_node_id, None))
+
+            if instance.status == InstanceStatusModel.Status.FAILED:
+                break
 
-        # 查找从已完成节点出发的边
-        outgoing_edges = self._find_outgoing_edges(definition_json, completed_node_id)
+        instance.current_node_ids = list(active_nodes)
+        # 没有活动的节点意味着工作流完成。等待中的汇聚节点不算活动节点：
+        # 若某个分支没有走到汇聚节点 (例如被决策节点引向结束)，汇聚节点不会触发
+        if not active_nodes and instance.status == InstanceStatusModel.Status.RUNNING:
+            instance.status = InstanceStatusModel.Status.COMPLETED
+            instance.completed_at = timezone.now()
+            self._log_history(instance, WorkflowHistory.EventType.INSTANCE_COMPLETED)
+            # TODO: 执行工作流完成时的任何最终操作 (例如，更新原始请假请求的状态)
 
-        # 根据节点类型和边/条件确定下一个节点
-        node_type = completed_node.get('type', '').lower()
+    def _select_next_nodes(self, instance, graph, node_id):
+        """
+        根据节点类型和边上的条件确定离开 node_id 后要进入的节点。
+        返回 [(目标节点ID, NODE_ENTERED 详情), ...]；决策节点没有任何可走路径时返回 None。
+        """
+        outgoing_edges = graph.outgoing_edges(node_id)
 
-        if node_type == 'decisionnode': # 或者你的决策节点类型
-            evaluated_edge_found = False
+        if graph.node_type(node_id) == NodeType.DECISION:
             default_edge = None
             for edge in outgoing_edges:
                 condition = edge.get('data', {}).get('condition', '') # 条件在边的 data.condition 中
                 is_default = edge.get('data', {}).get('isDefault', False) # 检查是否有默认标记
 
                 if not condition and not is_default: # 没有条件也不是默认，视为始终为真
-                     target_node_id = edge.get('target')
-                     next_node_ids_to_activate.append(target_node_id)
-                     self._log_history(instance, WorkflowHistory.EventType.NODE_ENTERED, node_id=target_node_id, details={'来自决策节点': completed_node_id, '原因': '无条件路径'})
-                     evaluated_edge_found = True
-                     break # 假设是排他网关 (XOR)
-
-                elif condition and rule_evaluator.evaluate(condition, instance.payload):
-                     target_node_id = edge.get('target')
-                     next_node_ids_to_activate.append(target_node_id)
-                     self._log_history(instance, WorkflowHistory.EventType.NODE_ENTERED, node_id=target_node_id, details={'来自决策节点': completed_node_id, '满足条件': condition})
-                     evaluated_edge_found = True
-                     break # 假设是排他网关 (XOR)
+                     return [(edge.get('target'), {'来自决策节点': node_id, '原因': '无条件路径'})] # 排他网关 (XOR)
+
+                elif condition and self._evaluate_condition(condition, instance.payload):
+                     return [(edge.get('target'), {'来自决策节点': node_id, '满足条件': condition})] # 排他网关 (XOR)
 
                 elif is_default:
                     default_edge = edge # 记下默认边，最后处理
 
-            if not evaluated_edge_found and default_edge:
-                 target_node_id = default_edge.get('target')
-                 next_node_ids_to_activate.append(target_node_id)
-                 self._log_history(instance, WorkflowHistory.EventType.NODE_ENTERED, node_id=target_node_id, details={'来自决策节点': completed_node_id, '原因': '默认路径'})
-                 evaluated_edge_found = True
-
-            if not evaluated_edge_found:
-                 # 处理没有条件匹配且没有默认路径的情况 (例如，错误或流程卡住)
-                 print(f"警告：决策节点 {completed_node_id} 在实例 {instance.id} 中没有路径满足条件且无默认路径")
-                 # 可以在这里将实例标记为 FAILED 或 SUSPENDED
-                 # instance.status = InstanceStatusModel.Status.SUSPENDED
-                 # self._log_history(instance, WorkflowHistory.EventType.INSTANCE_FAILED, node_id=completed_node_id, details={'错误':'决策节点无匹配路径'})
-                 pass # 当前实现：此路径停止
-
-        elif node_type == 'endnode': # 或者你的结束节点类型
-             # 工作流路径在此结束。如果没有其他活动路径，则完成实例。
-             pass # 下面的逻辑处理实例完成检查
-
-        else: # 标准节点类型 (开始、审批、服务、通知等)
-             # 除非是并行拆分节点，否则假定只有一个传出路径
-             for edge in outgoing_edges:
-                 target_node_id = edge.get('target')
-                 next_node_ids_to_activate.append(target_node_id)
-                 self._log_history(instance, WorkflowHistory.EventType.NODE_ENTERED, node_id=target_node_id, details={'来自节点': completed_node_id})
-                 # 如果是并行拆分 (AND)，添加所有目标。如果是顺序流，应该只有一条边。
-
-        # 处理新激活的节点
-        newly_activated_nodes_requiring_processing = []
-        for next_node_id in next_node_ids_to_activate:
-             if next_node_id not in current_nodes: # 避免在合并并行路径时重复添加
-                 current_nodes.append(next_node_id)
-                 newly_activated_nodes_requiring_processing.append(next_node_id)
-
-        instance.current_node_ids = current_nodes # 先保存当前节点状态
-        instance.save() # 保存 payload 和 current_node_ids 的更新
-
-        # 现在处理需要动作的新节点（创建任务、执行服务等）
-        # 将此移到循环外可以避免在一个事务中嵌套调用 advance_workflow
-        for node_id_to_process in newly_activated_nodes_requiring_processing:
-             next_node = self._find_node_by_id(definition_json, node_id_to_process)
-             if not next_node:
-                 print(f"错误：下一个节点 ID {node_id_to_process} 在定义中未找到。")
-                 instance.status = InstanceStatusModel.Status.FAILED
-                 instance.save() # 保存失败状态
-                 self._log_history(instance, WorkflowHistory.EventType.INSTANCE_FAILED, details={'错误': f'下一个节点 {node_id_to_process} 未找到'})
-                 # 停止此实例的进一步处理
-                 continue # 处理下一个可能的新激活节点
-
-             next_node_type = next_node.get('type', '').lower()
-
-             # 为 *新进入* 的节点执行逻辑
-             if next_node_type in ['approvalnode', 'usertasknode']: # 检查你的特定类型
-                 self._create_task(instance, next_node)
-                 # 路径在此暂停，等待任务完成
-
-             elif next_node_type == 'servicetasknode':
-                 # TODO: 执行服务任务 (例如，调用外部 API, 更新数据库)
-                 # 这可能是同步的或异步的 (使用 Celery)
-                 # 如果同步且成功，立即调用 advance_workflow(instance, node_id_to_process, {'service_result': ...})
-                 # 如果异步，Celery 任务必须在完成时调用 advance_workflow
-                 print(f"信息：到达服务任务 {node_id_to_process}。执行未实现。")
-                 # 暂时假设同步成功：
-                 # 注意：在同一个事务中递归调用 advance_workflow 可能导致问题，最好用 Celery
-                 # self.advance_workflow(instance, node_id_to_process, {'service_result': 'NotImplemented'})
-                 # 如果需要立即推进，并且操作很快，可以在这里直接调用，但要注意事务嵌套
-                 # 更好的方式是让服务任务执行后（可能通过 Celery 任务）再调用 advance_workflow
-
-             elif next_node_type == 'notificationnode':
-                 # TODO: 发送通知 (例如，使用 Celery)
-                 print(f"信息：到达通知任务 {node_id_to_process}。发送未实现。")
-                 # 通知通常不阻塞，立即推进
-                 # 同样，推荐异步处理后调用 advance_workflow
-                 # self.advance_workflow(instance, node_id_to_process, {'notification_sent': 'NotImplemented'})
-
-             elif next_node_type == 'endnode':
-                 # 到达结束节点。此路径完成。
-                 # 下面的逻辑将检查整个实例是否应完成。
-                 pass # 此处无需操作
-
-             elif next_node_type == 'decisionnode':
-                  # 决策逻辑在 *离开* 节点时运行，所以只需进入即可。
-                  # 或者，如果条件仅依赖于已存在的 payload，可以立即评估？
-                  # 标准做法是根据传入数据/任务结果在退出时评估。
-                  pass # 假设在退出时评估
-
-             else: # 包括 'startNode' 或其他中间节点
-                 # 没有特定操作，自动推进
-                 self.advance_workflow(instance, node_id_to_process)
-
-
-        # 在所有新节点处理（或任务创建）完成后，检查实例是否已完成
-        # 重新获取实例状态，因为 advance_workflow 可能已被递归或异步调用修改
-        instance.refresh_from_db()
-        if not instance.current_node_ids and instance.status == InstanceStatusModel.Status.RUNNING: # 没有活动的节点意味着工作流完成
+            if default_edge:
+                 return [(default_edge.get('target'), {'来自决策节点': node_id, '原因': '默认路径'})]
+
+            # 没有条件匹配且没有默认路径 (例如，错误或流程卡住)
+            print(f"警告：决策节点 {node_id} 在实例 {instance.id} 中没有路径满足条件且无默认路径")
+            return None
+
+        # 标准节点类型 (开始、审批、服务、通知、并行拆分/汇聚等)；多条出边视为并行拆分 (AND)，结束节点没有出边
+        return [(edge.get('target'), {'来自节点': node_id}) for edge in outgoing_edges]
+
+    def _evaluate_condition(self, condition, payload):
+        with get_metrics().timer('workflow_rule_evaluation_seconds'):
+            return rule_evaluator.evaluate(condition, payload)
+
+    def _build_job(self, instance, node_definition, node_type):
+        job_type = WorkflowJob.JobType.SERVICE_TASK if node_type == NodeType.SERVICE_TASK else WorkflowJob.JobType.NOTIFICATION
+        config = node_definition.get('data', {}).get('config', {})
+        return build_job(instance, node_definition.get('id'), job_type, config)
+
+    def _enqueue_job(self, instance, node_definition, node_type):
+        job = self._build_job(instance, node_definition, node_type)
+        self.storage.create_jobs([job])
+        return job
+
+    @storage_atomic
+    @batches_history
+    def fail_instance(self, instance_id, node_id=None, reason=''):
+        """将实例标记为失败 (例如异步作业重试次数用尽)"""
+        instance = self.storage.lock_instance(instance_id)
+        if instance.status in (InstanceStatusModel.Status.COMPLETED, InstanceStatusModel.Status.CANCELED, InstanceStatusModel.Status.FAILED):
+            return instance
+        instance.status = InstanceStatusModel.Status.FAILED
+        instance.completed_at = timezone.now()
+        self.storage.save_instance(instance)
+        self._log_history(instance, WorkflowHistory.EventType.INSTANCE_FAILED, node_id=node_id, details={'错误': reason})
+        return instance
+
+    # --- 卡住实例的修复 (repair_stuck_instances 命令) ---
+    def _lock_stuck_instances(self, instance_ids):
+        """加锁读取仍为 RUNNING 的实例，并在锁内重新判定；返回 [(实例, {节点ID: 原因})]"""
+        with get_metrics().timer('workflow_lock_wait_seconds', table='instance'):
+            instances = list(
+                WorkflowInstance.objects.select_for_update().filter(pk__in=instance_ids, status=InstanceStatusModel.Status.RUNNING)
+            )
+        stuck = classify_instances((instance.pk, instance.definition_id, instance.current_node_ids) for instance in instances)
+        return [(instance, stuck[instance.pk]) for instance in instances if instance.pk in stuck]
+
+    @transaction.atomic
+    @batches_history
+    def close_stuck_instances(self, instance_ids, status, reason=''):
+        """
+        把一批卡住的实例标记为 SUSPENDED 或 FAILED (一条 UPDATE)。
+        任务和作业都在实例锁内创建，因此锁内重新判定后仍卡住的实例不会在此期间被推进。返回处理的实例 ID 列表。
+        """
+        event_type = {
+            InstanceStatusModel.Status.SUSPENDED: WorkflowHistory.EventType.INSTANCE_SUSPENDED,
+            InstanceStatusModel.Status.FAILED: WorkflowHistory.EventType.INSTANCE_FAILED,
+        }[status]
+        locked = self._lock_stuck_instances(instance_ids)
+        if not locked:
+            return []
+        now = timezone.now()
+        closed_ids = [instance.pk for instance, _reasons in locked]
+        WorkflowInstance.objects.filter(pk__in=closed_ids).update(
+            status=status, completed_at=now if status == InstanceStatusModel.Status.FAILED else None,
+            lock_version=F('lock_version') + 1,
+        )
+        for instance, reasons in locked:
+            self._log_history(instance, event_type, details={'错误': reason or '实例卡住', '卡住的节点': {str(node_id): r for node_id, r in reasons.items()}})
+        return closed_ids
+
+    @transaction.atomic
+    @batches_history
+    def retry_stuck_instance(self, instance_id):
+        """
+        重新推进一个卡住的实例：缺少任务的用户任务节点重新创建任务，缺少作业的服务/通知节点重新写入作业，
+        决策等自动节点按当前 payload 重新求值后继续推进 (仍无路可走时保持原样)；没有活动节点的实例按完成处理。
+        活动节点已不在定义中的无法重试。返回实例 (未卡住或不存在时返回 None)。
+        """
+        locked = self._lock_stuck_instances([instance_id])
+        if not locked:
+            return None
+        instance, reasons = locked[0]
+        graph = self._get_graph(instance.definition)
+        for node_id, reason in reasons.items():
+            if reason == StuckReason.MISSING_TASK:
+                self._create_task(instance, graph.node(node_id))
+            elif reason == StuckReason.MISSING_JOB:
+                self._enqueue_job(instance, graph.node(node_id), graph.node_type(node_id))
+            elif reason == StuckReason.STALLED_NODE and instance.status == InstanceStatusModel.Status.RUNNING:
+                self._advance_in_memory(instance, graph, node_id)
+        if reasons.get(None) == StuckReason.NO_ACTIVE_NODES:
             instance.status = InstanceStatusModel.Status.COMPLETED
             instance.completed_at = timezone.now()
-            instance.save()
-            self._log_history(instance, WorkflowHistory.EventType.INSTANCE_COMPLETED)
-            # TODO: 执行工作流完成时的任何最终操作 (例如，更新原始请假请求的状态)
-
+            self._log_history(instance, WorkflowHistory.EventType.INSTANCE_COMPLETED, details={'原因': '修复：没有活动节点'})
+        instance.save()
+        return instance
 
+    # --- 任务超时 (SLA) ---
+    @timed('timeouts')
     @transaction.atomic
+    @batches_history
+    def handle_task_timeouts(self, task_ids, now=None):
+        """
+        对一批已到期的任务执行节点配置的超时动作 (由 SlaScheduler 调用)。
+        只处理仍未完成、未超时且确已到期的任务，返回实际处理的任务列表。
+        """
+        now = now or timezone.now()
+        with get_metrics().timer('workflow_lock_wait_seconds', table='task'):
+            tasks = list(
+                WorkflowTask.objects.select_for_update(of=('self',)).select_related('instance__definition')
+                .filter(
+                    id__in=task_ids,
+                    status__in=(TaskStatusModel.Status.PENDING, TaskStatusModel.Status.ASSIGNED),
+                    timed_out_at__isnull=True,
+                    due_date__lte=now,
+                )
+            )
+        if not tasks:
+            return tasks
+        # 先整体标记为已超时：一条 UPDATE，也保证自动完成时重新读取的任务不会再次入队
+        WorkflowTask.objects.filter(id__in=[task.id for task in tasks]).update(timed_out_at=now)
+
+        for task in tasks:
+            task.timed_out_at = now
+            node = self._get_graph(task.instance.definition).node(task.node_id) or {}
+            config = node.get('data', {}).get('config', {})
+            action = config.get('timeoutAction') or TimeoutAction.NOTIFY
+            if action == TimeoutAction.ESCALATE and not config.get('escalateToIdentifier'):
+                print(f"警告：任务 {task.id} 配置了上报但缺少 escalateToIdentifier，改为提醒。")
+                action = TimeoutAction.NOTIFY
+
+            self._log_history(
+                task.instance, WorkflowHistory.EventType.TASK_TIMED_OUT, node_id=task.node_id, task=task,
+                details={'截止时间': task.due_date.isoformat(), '超时动作': action},
+            )
+            if action == TimeoutAction.AUTO_APPROVE:
+                self.complete_task(task.id, None, 'approved', {'自动处理': '超时自动批准'})
+            elif action == TimeoutAction.AUTO_REJECT:
+                self.complete_task(task.id, None, 'rejected', {'自动处理': '超时自动驳回'})
+            elif action == TimeoutAction.ESCALATE:
+                self._escalate_task(task, config.get('escalateToType', AssigneeTypeModel.AssigneeType.ROLE), config['escalateToIdentifier'])
+            else:
+                self._notify_task_timeout(task, config)
+        return tasks
+
+    def _escalate_task(self, task, assignee_type, assignee_identifier):
+        """改派任务：替换指派人、assigned_users 和收件箱索引"""
+        previous = f"{task.assignee_type}:{task.assignee_identifier}"
+        task.assignee_type, task.assignee_identifier = assignee_type, assignee_identifier
+        task.save(update_fields=['assignee_type', 'assignee_identifier'])
+        WorkflowTask.assigned_users.through.objects.filter(workflowtask_id=task.pk).delete()
+        WorkflowTaskCandidate.objects.filter(task=task).delete()
+
+        resolved_user_ids = self._assigned_user_ids(assignee_type, assignee_identifier, task.instance)
+        if resolved_user_ids:
+            self._assign_users(task, resolved_user_ids)
+        self._index_task_candidates(task, resolved_user_ids)
+        self._log_history(
+            task.instance, WorkflowHistory.EventType.TASK_ASSIGNED, node_id=task.node_id, task=task,
+            details={'原指派': previous, '上报给': f"{assignee_type}:{assignee_identifier}"},
+        )
+
+    def _notify_task_timeout(self, task, config):
+        """通过通知后端 (WORKFLOW_WORKER['NOTIFICATION_BACKEND']) 提醒当前指派人"""
+        template = config.get('timeoutMessageTemplate') or f"任务 {task.node_id} 已超过截止时间 {task.due_date:%Y-%m-%d %H:%M}"
+        message = render_message(template, task.instance.payload)
+        try:
+            backend = import_string(get_worker_settings()['NOTIFICATION_BACKEND'])
+            with transaction.atomic(): # 后端若访问数据库出错，只回滚到此保存点
+                backend(task, task.assignee_type, task.assignee_identifier, message)
+        except Exception as e:
+            # 提醒失败不影响同批其他任务，超时事件已记录在历史中
+            print(f"错误：任务 {task.id} 的超时提醒发送失败：{e}")
+
+    @timed('complete_task')
     def complete_task(self, task_id, user, outcome, completion_data=None):
+        """
+        完成任务并从任务所在节点推进实例。
+        WORKFLOW_ENGINE['CONCURRENCY_MODE'] 为 'optimistic' 时先尝试乐观并发 (见 _complete_task_optimistic)，
+        版本冲突按随机退避重试，重试用尽或遇到需要加锁处理的情况时退回加锁完成。
+        """
+        engine_settings = get_engine_settings()
+        # 嵌套在外层事务中时 (例如超时自动批准) 重试仍读取同一个 REPEATABLE READ 快照，只能加锁
+        if engine_settings['CONCURRENCY_MODE'] == 'optimistic' and not self.storage.in_atomic_block():
+            for attempt in range(engine_settings['OPTIMISTIC_RETRIES']):
+                try:
+                    task = self._complete_task_optimistic(task_id, user, outcome, completion_data)
+                except InstanceVersionConflict:
+                    get_metrics().inc('workflow_optimistic_conflicts_total')
+                    time.sleep(random.uniform(0, engine_settings['OPTIMISTIC_BACKOFF'] * 2 ** attempt))
+                    continue
+                if task is not None:
+                    return task
+                break
+            get_metrics().inc('workflow_optimistic_fallbacks_total')
+        return self._complete_task_locked(task_id, user, outcome, completion_data)
+
+    def _get_task_for_completion(self, task_id, lock_instance):
         try:
-            # 使用 select_for_update 锁定任务和实例以防止竞争条件
-            task = WorkflowTask.objects.select_for_update().select_related('instance').get(id=task_id)
-            instance = WorkflowInstance.objects.select_for_update().get(id=task.instance.id)
-            task.instance = instance # 确保任务关联的是锁定的实例
+            task = self.storage.lock_task(task_id, lock_instance=lock_instance)
         except WorkflowTask.DoesNotExist:
             print(f"错误：任务 {task_id} 未找到。")
             raise ValueError(_("任务未找到")) # 返回可翻译的错误
         except WorkflowInstance.DoesNotExist:
-             print(f"错误：任务 {task_id} 关联的实例 {task.instance_id} 未找到。")
+             print(f"错误：任务 {task_id} 关联的实例未找到。")
              raise ValueError(_("任务关联的实例未找到"))
 
-        # TODO: 添加权限检查：'user' 是否允许完成此任务？
-        # (检查 task.assigned_users 或解析指派人标识符)
-        # if not self._can_user_complete_task(user, task):
+        # API 调用已由 CanCompleteTask 调用 can_complete_task 检查
+        # TODO: 其他调用方是否也需要在这里检查 'user' 是否允许完成此任务？
+        # if not self.can_complete_task(user, task):
         #     raise PermissionError(_("用户无权完成此任务"))
 
-        if task.status == TaskStatusModel.Status.COMPLETED:
-            print(f"警告：任务 {task_id} 已完成。")
-            # 可以选择返回任务或引发特定错误，表明重复完成
-            # raise ValueError(_("任务已完成"))
-            return task
-
         if task.status == TaskStatusModel.Status.CANCELED:
             print(f"警告：任务 {task_id} 已取消，无法完成。")
             raise ValueError(_("任务已取消"))
+        return task
 
-
+    def _record_task_completion(self, task, user, outcome, completion_data):
+        """在内存中把任务标记为完成并记录历史 (由调用方保存)，返回要合并到实例 payload 的任务结果"""
         task.status = TaskStatusModel.Status.COMPLETED
         task.outcome = outcome
         task.completion_data = completion_data or {}
         task.completed_at = timezone.now()
         task.completed_by = user
-        task.save()
-
-        # 将任务结果合并到实例 payload 中，以便后续节点（如决策节点）使用
-        task_result_payload = {
-            f"{task.node_id}_outcome": outcome,
-            f"{task.node_id}_completion_data": task.completion_data,
-            f"{task.node_id}_completed_by": user.username # 或 user.id
-        }
-        # instance.payload.update(task_result_payload) # advance_workflow 现在处理合并
-        # instance.save() # advance_workflow 会保存
 
         self._log_history(
-            instance,
+            task.instance,
             WorkflowHistory.EventType.TASK_COMPLETED,
             node_id=task.node_id,
             task=task,
@@ -436,9 +850,69 @@ class WorkflowEngineService:
             details={'结果': outcome, '完成数据': task.completion_data}
         )
 
+        return self._task_result_payload(task.node_id, outcome, task.completion_data, user)
+
+    def _task_result_payload(self, node_id, outcome, completion_data, user):
+        # 将任务结果合并到实例 payload 中，以便后续节点（如决策节点）使用
+        return {
+            f"{node_id}_outcome": outcome,
+            f"{node_id}_completion_data": completion_data,
+            f"{node_id}_completed_by": user.username if user else None # 或 user.id；None 表示系统自动完成 (例如超时)
+        }
+
+    @storage_atomic
+    @batches_history
+    def _complete_task_locked(self, task_id, user, outcome, completion_data=None):
+        task = self._get_task_for_completion(task_id, lock_instance=True)
+        if task.status == TaskStatusModel.Status.COMPLETED:
+            print(f"警告：任务 {task_id} 已完成。")
+            # 可以选择返回任务或引发特定错误，表明重复完成
+            # raise ValueError(_("任务已完成"))
+            return task
+        instance = task.instance
+        # 定义单独读取 (不加锁)，避免 FOR UPDATE 连带锁住同一定义的所有实例
+        graph = self._get_graph(instance.definition)
+
+        task_result_payload = self._record_task_completion(task, user, outcome, completion_data)
+        self.storage.save_task(task)
+
         # 从生成此任务的节点推进工作流
-        self.advance_workflow(instance, task.node_id, task_result_payload) # 将任务结果传递下去
+        self.advance_workflow(instance, task.node_id, task_result_payload, graph=graph, instance_locked=True) # 将任务结果传递下去
+
+        return task
+
+    @storage_atomic
+    @batches_history
+    def _complete_task_optimistic(self, task_id, user, outcome, completion_data=None):
+        """
+        乐观并发完成任务：只锁任务行，实例不加锁读取并在内存中推进 (规则求值、指派解析都不持有实例锁)，
+        然后用 UPDATE ... WHERE lock_version = 读取时的版本 写回实例。并发的兄弟分支先提交时更新 0 行，
+        抛出 InstanceVersionConflict，整个事务 (包括任务状态和历史) 回滚，由 complete_task 重新读取后重试。
+        实例行锁只从这条 UPDATE 持有到提交，其间只有本次推进产生的插入。
+        实例不在运行中或节点已不在定义中等少见情况返回 None，由调用方走加锁路径处理。
+        """
+        task = self._get_task_for_completion(task_id, lock_instance=False)
+        if task.status == TaskStatusModel.Status.COMPLETED:
+            print(f"警告：任务 {task_id} 已完成。")
+            return task
+        instance = task.instance
+        graph = self._get_graph(instance.definition)
+        if instance.status not in (InstanceStatusModel.Status.RUNNING, InstanceStatusModel.Status.SUSPENDED) or graph.node(task.node_id) is None:
+            return None
+
+        expected_version = instance.lock_version
+        task_result_payload = self._record_task_completion(task, user, outcome, completion_data)
+        writer = BulkStartWriter(self) # 推进中创建的任务和作业先收集在内存中，版本检查通过后再写入
+        self._advance_in_memory(
+            instance, graph, task.node_id, task_result_payload, create_task=writer.create_task, enqueue_job=writer.enqueue_job
+        )
+        if not self.storage.update_instance_if_version(instance, expected_version):
+            raise InstanceVersionConflict(instance.pk)
 
+        self.storage.save_task(task)
+        writer.flush()
+        if instance.events_since_snapshot >= self.SNAPSHOT_EVERY_EVENTS:
+            self._history_buffer.snapshot_due[instance.pk] = instance
         return task
 
 # 实例化服务供视图使用
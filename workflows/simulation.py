@@ -0,0 +1,192 @@
+# workflows/simulation.py
+"""
+工作流定义的模拟运行 (dry-run)：发布前估算路径长度、决策分支概率和各指派对象的任务量。
+
+模拟不访问数据库：SimulationEngine 继承 WorkflowEngineService，推进循环 (_advance_in_memory)、
+决策条件求值 (RuleEvaluator) 和任务配置解析与真实引擎完全相同，只替换写库的几个环节：
+- 历史事件不写入，只累加到报告 (节点访问次数、决策分支走向)；
+- 用户任务和异步作业不写入，放进内存中的待办队列，由模拟器按配置的结果分布依次"完成"。
+实例和任务都是未保存的模型对象，指派人不解析为具体用户，任务量按 "类型:标识" 统计。
+
+待办按先进先出完成 (并行分支依次到达汇聚节点)；用户任务的结果按 outcomes 中该节点的权重随机抽取，
+未配置的节点一律为 DEFAULT_OUTCOME；服务任务 / 通知作业的结果取 job_results 中该节点的值 (默认空字典)。
+"""
+import copy
+import random
+import time
+from bisect import bisect
+from collections import Counter, deque
+from itertools import accumulate
+
+from .graph import DefinitionValidationError, validate_definition
+from .models import WorkflowHistory, WorkflowInstance
+from .services import WorkflowEngineService
+
+DEFAULT_OUTCOME = 'approved'
+# 一个实例最多完成的任务 / 作业数，超过即截断 (例如驳回后重新提交的环在结果分布下很难走出)
+DEFAULT_MAX_STEPS = 1000
+
+
+def _percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class SimulationReport:
+    """模拟结果的累计值；as_dict() 给出按实例数归一化后的报告"""
+
+    def __init__(self, errors=()):
+        self.errors = list(errors)   # 定义校验错误 (仍可模拟，但结果可能不可靠)
+        self.instances = 0
+        self.statuses = Counter()     # 结束时的实例状态
+        self.node_visits = Counter()  # 节点ID -> 进入次数
+        self.branches = Counter()     # (决策节点ID, 目标节点ID) -> 次数
+        self.outcomes = Counter()     # (节点ID, 结果) -> 次数
+        self.task_load = Counter()    # "类型:标识" -> 任务数
+        self.jobs = Counter()         # 节点ID -> 作业数
+        self.stalled = Counter()      # 结束时仍在运行且没有待办的活动节点 -> 次数
+        self.truncated = 0            # 超过 max_steps 被截断的实例数
+        self.path_lengths = []        # 每个实例进入的节点数
+        self.seconds = 0.0
+
+    def as_dict(self):
+        instances = self.instances or 1
+        lengths = sorted(self.path_lengths) or [0]
+        decisions = Counter()
+        for (decision, _target), count in self.branches.items():
+            decisions[decision] += count
+        branch_probabilities = {}
+        for (decision, target), count in sorted(self.branches.items()):
+            branch_probabilities.setdefault(decision, {})[target] = round(count / decisions[decision], 4)
+        outcomes = {}
+        for (node_id, outcome), count in sorted(self.outcomes.items()):
+            outcomes.setdefault(node_id, {})[outcome] = count
+        return {
+            'instances': self.instances,
+            'seconds': round(self.seconds, 3),
+            'instances_per_second': round(self.instances / self.seconds, 1) if self.seconds else None,
+            'errors': self.errors,
+            'statuses': {str(status): count for status, count in self.statuses.items()},
+            'truncated': self.truncated,
+            'path_length': {
+                'min': lengths[0],
+                'mean': round(sum(lengths) / len(lengths), 2),
+                'p50': _percentile(lengths, 0.5),
+                'p95': _percentile(lengths, 0.95),
+                'max': lengths[-1],
+            },
+            'node_visits': {
+                node_id: {'count': count, 'per_instance': round(count / instances, 4)}
+                for node_id, count in self.node_visits.most_common()
+            },
+            'branch_probabilities': branch_probabilities,
+            'outcomes': outcomes,
+            'task_load': {
+                assignee: {'tasks': count, 'per_instance': round(count / instances, 4)}
+                for assignee, count in self.task_load.most_common()
+            },
+            'jobs': dict(self.jobs.most_common()),
+            'stalled_nodes': dict(self.stalled.most_common()),
+        }
+
+
+class SimulationEngine(WorkflowEngineService):
+    """推进逻辑与 WorkflowEngineService 相同；历史只计入报告，任务和作业只放进内存待办队列"""
+
+    def __init__(self, report):
+        super().__init__()
+        self.report = report
+        self.pending = deque() # (节点ID, 是否为用户任务)
+        self.entered = 0       # 当前实例进入的节点数
+
+    def _log_history(self, instance, event_type, node_id=None, task=None, user=None, details=None):
+        if event_type == WorkflowHistory.EventType.NODE_ENTERED:
+            self.entered += 1
+            self.report.node_visits[node_id] += 1
+            decision = (details or {}).get('来自决策节点')
+            if decision is not None:
+                self.report.branches[(decision, node_id)] += 1
+
+    def _create_task(self, instance, node_definition):
+        task = self._build_task(instance, node_definition)
+        self.report.task_load[f"{task.assignee_type}:{task.assignee_identifier}"] += 1
+        self.pending.append((task.node_id, True))
+        return task
+
+    def _enqueue_job(self, instance, node_definition, node_type):
+        node_id = node_definition.get('id')
+        self.report.jobs[node_id] += 1
+        self.pending.append((node_id, False))
+
+
+class WorkflowSimulator:
+    """
+    用法:
+        simulator = WorkflowSimulator(definition_json, outcomes={'review': {'approved': 8, 'rejected': 2}}, seed=1)
+        report = simulator.run(sample_payloads, instances=10000)
+    定义没有开始节点时抛出 DefinitionValidationError；其他校验错误记录在报告的 errors 中。
+    """
+
+    def __init__(self, definition_json, outcomes=None, job_results=None, seed=None, max_steps=DEFAULT_MAX_STEPS):
+        self.graph, self.errors = validate_definition(definition_json)
+        if self.graph.start_node is None:
+            raise DefinitionValidationError(self.errors)
+        # 节点ID -> (结果列表, 累计权重)，抽样为一次二分查找
+        self.outcomes = {
+            node_id: (list(weights), list(accumulate(weights.values())))
+            for node_id, weights in (outcomes or {}).items() if weights and sum(weights.values()) > 0
+        }
+        self.job_results = job_results or {}
+        self.max_steps = max_steps
+        self.random = random.Random(seed)
+
+    def choose_outcome(self, node_id):
+        choices = self.outcomes.get(node_id)
+        if choices is None:
+            return DEFAULT_OUTCOME
+        names, cumulative = choices
+        return names[bisect(cumulative, self.random.random() * cumulative[-1])]
+
+    def run(self, payloads, instances):
+        """依次用 payloads 中的样本 (循环使用) 模拟 instances 个实例，返回 SimulationReport"""
+        payloads = list(payloads) or [{}]
+        report = SimulationReport(self.errors)
+        engine = SimulationEngine(report)
+        begin = time.perf_counter()
+        for index in range(instances):
+            self._run_instance(engine, report, copy.deepcopy(payloads[index % len(payloads)]))
+        report.seconds = time.perf_counter() - begin
+        return report
+
+    def _run_instance(self, engine, report, payload):
+        instance = WorkflowInstance(status=WorkflowInstance.Status.RUNNING, payload=payload, current_node_ids=[], join_counters={})
+        engine.pending.clear()
+        engine.entered = 0
+        engine._advance_in_memory(instance, self.graph, self.graph.start_node.get('id'))
+
+        steps = 0
+        while engine.pending and instance.status == WorkflowInstance.Status.RUNNING:
+            if steps >= self.max_steps:
+                report.truncated += 1
+                break
+            steps += 1
+            node_id, is_task = engine.pending.popleft()
+            if is_task:
+                outcome = self.choose_outcome(node_id)
+                report.outcomes[(node_id, outcome)] += 1
+                result = engine._task_result_payload(node_id, outcome, {}, None)
+            else:
+                result = {f"{node_id}_result": self.job_results.get(node_id, {})}
+            engine._advance_in_memory(instance, self.graph, node_id, result)
+        else:
+            if instance.status == WorkflowInstance.Status.RUNNING:
+                report.stalled.update(instance.current_node_ids)
+
+        report.instances += 1
+        report.statuses[instance.status] += 1
+        report.path_lengths.append(engine.entered)
+
+
+def simulate_definition(definition_json, payloads, instances, outcomes=None, job_results=None, seed=None, max_steps=DEFAULT_MAX_STEPS):
+    """WorkflowSimulator 的便捷入口，返回 SimulationReport"""
+    simulator = WorkflowSimulator(definition_json, outcomes=outcomes, job_results=job_results, seed=seed, max_steps=max_steps)
+    return simulator.run(payloads, instances)
@@ -0,0 +1,136 @@
+# workflows/snapshots.py
+"""
+由历史事件重建实例状态，以及定期快照。
+
+WorkflowHistory 是实例状态变化的事件日志。改变状态的事件都在持有实例行锁的事务中写入
+(启动 / 推进 / 失败)，因此按 (timestamp, id) 排序后依次折叠即可得到 payload、活动节点、
+汇聚计数和状态：
+- INSTANCE_STARTED   初始负载
+- NODE_EXITED        合并节点的完成数据到 payload，移出活动节点
+- NODE_ENTERED       加入活动节点 (汇聚节点触发时清零其计数)
+- JOIN_ARRIVED       更新汇聚节点的到达计数
+- INSTANCE_COMPLETED / INSTANCE_FAILED / INSTANCE_CANCELED / INSTANCE_SUSPENDED  更新状态
+其他事件 (任务创建、超时、评论等) 不影响这些字段。
+
+WorkflowInstanceSnapshot 保存某一事件位置上的状态；重建时只需读取最新快照和它之后的尾部事件。
+"""
+import copy
+
+from django.db.models import Q
+
+from .models import WorkflowHistory, WorkflowInstance, WorkflowInstanceSnapshot
+
+EventType = WorkflowHistory.EventType
+
+_STATUS_EVENTS = {
+    EventType.INSTANCE_COMPLETED: WorkflowInstance.Status.COMPLETED,
+    EventType.INSTANCE_FAILED: WorkflowInstance.Status.FAILED,
+    EventType.INSTANCE_CANCELED: WorkflowInstance.Status.CANCELED,
+    EventType.INSTANCE_SUSPENDED: WorkflowInstance.Status.SUSPENDED,
+}
+
+
+class InstanceState:
+    """折叠历史得到的实例状态；sequence 为已折叠的事件数，last_event 为最后一条事件的 (timestamp, id)"""
+
+    def __init__(self, status=None, payload=None, current_node_ids=(), join_counters=None, sequence=0, last_event=None):
+        self.status = status
+        self.payload = payload if payload is not None else {}
+        self.active_nodes = dict.fromkeys(current_node_ids)
+        self.join_counters = join_counters if join_counters is not None else {}
+        self.sequence = sequence
+        self.last_event = last_event
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        last_event = (snapshot.last_event_timestamp, snapshot.last_event_id) if snapshot.last_event_id else None
+        return cls(
+            status=snapshot.status,
+            payload=copy.deepcopy(snapshot.payload),
+            current_node_ids=snapshot.current_node_ids,
+            join_counters=dict(snapshot.join_counters),
+            sequence=snapshot.history_sequence,
+            last_event=last_event,
+        )
+
+    @property
+    def current_node_ids(self):
+        return list(self.active_nodes)
+
+    def apply(self, event_type, node_id, details):
+        details = details or {}
+        if event_type == EventType.INSTANCE_STARTED:
+            self.status = WorkflowInstance.Status.RUNNING
+            self.payload = copy.deepcopy(details.get('初始负载') or {})
+            self.active_nodes = {}
+            self.join_counters = {}
+        elif event_type == EventType.NODE_EXITED:
+            self.payload.update(details)
+            self.active_nodes.pop(node_id, None)
+        elif event_type == EventType.NODE_ENTERED:
+            self.join_counters.pop(node_id, None)
+            self.active_nodes.setdefault(node_id)
+        elif event_type == EventType.JOIN_ARRIVED:
+            self.join_counters[node_id] = details.get('已到达', self.join_counters.get(node_id, 0) + 1)
+        elif event_type in _STATUS_EVENTS:
+            self.status = _STATUS_EVENTS[event_type]
+
+    def differences(self, instance):
+        """与数据库中实例的差异，{字段: (重建值, 实际值)}；活动节点按集合比较"""
+        diff = {}
+        if self.status != instance.status:
+            diff['status'] = (self.status, instance.status)
+        if self.payload != instance.payload:
+            diff['payload'] = (self.payload, instance.payload)
+        if set(self.active_nodes) != set(instance.current_node_ids):
+            diff['current_node_ids'] = (self.current_node_ids, instance.current_node_ids)
+        if self.join_counters != (instance.join_counters or {}):
+            diff['join_counters'] = (self.join_counters, instance.join_counters)
+        return diff
+
+
+def events_after(instance_id, last_event=None):
+    """实例在 last_event = (timestamp, id) 之后的历史事件，走 (instance, timestamp, id) 索引"""
+    events = WorkflowHistory.objects.filter(instance_id=instance_id)
+    if last_event is not None:
+        timestamp, event_id = last_event
+        events = events.filter(Q(timestamp__gt=timestamp) | Q(timestamp=timestamp, id__gt=event_id))
+    return events.order_by('timestamp', 'id')
+
+
+def latest_snapshot(instance_id):
+    return WorkflowInstanceSnapshot.objects.filter(instance_id=instance_id).order_by('-history_sequence').first()
+
+
+def rebuild_instance_state(instance_id, use_snapshot=True):
+    """读取最新快照 (use_snapshot=False 时从头开始) 并折叠其后的事件，返回 InstanceState"""
+    snapshot = latest_snapshot(instance_id) if use_snapshot else None
+    state = InstanceState.from_snapshot(snapshot) if snapshot else InstanceState()
+    tail = events_after(instance_id, state.last_event).values_list('timestamp', 'id', 'event_type', 'node_id', 'details')
+    for timestamp, event_id, event_type, node_id, details in tail.iterator():
+        state.apply(event_type, node_id, details)
+        state.sequence += 1
+        state.last_event = (timestamp, event_id)
+    return state
+
+
+def take_snapshot(instance):
+    """
+    为实例记录快照：状态取自 instance (须是当前事务中持有行锁的最新状态，且本事务的历史已写入)，
+    事件位置由上一快照之后的尾部确定。返回新快照；没有新事件时返回 None。
+    """
+    previous = latest_snapshot(instance.pk)
+    last_event = (previous.last_event_timestamp, previous.last_event_id) if previous and previous.last_event_id else None
+    tail = list(events_after(instance.pk, last_event).values_list('timestamp', 'id'))
+    if not tail:
+        return None
+    return WorkflowInstanceSnapshot.objects.create(
+        instance=instance,
+        status=instance.status,
+        payload=instance.payload,
+        current_node_ids=instance.current_node_ids,
+        join_counters=instance.join_counters,
+        history_sequence=(previous.history_sequence if previous else 0) + len(tail),
+        last_event_timestamp=tail[-1][0],
+        last_event_id=tail[-1][1],
+    )
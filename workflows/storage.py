@@ -0,0 +1,439 @@
+# workflows/storage.py
+"""
+工作流引擎的存储后端。
+
+WorkflowEngineService 的核心路径 (启动 / 批量启动 / 推进 / 完成任务 / 失败) 不直接使用 ORM，
+而是通过 engine.storage 读写实例、任务、作业和历史，并由它提供事务与行锁：
+- OrmStorage        默认后端，即原先的 Django ORM 实现 (select_for_update 行锁、bulk_create 批量写入)；
+- InMemoryStorage   进程内字典，用于单元测试和在不依赖数据库的情况下测量引擎本身的吞吐量。
+后端由 settings.WORKFLOW_ENGINE['STORAGE'] 选择，也可以直接传给 WorkflowEngineService(storage=...)。
+
+待办收件箱、任务超时、卡住实例修复和定义发布仍直接使用 ORM，只能配合 OrmStorage 使用。
+对象都是模型实例 (InMemoryStorage 中从不保存到数据库)，因此引擎的推进逻辑对两种后端完全相同。
+"""
+import contextlib
+import copy
+import threading
+import uuid
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+
+from .metrics import get_metrics
+from .models import WorkflowDefinition, WorkflowHistory, WorkflowInstance, WorkflowJob, WorkflowTask, WorkflowTaskCandidate
+from .snapshots import take_snapshot
+
+
+# 假设用户/角色/组织逻辑可用 (例如，在 'accounts' 应用中)
+# from accounts.services import get_user_manager, get_users_in_role
+
+# --- 用户/组织服务的占位符 ---
+# 用你实际的用户/角色查找逻辑替换
+class OrgChartService:
+    def get_user_manager(self, user):
+        # 实现查找用户经理的逻辑
+        print(f"警告：OrgChartService.get_user_manager 未为用户 {user.id} 实现")
+        return None # 占位符
+
+    def get_users_in_role(self, role_name):
+        # 角色即 Django Group 名称 (与 WorkflowTaskViewSet / CanCompleteTask 一致)
+        User = get_user_model()
+        return User.objects.filter(groups__name=role_name, is_active=True)
+
+org_chart_service = OrgChartService() # 实例化或获取服务
+
+
+class WorkflowStorage:
+    """
+    存储后端接口。引擎在 atomic() 内调用其余方法；lock_* 返回的对象在事务结束前不会被其他事务修改。
+    实例的每次写入递增 lock_version (与 WorkflowInstance.save 一致)。
+    """
+
+    def atomic(self):
+        """事务上下文管理器，可嵌套；出现异常时撤销其中的写入"""
+        raise NotImplementedError
+
+    def in_atomic_block(self):
+        raise NotImplementedError
+
+    def on_commit(self, func):
+        """最外层事务提交后调用 func (不在事务中时立即调用)；事务回滚时丢弃"""
+        raise NotImplementedError
+
+    def get_startable_definition(self, definition_id):
+        """定义的最新启用版本，找不到时抛出 WorkflowDefinition.DoesNotExist"""
+        raise NotImplementedError
+
+    def create_instance(self, instance):
+        raise NotImplementedError
+
+    def create_instances(self, instances):
+        """批量插入 (不递增 lock_version，与 bulk_create 一致)"""
+        raise NotImplementedError
+
+    def save_instance(self, instance):
+        raise NotImplementedError
+
+    def lock_instance(self, instance_id):
+        """加锁读取实例，不存在时抛出 WorkflowInstance.DoesNotExist"""
+        raise NotImplementedError
+
+    def update_instance_if_version(self, instance, expected_version):
+        """lock_version 仍为 expected_version 时写回实例状态并递增版本，返回是否写入"""
+        raise NotImplementedError
+
+    def lock_task(self, task_id, lock_instance=True):
+        """
+        加锁读取任务，task.instance 为其实例 (lock_instance=True 时同时锁定实例，否则为不加锁的读取)。
+        任务不存在时抛出 WorkflowTask.DoesNotExist，实例不存在时抛出 WorkflowInstance.DoesNotExist。
+        """
+        raise NotImplementedError
+
+    def save_task(self, task):
+        """保存任务的状态变化 (同步收件箱索引)"""
+        raise NotImplementedError
+
+    def create_tasks(self, entries):
+        """
+        entries 为 [(未保存的任务, 解析出的用户 ID 列表, 收件箱行)]，写入任务、assigned_users 和收件箱索引
+        (收件箱是 ORM 侧的查询优化，其他后端可以忽略第三项)
+        """
+        raise NotImplementedError
+
+    def create_jobs(self, jobs):
+        raise NotImplementedError
+
+    def add_history(self, entries):
+        raise NotImplementedError
+
+    def take_snapshot(self, instance):
+        """为实例记录状态快照并把 events_since_snapshot 清零，返回是否记录"""
+        raise NotImplementedError
+
+    def resolve_assignees(self, assignee_type, identifier, instance):
+        """把指派配置解析为用户 ID 列表"""
+        raise NotImplementedError
+
+
+class OrmStorage(WorkflowStorage):
+    """Django ORM 实现：事务即数据库事务，锁为 SELECT ... FOR UPDATE"""
+
+    def __init__(self, org_chart=None):
+        self.org_chart = org_chart or org_chart_service
+
+    def atomic(self):
+        return transaction.atomic()
+
+    def in_atomic_block(self):
+        return transaction.get_connection().in_atomic_block
+
+    def on_commit(self, func):
+        transaction.on_commit(func)
+
+    def get_startable_definition(self, definition_id):
+        # 优先选择最新的 active 版本
+        return WorkflowDefinition.objects.filter(
+            # 如果 name 是唯一的，可以直接用 name 查找最新 active 版本
+            # name=definition_name,
+            id=definition_id, # 如果传入的是特定版本的 ID
+            is_active=True
+        ).latest('version') # 或者根据你的逻辑选择版本
+
+    def create_instance(self, instance):
+        instance.save(force_insert=True)
+
+    def create_instances(self, instances):
+        WorkflowInstance.objects.bulk_create(instances)
+
+    def save_instance(self, instance):
+        instance.save() # 一次性保存 payload、current_node_ids 和状态
+
+    def lock_instance(self, instance_id):
+        with get_metrics().timer('workflow_lock_wait_seconds', table='instance'):
+            return WorkflowInstance.objects.select_for_update().get(pk=instance_id)
+
+    def update_instance_if_version(self, instance, expected_version):
+        updated = WorkflowInstance.objects.filter(pk=instance.pk, lock_version=expected_version).update(
+            payload=instance.payload,
+            current_node_ids=instance.current_node_ids,
+            join_counters=instance.join_counters,
+            status=instance.status,
+            completed_at=instance.completed_at,
+            events_since_snapshot=instance.events_since_snapshot,
+            lock_version=expected_version + 1,
+        )
+        if updated:
+            instance.lock_version = expected_version + 1
+        return bool(updated)
+
+    def lock_task(self, task_id, lock_instance=True):
+        metrics = get_metrics()
+        if lock_instance:
+            # 使用 select_for_update 锁定任务和实例以防止竞争条件
+            with metrics.timer('workflow_lock_wait_seconds', table='task'):
+                task = WorkflowTask.objects.select_for_update().select_related('instance').get(id=task_id)
+            task.instance = self.lock_instance(task.instance_id) # 确保任务关联的是锁定的实例
+        else:
+            # 只锁任务行 (OF 限定，不连带锁住 JOIN 的实例行)，实例为不加锁的一致性读
+            with metrics.timer('workflow_lock_wait_seconds', table='task'):
+                task = WorkflowTask.objects.select_for_update(of=('self',)).select_related('instance').get(id=task_id)
+        return task
+
+    def save_task(self, task):
+        task.save()
+        # 任务状态变化后同步到收件箱，一条 UPDATE
+        WorkflowTaskCandidate.objects.filter(task=task).update(status=task.status)
+
+    def create_tasks(self, entries):
+        if not entries:
+            return
+        WorkflowTask.objects.bulk_create([task for task, _user_ids, _candidates in entries]) # 同时填充 created_at
+        Assignment = WorkflowTask.assigned_users.through
+        Assignment.objects.bulk_create(
+            [Assignment(workflowtask_id=task.pk, user_id=user_id) for task, user_ids, _candidates in entries for user_id in user_ids]
+        )
+        # 收件箱行在 bulk_create 填充任务的 created_at 之后才补上创建时间
+        candidates = []
+        for task, _user_ids, task_candidates in entries:
+            for candidate in task_candidates:
+                candidate.created_at = task.created_at
+                candidates.append(candidate)
+        WorkflowTaskCandidate.objects.bulk_create(candidates)
+
+    def create_jobs(self, jobs):
+        if jobs:
+            WorkflowJob.objects.bulk_create(jobs)
+
+    def add_history(self, entries):
+        if entries:
+            WorkflowHistory.objects.bulk_create(entries)
+
+    def take_snapshot(self, instance):
+        if not take_snapshot(instance):
+            return False
+        instance.events_since_snapshot = 0
+        WorkflowInstance.objects.filter(pk=instance.pk).update(events_since_snapshot=0)
+        return True
+
+    def resolve_assignees(self, assignee_type, identifier, instance):
+        """
+        每种类型只做一两次按主键/索引的查询，角色成员通过 values_list 取 ID，不实例化用户对象。
+        """
+        User = get_user_model()
+        user_ids = []
+        if assignee_type == WorkflowTask.AssigneeType.USER:
+            try:
+                # 假设 identifier 是用户 ID
+                user_ids = list(User.objects.filter(pk=identifier).values_list('pk', flat=True)) # 使用 pk 更通用
+            except (ValueError, TypeError):
+                pass
+            if not user_ids:
+                print(f"错误：指派人用户 ID {identifier} 未找到。")
+        elif assignee_type == WorkflowTask.AssigneeType.ROLE:
+             # 假设 identifier 是角色名称
+            user_ids = list(self.org_chart.get_users_in_role(identifier).values_list('pk', flat=True))
+        elif assignee_type == WorkflowTask.AssigneeType.RULE:
+            if identifier == 'RequesterManager':
+                 # 假设 payload 中有 'requester_id'
+                 requester_id = instance.payload.get('requester_id')
+                 if requester_id:
+                     try:
+                        requester = User.objects.get(pk=requester_id)
+                        manager = self.org_chart.get_user_manager(requester)
+                        if manager:
+                            user_ids.append(manager.pk)
+                        else:
+                            print(f"警告：用户 {requester_id} 的经理未找到。")
+                     except User.DoesNotExist:
+                         print(f"错误：申请人用户 ID {requester_id} 未找到。")
+                 else:
+                     print("错误：无法解析 'RequesterManager'，payload 中缺少 'requester_id'。")
+            # 根据需要添加更多规则
+        return user_ids
+
+
+_MISSING = object()
+
+
+def _as_uuid(value):
+    return value if isinstance(value, uuid.UUID) else uuid.UUID(str(value))
+
+
+def _copy_instance(instance):
+    copied = copy.copy(instance)
+    copied.payload = copy.deepcopy(instance.payload)
+    copied.current_node_ids = list(instance.current_node_ids)
+    copied.join_counters = dict(instance.join_counters or {})
+    return copied
+
+
+class InMemoryStorage(WorkflowStorage):
+    """
+    进程内实现。读写的都是对象的副本，未提交的修改对其他读取不可见；
+    atomic() 持有一把全局可重入锁 (所有事务串行，相当于表级锁)，异常时按撤销日志回滚到进入时的状态。
+    roles 为 {角色名: [用户ID]}，managers 为 {用户ID: 经理用户ID}，用于指派解析；USER 指派直接使用标识。
+    定义通过 add_definition 加入。
+    """
+
+    def __init__(self, roles=None, managers=None):
+        self.definitions = {}
+        self.instances = {}
+        self.tasks = {}
+        self.assignments = {} # 任务 ID -> 用户 ID 列表
+        self.jobs = {}
+        self.history = []
+        self.roles = {name: list(user_ids) for name, user_ids in (roles or {}).items()}
+        self.managers = dict(managers or {})
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._undo = None # 事务中的撤销日志：(存储字典, 键, 原值)；存储为 None 表示历史列表截断到该长度
+        self._on_commit = None # 事务中登记的提交回调
+
+    @contextlib.contextmanager
+    def atomic(self):
+        with self._lock:
+            outermost = self._depth == 0
+            if outermost:
+                self._undo = []
+                self._on_commit = []
+            mark, callback_mark = len(self._undo), len(self._on_commit)
+            self._depth += 1
+            try:
+                yield
+            except BaseException:
+                self._rollback(mark)
+                del self._on_commit[callback_mark:]
+                raise
+            finally:
+                self._depth -= 1
+                if outermost:
+                    self._undo = None
+                    callbacks, self._on_commit = self._on_commit, None
+            if outermost:
+                for callback in callbacks:
+                    callback()
+
+    def _rollback(self, mark):
+        for store, key, previous in reversed(self._undo[mark:]):
+            if store is None:
+                del self.history[key:]
+            elif previous is _MISSING:
+                store.pop(key, None)
+            else:
+                store[key] = previous
+        del self._undo[mark:]
+
+    def _put(self, store, key, value):
+        if self._undo is not None:
+            self._undo.append((store, key, store.get(key, _MISSING)))
+        store[key] = value
+
+    def in_atomic_block(self):
+        return self._depth > 0
+
+    def on_commit(self, func):
+        with self._lock:
+            if self._on_commit is not None:
+                self._on_commit.append(func)
+                return
+        func()
+
+    def add_definition(self, definition):
+        with self._lock:
+            self.definitions[definition.pk] = definition
+        return definition
+
+    def get_startable_definition(self, definition_id):
+        with self._lock:
+            try:
+                definition = self.definitions[_as_uuid(definition_id)]
+            except (KeyError, ValueError):
+                raise WorkflowDefinition.DoesNotExist(definition_id)
+        if not definition.is_active:
+            raise WorkflowDefinition.DoesNotExist(definition_id)
+        return definition
+
+    def create_instance(self, instance):
+        self.save_instance(instance)
+
+    def create_instances(self, instances):
+        with self._lock:
+            for instance in instances:
+                self._put(self.instances, instance.pk, _copy_instance(instance))
+
+    def save_instance(self, instance):
+        with self._lock:
+            instance.lock_version += 1
+            self._put(self.instances, instance.pk, _copy_instance(instance))
+
+    def get_instance(self, instance_id):
+        """不加锁读取 (副本)，不存在时抛出 WorkflowInstance.DoesNotExist"""
+        with self._lock:
+            try:
+                return _copy_instance(self.instances[_as_uuid(instance_id)])
+            except (KeyError, ValueError):
+                raise WorkflowInstance.DoesNotExist(instance_id)
+
+    def lock_instance(self, instance_id):
+        return self.get_instance(instance_id) # 事务本身已串行
+
+    def update_instance_if_version(self, instance, expected_version):
+        with self._lock:
+            stored = self.instances.get(instance.pk)
+            if stored is None or stored.lock_version != expected_version:
+                return False
+            instance.lock_version = expected_version + 1
+            self._put(self.instances, instance.pk, _copy_instance(instance))
+            return True
+
+    def lock_task(self, task_id, lock_instance=True):
+        with self._lock:
+            try:
+                task = copy.copy(self.tasks[_as_uuid(task_id)])
+            except (KeyError, ValueError):
+                raise WorkflowTask.DoesNotExist(task_id)
+            task.instance = self.get_instance(task.instance_id)
+            return task
+
+    def get_tasks(self, instance_id, status=None):
+        """实例的任务 (副本)，按创建顺序"""
+        instance_id = _as_uuid(instance_id)
+        with self._lock:
+            return [
+                copy.copy(task) for task in self.tasks.values()
+                if task.instance_id == instance_id and (status is None or task.status == status)
+            ]
+
+    def save_task(self, task):
+        with self._lock:
+            self._put(self.tasks, task.pk, copy.copy(task))
+
+    def create_tasks(self, entries):
+        with self._lock:
+            for task, user_ids, _candidates in entries:
+                self._put(self.tasks, task.pk, copy.copy(task))
+                self._put(self.assignments, task.pk, list(user_ids))
+
+    def create_jobs(self, jobs):
+        with self._lock:
+            for job in jobs:
+                self._put(self.jobs, job.pk, job)
+
+    def add_history(self, entries):
+        with self._lock:
+            if self._undo is not None:
+                self._undo.append((None, len(self.history), None))
+            self.history.extend(entries)
+
+    def take_snapshot(self, instance):
+        return False # 历史只保存在内存中，不需要快照
+
+    def resolve_assignees(self, assignee_type, identifier, instance):
+        if assignee_type == WorkflowTask.AssigneeType.USER:
+            return [identifier]
+        if assignee_type == WorkflowTask.AssigneeType.ROLE:
+            return list(self.roles.get(identifier, ()))
+        if assignee_type == WorkflowTask.AssigneeType.RULE and identifier == 'RequesterManager':
+            manager_id = self.managers.get(instance.payload.get('requester_id'))
+            return [manager_id] if manager_id is not None else []
+        return []
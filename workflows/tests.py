@@ -1,3 +1,1281 @@
-from django.test import TestCase
+import gzip
+import json
+import os
+import re
+import tempfile
+from contextlib import redirect_stdout
+from datetime import timedelta
+from io import StringIO
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.contrib.auth.models import Group
+from django.db import OperationalError, connection, transaction
+from django.db.models import F
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from rest_framework.test import APIClient
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from .archive import archive_instances, decode_document
+from .executors import WorkflowWorker, claim_jobs, complete_job, fail_job_attempt, register_service_handler, requeue_expired_jobs
+from .graph import CompiledGraph, DefinitionValidationError, GraphCache, NodeType, graph_cache, validate_definition
+from .metrics import NullMetrics, get_metrics
+from .repair import StuckReason, iter_stuck_instances
+from .scheduler import SlaScheduler
+from .simulation import simulate_definition
+from .snapshots import rebuild_instance_state
+from .roles import get_user_role_names
+from .rules import RuleSyntaxError, compile_condition, parse_condition, rule_evaluator
+from .models import (
+    ArchivedWorkflowInstance, WorkflowDefinition, WorkflowHistory, WorkflowInstance, WorkflowInstanceSnapshot, WorkflowJob, WorkflowTask,
+    WorkflowTaskCandidate,
+)
+from .services import InstanceVersionConflict, WorkflowEngineService, workflow_engine
+from .storage import InMemoryStorage
+from .views import WorkflowInstanceViewSet
+
+
+def approval_node(node_id, assignee_type='ROLE', assignee_identifier='approvers'):
+    config = {'assigneeType': assignee_type, 'assigneeIdentifier': assignee_identifier}
+    return {'id': node_id, 'type': 'approvalNode', 'data': {'config': config}}
+
+
+def linear_definition():
+    """start -> a -> b -> end"""
+    return {
+        'nodes': [{'id': 'start', 'type': 'startNode'}, approval_node('a'), approval_node('b'), {'id': 'end', 'type': 'endNode'}],
+        'edges': [
+            {'id': 'e1', 'source': 'start', 'target': 'a'},
+            {'id': 'e2', 'source': 'a', 'target': 'b'},
+            {'id': 'e3', 'source': 'b', 'target': 'end'},
+        ],
+    }
+
+
+def branching_definition():
+    """start -> a -> (b, c 并行) -> end"""
+    return {
+        'nodes': [
+            {'id': 'start', 'type': 'startNode'}, approval_node('a'), approval_node('b'), approval_node('c'),
+            {'id': 'end', 'type': 'endNode'},
+        ],
+        'edges': [
+            {'id': 'e1', 'source': 'start', 'target': 'a'},
+            {'id': 'e2', 'source': 'a', 'target': 'b'},
+            {'id': 'e3', 'source': 'a', 'target': 'c'},
+            {'id': 'e4', 'source': 'b', 'target': 'end'},
+            {'id': 'e5', 'source': 'c', 'target': 'end'},
+        ],
+    }
+
+
+def gateway_chain_definition(length):
+    """start -> gw_1 -> ... -> gw_length (决策节点) -> a -> end"""
+    gateways = [f'gw_{i}' for i in range(1, length + 1)]
+    node_ids = ['start'] + gateways + ['a', 'end']
+    nodes = [{'id': 'start', 'type': 'startNode'}]
+    nodes += [{'id': gw, 'type': 'decisionNode'} for gw in gateways]
+    nodes += [approval_node('a'), {'id': 'end', 'type': 'endNode'}]
+    edges = [
+        {'id': f'e_{source}', 'source': source, 'target': target, 'data': {'condition': 'payload.days >= 0'}}
+        for source, target in zip(node_ids, node_ids[1:])
+    ]
+    return {'nodes': nodes, 'edges': edges}
+
+
+def fan_out_definition(width):
+    """start -> split -> (head_1 ... head_width 并行) -> join -> final -> end"""
+    heads = [f'head_{i}' for i in range(1, width + 1)]
+    nodes = [{'id': 'start', 'type': 'startNode'}, {'id': 'split', 'type': 'parallelSplitNode'}]
+    nodes += [approval_node(head) for head in heads]
+    nodes += [{'id': 'join', 'type': 'parallelJoinNode'}, approval_node('final'), {'id': 'end', 'type': 'endNode'}]
+    edges = [{'id': 'e_start', 'source': 'start', 'target': 'split'}]
+    edges += [{'id': f'e_split_{head}', 'source': 'split', 'target': head} for head in heads]
+    edges += [{'id': f'e_{head}_join', 'source': head, 'target': 'join'} for head in heads]
+    edges += [{'id': 'e_join', 'source': 'join', 'target': 'final'}, {'id': 'e_final', 'source': 'final', 'target': 'end'}]
+    return {'nodes': nodes, 'edges': edges}
+
+
+def statements(captured_queries):
+    """去掉 SAVEPOINT / RELEASE 等事务控制语句，只保留实际的读写"""
+    return [q['sql'] for q in captured_queries if q['sql'].split(' ', 1)[0] in ('SELECT', 'INSERT', 'UPDATE', 'DELETE')]
+
+
+class WorkflowEngineTestMixin:
+    def setUp(self):
+        self.user = get_user_model().objects.create(username='approver')
+
+    def start(self, definition_json, payload=None, name='test'):
+        definition = WorkflowDefinition.objects.create(name=name, definition_json=definition_json)
+        return workflow_engine.start_instance(definition.id, payload or {}, user=self.user)
+
+    def pending_task(self, instance, node_id):
+        return WorkflowTask.objects.get(instance=instance, node_id=node_id, status=WorkflowTask.Status.PENDING)
+
+    def single_task_definition(self, assignee_type, assignee_identifier):
+        return {
+            'nodes': [{'id': 'start', 'type': 'startNode'}, approval_node('t', assignee_type, assignee_identifier), {'id': 'end', 'type': 'endNode'}],
+            'edges': [{'id': 'e1', 'source': 'start', 'target': 't'}, {'id': 'e2', 'source': 't', 'target': 'end'}],
+        }
+
+
+class WorkflowEngineTestBase(WorkflowEngineTestMixin, TestCase):
+    pass
+
+
+class HistoryBatchingTests(WorkflowEngineTestBase):
+    def assert_single_history_insert(self, sqls):
+        history_table = WorkflowHistory._meta.db_table
+        inserts = [sql for sql in sqls if sql.startswith('INSERT') and history_table in sql]
+        self.assertEqual(len(inserts), 1, inserts)
+
+    def test_complete_task_linear_query_count(self):
+        instance = self.start(linear_definition())
+        task = self.pending_task(instance, 'a')
+
+        with CaptureQueriesContext(connection) as ctx:
+            workflow_engine.complete_task(task.id, self.user, 'approved')
+        sqls = statements(ctx.captured_queries)
+        self.assert_single_history_insert(sqls)
+        self.assertEqual(len(sqls), 9, sqls)
+
+        events = list(WorkflowHistory.objects.filter(instance=instance).values_list('event_type', flat=True))
+        self.assertEqual(events[-4:], ['TASK_COMPLETED', 'NODE_EXITED', 'NODE_ENTERED', 'TASK_CREATED'])
+
+    def test_complete_task_branching_query_count(self):
+        instance = self.start(branching_definition(), name='branching')
+        task = self.pending_task(instance, 'a')
+
+        with CaptureQueriesContext(connection) as ctx:
+            workflow_engine.complete_task(task.id, self.user, 'approved')
+        sqls = statements(ctx.captured_queries)
+        self.assert_single_history_insert(sqls)
+        self.assertEqual(len(sqls), 11, sqls)
+
+        instance.refresh_from_db()
+        self.assertEqual(sorted(instance.current_node_ids), ['b', 'c'])
+
+    def test_history_timestamps_preserve_order(self):
+        instance = self.start(linear_definition())
+        timestamps = list(WorkflowHistory.objects.filter(instance=instance).values_list('timestamp', flat=True))
+        self.assertEqual(timestamps, sorted(set(timestamps)))
+
+
+class AdvanceLoopTests(WorkflowEngineTestBase):
+    def test_gateway_chain_costs_constant_queries(self):
+        counts = []
+        for length in (1, 50):
+            with CaptureQueriesContext(connection) as ctx:
+                instance = self.start(gateway_chain_definition(length), {'days': 2}, name=f'chain-{length}')
+            counts.append(len(statements(ctx.captured_queries)))
+            instance.refresh_from_db()
+            self.assertEqual(instance.current_node_ids, ['a'])
+        self.assertEqual(counts[0], counts[1])
+
+    def test_linear_instance_completes_at_end_node(self):
+        instance = self.start(linear_definition())
+        for node_id in ('a', 'b'):
+            workflow_engine.complete_task(self.pending_task(instance, node_id).id, self.user, 'approved')
+        instance.refresh_from_db()
+        self.assertEqual(instance.status, WorkflowInstance.Status.COMPLETED)
+        self.assertEqual(instance.current_node_ids, [])
+
+    def test_parallel_branches_complete_after_last_branch(self):
+        instance = self.start(branching_definition(), name='branching')
+        workflow_engine.complete_task(self.pending_task(instance, 'a').id, self.user, 'approved')
+        workflow_engine.complete_task(self.pending_task(instance, 'b').id, self.user, 'approved')
+        instance.refresh_from_db()
+        self.assertEqual(instance.status, WorkflowInstance.Status.RUNNING)
+        self.assertEqual(instance.current_node_ids, ['c'])
+
+        workflow_engine.complete_task(self.pending_task(instance, 'c').id, self.user, 'approved')
+        instance.refresh_from_db()
+        self.assertEqual(instance.status, WorkflowInstance.Status.COMPLETED)
+
+    def test_decision_without_matching_edge_stays_active(self):
+        instance = self.start(gateway_chain_definition(1), {'days': -1}, name='no-match')
+        instance.refresh_from_db()
+        self.assertEqual(instance.status, WorkflowInstance.Status.RUNNING)
+        self.assertEqual(instance.current_node_ids, ['gw_1'])
+        self.assertFalse(WorkflowTask.objects.filter(instance=instance).exists())
+
+
+class TaskInboxTests(WorkflowEngineTestBase):
+    def inbox(self, user, status=None):
+        roles = list(user.groups.values_list('name', flat=True))
+        return set(
+            WorkflowTask.objects.filter(id__in=workflow_engine.inbox_task_ids(user, roles, status=status))
+            .values_list('instance__definition__name', flat=True)
+        )
+
+    def test_inbox_contains_user_and_role_tasks(self):
+        self.user.groups.add(Group.objects.create(name='hr'))
+        self.start(self.single_task_definition('USER', str(self.user.pk)), name='mine')
+        self.start(self.single_task_definition('USER', str(self.user.pk + 1)), name='someone-else')
+        role_instance = self.start(self.single_task_definition('ROLE', 'hr'), name='role')
+        self.start(self.single_task_definition('ROLE', 'finance'), name='other-role')
+
+        self.assertEqual(self.inbox(self.user), {'mine', 'role'})
+        self.assertEqual(self.inbox(self.user, WorkflowTask.Status.PENDING), {'mine', 'role'})
+
+        workflow_engine.complete_task(self.pending_task(role_instance, 't').id, self.user, 'approved')
+        # 已完成的角色任务不再出现在收件箱中
+        self.assertEqual(self.inbox(self.user), {'mine'})
+        self.assertEqual(self.inbox(self.user, WorkflowTask.Status.COMPLETED), set())
+
+
+class AssigneeResolutionTests(WorkflowEngineTestBase):
+    def create_role(self, name, size):
+        group = Group.objects.create(name=name)
+        users = get_user_model().objects.bulk_create(
+            [get_user_model()(username=f'{name}_{i}') for i in range(size)]
+        )
+        group.user_set.add(*users)
+        return users
+
+    def test_role_tasks_cost_constant_queries_without_copying_members(self):
+        create_counts, complete_counts = [], []
+        for size in (1, 30):
+            members = self.create_role(f'role{size}', size)
+            definition = self.single_task_definition('ROLE', f'role{size}')
+            with CaptureQueriesContext(connection) as ctx:
+                instance = self.start(definition, name=f'role-{size}')
+            create_counts.append(len(statements(ctx.captured_queries)))
+
+            task = self.pending_task(instance, 't')
+            # 角色成员不展开到 assigned_users，权限按角色实时检查
+            self.assertEqual(task.assigned_users.count(), 0)
+            member = members[-1]
+            get_user_role_names(member) # 预热角色缓存
+            with CaptureQueriesContext(connection) as ctx:
+                self.assertTrue(workflow_engine.can_complete_task(member, task))
+                workflow_engine.complete_task(task.id, member, 'approved')
+            complete_counts.append(len(statements(ctx.captured_queries)))
+
+        self.assertEqual(create_counts[0], create_counts[1])
+        self.assertEqual(complete_counts[0], complete_counts[1])
+
+    def test_user_removed_from_role_can_no_longer_complete_existing_task(self):
+        [member] = self.create_role('reviewers', 1)
+        instance = self.start(self.single_task_definition('ROLE', 'reviewers'))
+        task = self.pending_task(instance, 't')
+        self.assertTrue(workflow_engine.can_complete_task(member, task))
+
+        Group.objects.get(name='reviewers').user_set.remove(member)
+        self.assertFalse(workflow_engine.can_complete_task(member, task))
+        client = APIClient()
+        client.force_authenticate(member)
+        response = client.post(f'/api/workflows/tasks/{task.pk}/complete/', {'outcome': 'approved'}, format='json')
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(WorkflowTask.objects.get(pk=task.pk).status, WorkflowTask.Status.PENDING)
+
+    def test_rule_assignee_checked_with_exists(self):
+        instance = self.start(self.single_task_definition('USER', str(self.user.pk)))
+        task = self.pending_task(instance, 't')
+        outsider = get_user_model().objects.create(username='outsider')
+        self.assertTrue(workflow_engine.can_complete_task(self.user, task))
+        self.assertFalse(workflow_engine.can_complete_task(outsider, task))
+        task.assigned_users.add(outsider)
+        with self.assertNumQueries(1):
+            self.assertTrue(workflow_engine.can_complete_task(outsider, task))
+
+    def test_role_cache_invalidated_on_group_change(self):
+        group = Group.objects.create(name='hr')
+        self.assertEqual(get_user_role_names(self.user), frozenset())
+        with self.assertNumQueries(0):
+            get_user_role_names(self.user)
+
+        self.user.groups.add(group)
+        self.assertEqual(get_user_role_names(self.user), {'hr'})
+        group.user_set.remove(self.user)
+        self.assertEqual(get_user_role_names(self.user), frozenset())
+        group.user_set.add(self.user)
+        group.name = 'people'
+        group.save()
+        self.assertEqual(get_user_role_names(self.user), {'people'})
+
+
+class ParallelJoinTests(WorkflowEngineTestBase):
+    def test_join_fires_once_after_all_branches(self):
+        instance = self.start(fan_out_definition(20), name='fan-out')
+        self.assertEqual(len(instance.current_node_ids), 20)
+
+        for i in range(1, 20):
+            workflow_engine.complete_task(self.pending_task(instance, f'head_{i}').id, self.user, 'approved')
+        instance.refresh_from_db()
+        self.assertEqual(instance.current_node_ids, ['head_20'])
+        self.assertEqual(instance.join_counters, {'join': 19})
+        self.assertFalse(WorkflowTask.objects.filter(instance=instance, node_id='final').exists())
+
+        workflow_engine.complete_task(self.pending_task(instance, 'head_20').id, self.user, 'approved')
+        instance.refresh_from_db()
+        self.assertEqual(instance.current_node_ids, ['final'])
+        self.assertEqual(instance.join_counters, {})
+        self.assertEqual(WorkflowTask.objects.filter(instance=instance, node_id='final').count(), 1)
+        self.assertEqual(
+            WorkflowHistory.objects.filter(instance=instance, node_id='join', event_type=WorkflowHistory.EventType.NODE_ENTERED).count(), 1
+        )
+
+        workflow_engine.complete_task(self.pending_task(instance, 'final').id, self.user, 'approved')
+        instance.refresh_from_db()
+        self.assertEqual(instance.status, WorkflowInstance.Status.COMPLETED)
+
+    def test_branch_completion_cost_independent_of_width(self):
+        counts = []
+        for width in (2, 20):
+            instance = self.start(fan_out_definition(width), name=f'fan-out-{width}')
+            task = self.pending_task(instance, 'head_1')
+            with CaptureQueriesContext(connection) as ctx:
+                workflow_engine.complete_task(task.id, self.user, 'approved')
+            counts.append(len(statements(ctx.captured_queries)))
+        self.assertEqual(counts[0], counts[1])
+
+
+class SnapshotReplayTests(WorkflowEngineTestBase):
+    def assert_replay_matches(self, instance):
+        instance.refresh_from_db()
+        for use_snapshot in (True, False):
+            state = rebuild_instance_state(instance.pk, use_snapshot=use_snapshot)
+            self.assertEqual(state.differences(instance), {})
+            self.assertEqual(state.sequence, WorkflowHistory.objects.filter(instance=instance).count())
+
+    def test_replay_matches_live_state_through_join(self):
+        instance = self.start(fan_out_definition(5), payload={'employee_id': 7}, name='fan-out')
+        self.assert_replay_matches(instance)
+        for i in range(1, 4):
+            workflow_engine.complete_task(self.pending_task(instance, f'head_{i}').id, self.user, 'approved', {'i': i})
+        self.assert_replay_matches(instance) # 汇聚计数 {'join': 3}
+        for node_id in ('head_4', 'head_5', 'final'):
+            workflow_engine.complete_task(self.pending_task(instance, node_id).id, self.user, 'approved')
+        self.assert_replay_matches(instance)
+        self.assertEqual(instance.status, WorkflowInstance.Status.COMPLETED)
+
+    def test_snapshot_taken_every_n_events(self):
+        workflow_engine.SNAPSHOT_EVERY_EVENTS = 10
+        self.addCleanup(delattr, workflow_engine, 'SNAPSHOT_EVERY_EVENTS')
+        instance = self.start(fan_out_definition(8), name='fan-out')
+        for i in range(1, 9):
+            workflow_engine.complete_task(self.pending_task(instance, f'head_{i}').id, self.user, 'approved')
+
+        snapshots = list(WorkflowInstanceSnapshot.objects.filter(instance=instance))
+        self.assertGreaterEqual(len(snapshots), 2)
+        instance.refresh_from_db()
+        self.assertLess(instance.events_since_snapshot, 10)
+        latest = snapshots[0]
+        self.assertEqual(
+            latest.history_sequence,
+            WorkflowHistory.objects.filter(instance=instance, timestamp__lte=latest.last_event_timestamp).count(),
+        )
+        self.assert_replay_matches(instance)
+
+
+class AsyncJobTests(WorkflowEngineTestBase):
+    def service_definition(self, service_name):
+        return {
+            'nodes': [
+                {'id': 'start', 'type': 'startNode'},
+                {'id': 'svc', 'type': 'serviceTaskNode', 'data': {'config': {'serviceName': service_name, 'maxAttempts': 2}}},
+                {'id': 'end', 'type': 'endNode'},
+            ],
+            'edges': [{'id': 'e1', 'source': 'start', 'target': 'svc'}, {'id': 'e2', 'source': 'svc', 'target': 'end'}],
+        }
+
+    def test_service_node_is_enqueued_and_executed_after_commit(self):
+        instance = self.start(self.service_definition('noop'))
+        job = WorkflowJob.objects.get(instance=instance)
+        self.assertEqual((job.node_id, job.status), ('svc', WorkflowJob.Status.PENDING))
+        instance.refresh_from_db()
+        self.assertEqual(instance.current_node_ids, ['svc'])
+
+        self.assertEqual(WorkflowWorker(concurrency=1, log=lambda message: None).run(once=True), 1)
+        job.refresh_from_db()
+        instance.refresh_from_db()
+        self.assertEqual(job.status, WorkflowJob.Status.DONE)
+        self.assertEqual(instance.status, WorkflowInstance.Status.COMPLETED)
+        self.assertEqual(instance.payload['svc_result'], {'ok': True})
+
+    def test_failing_job_retries_then_fails_instance(self):
+        @register_service_handler('always_fails')
+        def always_fails(config, payload):
+            raise RuntimeError('下游不可用')
+
+        instance = self.start(self.service_definition('always_fails'))
+        job = WorkflowJob.objects.get(instance=instance)
+        worker = WorkflowWorker(concurrency=1, log=lambda message: None)
+
+        worker.run(once=True)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (WorkflowJob.Status.PENDING, 1))
+        self.assertGreater(job.available_at, timezone.now())
+
+        WorkflowJob.objects.filter(pk=job.pk).update(available_at=timezone.now())
+        worker.run(once=True)
+        job.refresh_from_db()
+        instance.refresh_from_db()
+        self.assertEqual(job.status, WorkflowJob.Status.FAILED)
+        self.assertIn('下游不可用', job.last_error)
+        self.assertEqual(instance.status, WorkflowInstance.Status.FAILED)
+
+
+    def test_worker_survives_errors_while_advancing(self):
+        broken = self.start(self.service_definition('noop'), name='broken')
+        healthy = self.start(self.service_definition('noop'), name='healthy')
+        original = workflow_engine.advance_workflow
+
+        def advance(instance, *args, **kwargs):
+            if instance.pk == broken.pk:
+                raise OperationalError('Deadlock found when trying to get lock')
+            return original(instance, *args, **kwargs)
+
+        workflow_engine.advance_workflow = advance
+        self.addCleanup(delattr, workflow_engine, 'advance_workflow')
+        messages = []
+        self.assertEqual(WorkflowWorker(concurrency=1, log=messages.append).run(once=True), 2)
+
+        job = WorkflowJob.objects.get(instance=broken)
+        self.assertEqual((job.status, job.attempts), (WorkflowJob.Status.PENDING, 1))
+        self.assertIn('Deadlock', job.last_error)
+        self.assertTrue(any('提交结果失败' in message for message in messages))
+        healthy.refresh_from_db()
+        self.assertEqual(healthy.status, WorkflowInstance.Status.COMPLETED)
+
+    def test_result_from_lost_lease_is_discarded(self):
+        instance = self.start(self.service_definition('noop'))
+        [stale] = claim_jobs('worker-1', 1)
+        # 租约过期后作业被重新排队并由另一个 worker 领取
+        WorkflowJob.objects.filter(pk=stale.pk).update(locked_until=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(requeue_expired_jobs(), 1)
+        WorkflowJob.objects.filter(pk=stale.pk).update(available_at=timezone.now())
+        [current] = claim_jobs('worker-2', 1)
+
+        self.assertIsNone(complete_job(stale, {'stale': True}))
+        self.assertIsNone(fail_job_attempt(stale, RuntimeError('超时')))
+        job = WorkflowJob.objects.get(pk=stale.pk)
+        self.assertEqual((job.status, job.locked_by, job.attempts, job.last_error), (WorkflowJob.Status.RUNNING, 'worker-2', 2, ''))
+        instance.refresh_from_db()
+        self.assertEqual(instance.current_node_ids, ['svc'])
+
+        # 同一个 worker 重新领取后，旧的那次执行 (attempts 不同) 同样不能提交
+        self.assertIsNone(complete_job(WorkflowJob(pk=current.pk, locked_by='worker-2', attempts=1), {'stale': True}))
+        complete_job(current, {'ok': True})
+        instance.refresh_from_db()
+        self.assertEqual((instance.status, instance.payload['svc_result']), (WorkflowInstance.Status.COMPLETED, {'ok': True}))
+
+
+class SlaTimeoutTests(WorkflowEngineTestBase):
+    def start_timed(self, **timeout_config):
+        definition = self.single_task_definition('ROLE', 'approvers')
+        definition['nodes'][1]['data']['config'].update(timeout_config)
+        instance = self.start(definition)
+        task = self.pending_task(instance, 't')
+        return instance, task
+
+    def expire(self, task):
+        WorkflowTask.objects.filter(pk=task.pk).update(due_date=timezone.now() - timedelta(seconds=1))
+
+    def run_scheduler(self):
+        return SlaScheduler(log=lambda message: None).run(once=True)
+
+    def test_due_date_computed_from_timeout_duration(self):
+        before = timezone.now()
+        _, task = self.start_timed(timeoutDuration='2h')
+        self.assertGreaterEqual(task.due_date, before + timedelta(hours=2))
+        self.assertLess(task.due_date, timezone.now() + timedelta(hours=2))
+
+        # 未到期的任务不会被处理
+        self.assertEqual(self.run_scheduler(), 0)
+
+    def test_auto_approve_completes_task_and_advances(self):
+        instance, task = self.start_timed(timeoutDuration=60, timeoutAction='AUTO_APPROVE')
+        self.expire(task)
+        self.assertEqual(self.run_scheduler(), 1)
+
+        task.refresh_from_db()
+        instance.refresh_from_db()
+        self.assertEqual((task.status, task.outcome), (WorkflowTask.Status.COMPLETED, 'approved'))
+        self.assertIsNotNone(task.timed_out_at)
+        self.assertEqual(instance.status, WorkflowInstance.Status.COMPLETED)
+        self.assertTrue(WorkflowHistory.objects.filter(task=task, event_type=WorkflowHistory.EventType.TASK_TIMED_OUT).exists())
+
+    def test_escalate_reassigns_task(self):
+        _, task = self.start_timed(timeoutDuration=60, timeoutAction='ESCALATE', escalateToIdentifier='managers')
+        self.expire(task)
+        self.assertEqual(self.run_scheduler(), 1)
+
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.assignee_type, task.assignee_identifier), (WorkflowTask.Status.PENDING, 'ROLE', 'managers'))
+        self.assertEqual(list(WorkflowTaskCandidate.objects.filter(task=task).values_list('principal', flat=True)), ['role:managers'])
+
+    def test_notify_fires_once(self):
+        _, task = self.start_timed(timeoutDuration=60)
+        self.expire(task)
+        self.assertEqual(self.run_scheduler(), 1)
+        self.assertEqual(self.run_scheduler(), 0)
+        task.refresh_from_db()
+        self.assertEqual(task.status, WorkflowTask.Status.PENDING)
+        self.assertIsNotNone(task.timed_out_at)
+
+    def test_incremental_refresh_picks_up_new_short_deadline(self):
+        scheduler = SlaScheduler(log=lambda message: None)
+        scheduler.refresh()
+        _, task = self.start_timed(timeoutDuration=1)
+        self.assertEqual(scheduler.refresh(), 1)
+        self.assertEqual(scheduler.pop_due(task.due_date), [task.id])
+
+
+class BulkStartTests(WorkflowEngineTestBase):
+    def bulk_definition(self):
+        definition = branching_definition()
+        definition['nodes'].append({'id': 'svc', 'type': 'serviceTaskNode', 'data': {'config': {'serviceName': 'noop'}}})
+        definition['edges'].append({'id': 'e6', 'source': 'start', 'target': 'svc'})
+        return WorkflowDefinition.objects.create(name='bulk', definition_json=definition)
+
+    def snapshot(self, instance):
+        return (
+            instance.status,
+            sorted(instance.current_node_ids),
+            sorted(WorkflowTask.objects.filter(instance=instance).values_list('node_id', 'assignee_identifier')),
+            WorkflowTaskCandidate.objects.filter(task__instance=instance).count(),
+            WorkflowJob.objects.filter(instance=instance).count(),
+            list(WorkflowHistory.objects.filter(instance=instance).values_list('event_type', 'node_id')),
+        )
+
+    def test_bulk_start_matches_single_start(self):
+        definition = self.bulk_definition()
+        single = workflow_engine.start_instance(definition.id, {'n': 0}, user=self.user)
+        results = list(workflow_engine.start_instances_bulk(definition.id, [{'n': 1}, 'invalid', {'n': 2}], user=self.user))
+
+        self.assertEqual([result['index'] for result in results], [1, 0, 2])
+        self.assertIn('error', results[0])
+        for result in (results[1], results[2]):
+            instance = WorkflowInstance.objects.get(pk=result['id'])
+            self.assertEqual(self.snapshot(instance), self.snapshot(single))
+            self.assertEqual(instance.payload['n'], results.index(result))
+
+    def test_bulk_start_queries_do_not_grow_with_batch(self):
+        definition = self.bulk_definition()
+        reads, totals = [], []
+        for size in (5, 50):
+            with CaptureQueriesContext(connection) as ctx:
+                list(workflow_engine.start_instances_bulk(definition.id, [{} for _ in range(size)], chunk_size=100))
+            sqls = statements(ctx.captured_queries)
+            reads.append(len([sql for sql in sqls if not sql.startswith('INSERT')]))
+            totals.append(len(sqls))
+        # 没有逐实例的读取或更新；INSERT 只会因数据库单条语句的参数上限被拆分
+        self.assertEqual(reads[0], reads[1])
+        self.assertLess(totals[1], 15)
+
+    def test_start_bulk_endpoint_streams_ndjson(self):
+        definition = self.bulk_definition()
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.post(
+            '/api/workflows/instances/start_bulk/',
+            {'definition_id': str(definition.id), 'payloads': [{}, {}, {}], 'chunk_size': 2},
+            format='json',
+        )
+        self.assertEqual(response.status_code, 200)
+        lines = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([line['index'] for line in lines[:-1]], [0, 1, 2])
+        self.assertEqual(lines[-1]['summary']['started'], 3)
+        self.assertEqual(WorkflowInstance.objects.filter(definition=definition).count(), 3)
+
+
+class InstanceHistoryEndpointTests(WorkflowEngineTestBase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.instance = self.start(fan_out_definition(10), name='fan-out')
+        for i in range(1, 6):
+            workflow_engine.complete_task(self.pending_task(self.instance, f'head_{i}').id, self.user, 'approved')
+        self.expected_ids = [
+            str(pk) for pk in WorkflowHistory.objects.filter(instance=self.instance).order_by('timestamp', 'id').values_list('pk', flat=True)
+        ]
+        self.url = f'/api/workflows/instances/{self.instance.pk}/history/'
+
+    def test_cursor_pages_cover_history_once(self):
+        ids, url, pages = [], f'{self.url}?page_size=7', 0
+        while url:
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            if pages:
+                self.assertEqual(len(ctx.captured_queries), first_page_queries) # 每页查询数与位置无关
+            else:
+                first_page_queries = len(ctx.captured_queries)
+            ids.extend(event['id'] for event in response.data['results'])
+            url, pages = response.data['next'], pages + 1
+        self.assertEqual(ids, self.expected_ids)
+        self.assertEqual(pages, -(-len(self.expected_ids) // 7))
+
+    def test_stream_ndjson_from_cursor(self):
+        self.addCleanup(setattr, WorkflowInstanceViewSet, 'HISTORY_STREAM_CHUNK_SIZE', WorkflowInstanceViewSet.HISTORY_STREAM_CHUNK_SIZE)
+        WorkflowInstanceViewSet.HISTORY_STREAM_CHUNK_SIZE = 4 # 覆盖跨块续读
+        response = self.client.get(self.url, {'stream': 'ndjson'})
+        lines = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([line['id'] for line in lines], self.expected_ids)
+
+        first_page = self.client.get(self.url, {'page_size': 3})
+        response = self.client.get(first_page.data['next'] + '&stream=ndjson')
+        lines = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([line['id'] for line in lines], self.expected_ids[3:])
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get(self.url, {'cursor': 'not-a-cursor'}).status_code, 404)
+
+
+class PayloadProjectionTests(WorkflowEngineTestBase):
+    def setUp(self):
+        super().setUp()
+        self.user.groups.add(Group.objects.create(name='approvers'))
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        payload = {'requester_name': '张三', 'leave_type': 'annual', 'start_date': '2025-03-01', 'attachments': ['x' * 1000] * 50}
+        self.instance = self.start(linear_definition(), payload=payload)
+
+    def selects(self, ctx):
+        return [sql for sql in statements(ctx.captured_queries) if sql.startswith('SELECT')]
+
+    def test_task_list_projects_summary_keys(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/workflows/tasks/', {'assignee': 'me'})
+        self.assertEqual(response.status_code, 200)
+        summary = response.data[0]['instance_payload_summary']
+        self.assertEqual(list(summary.values()), ['张三', 'annual', '2025-03-01'])
+        instance_column = f'"{WorkflowInstance._meta.db_table}"."payload"'
+        for sql in self.selects(ctx):
+            # 只允许出现在 JSON 键提取函数中，整列不会被读取
+            self.assertNotIn(instance_column, re.sub(r'JSON_\w+\(' + re.escape(instance_column), '', sql))
+
+    def test_sparse_fieldsets(self):
+        response = self.client.get('/api/workflows/tasks/', {'assignee': 'me', 'fields': 'id,status'})
+        self.assertEqual(set(response.data[0]), {'id', 'status'})
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/workflows/instances/', {'fields': 'id,status'})
+        self.assertEqual(response.data[0], {'id': str(self.instance.pk), 'status': WorkflowInstance.Status.RUNNING})
+        self.assertFalse(any('"payload"' in sql for sql in self.selects(ctx)))
+
+
+class CompiledGraphTests(SimpleTestCase):
+    def test_adjacency_and_start_end_detection(self):
+        graph = CompiledGraph(branching_definition())
+        self.assertEqual(len(graph), 5)
+        self.assertEqual((graph.start_node_id, graph.end_node_ids), ('start', ['end']))
+        self.assertEqual(graph.start_node['type'], 'startNode')
+        self.assertEqual([edge['target'] for edge in graph.outgoing_edges('a')], ['b', 'c'])
+        self.assertEqual(graph.incoming_sources('end'), ['b', 'c'])
+        self.assertEqual(graph.join_arity('end'), 2)
+        self.assertEqual((graph.node_type('a'), graph.node_type('missing')), (NodeType.APPROVAL, NodeType.OTHER))
+        self.assertEqual((graph.outgoing_edges('end'), graph.node('missing')), ([], None))
+
+    def test_first_node_wins_for_duplicate_ids(self):
+        definition = linear_definition()
+        definition['nodes'].append({'id': 'a', 'type': 'endNode'})
+        definition['nodes'].append({'id': 'start', 'type': 'startNode', 'data': {'label': 'second'}})
+        graph = CompiledGraph(definition)
+        self.assertEqual(graph.node_type('a'), NodeType.APPROVAL)
+        self.assertEqual(graph.end_node_ids, ['end'])
+        self.assertIs(graph.start_node, definition['nodes'][0])
+
+    def test_compiled_form_round_trips(self):
+        graph = CompiledGraph.from_compiled(json.loads(json.dumps(CompiledGraph(linear_definition()).to_compiled())))
+        self.assertEqual((graph.start_node_id, graph.end_node_ids), ('start', ['end']))
+        self.assertEqual([edge['target'] for edge in graph.outgoing_edges('a')], ['b'])
+        self.assertEqual(graph.node_type('b'), NodeType.APPROVAL)
+
+
+class GraphCacheTests(TestCase):
+    def definition(self, pk='d1', version=1):
+        return WorkflowDefinition(id=pk, name=pk, definition_json=linear_definition(), version=version, updated_at=timezone.now())
+
+    def test_key_changes_with_version_and_updated_at(self):
+        cache = GraphCache()
+        definition = self.definition()
+        graph = cache.get(definition)
+        self.assertIs(cache.get(definition), graph)
+        definition.version += 1
+        bumped = cache.get(definition)
+        self.assertIsNot(bumped, graph)
+        definition.updated_at += timedelta(seconds=1)
+        self.assertIsNot(cache.get(definition), bumped)
+
+    def test_least_recently_used_entry_evicted_at_max_size(self):
+        cache = GraphCache(max_size=2)
+        first, second, third = self.definition('d1'), self.definition('d2'), self.definition('d3')
+        first_graph, second_graph = cache.get(first), cache.get(second)
+        cache.get(first) # first 变为最近使用
+        cache.get(third)
+        self.assertIs(cache.get(first), first_graph)
+        self.assertIsNot(cache.get(second), second_graph)
+
+    def test_save_invalidates_cached_graph(self):
+        definition = WorkflowDefinition.objects.create(name='cached', definition_json=linear_definition())
+        self.addCleanup(graph_cache.invalidate, definition.pk)
+        stale = WorkflowDefinition.objects.get(pk=definition.pk)
+        graph = graph_cache.get(stale)
+        self.assertIs(graph_cache.get(stale), graph)
+        definition.save()
+        # 即使用保存前读到的行 (键相同) 也会重新编译
+        self.assertIsNot(graph_cache.get(stale), graph)
+
+
+class RuleEvaluatorTests(SimpleTestCase):
+    def setUp(self):
+        compile_condition.cache_clear()
+
+    def check(self, condition, payload):
+        return rule_evaluator.evaluate(condition, payload)
+
+    def test_comparison_boolean_and_membership_operators(self):
+        payload = {'days': 5, 'leave_type': 'annual', 'urgent': False}
+        for condition, expected in (
+            ('payload.days > 3', True), ('payload.days <= 4', False), ('3 < payload.days < 6', True),
+            ('payload.days != 5', False), ("payload.leave_type == 'annual'", True),
+            ("payload.days > 3 and payload.leave_type == 'sick'", False),
+            ("payload.days > 9 or payload.leave_type in ['annual', 'sick']", True),
+            ('not payload.urgent', True), ("payload.leave_type not in ('sick',)", True),
+            ('payload.days * 2 - 1 >= 9', True), ('payload.days % 2 == 1 and payload.days // 2 == 2', True),
+            ("'nu' in payload.leave_type", True), ('', True),
+        ):
+            with self.subTest(condition=condition):
+                self.assertIs(self.check(condition, payload), expected)
+
+    def test_nested_paths_and_missing_keys(self):
+        payload = {'a': {'b': 7, 'items': [{'name': 'x'}]}}
+        self.assertTrue(self.check('payload.a.b == 7', payload))
+        self.assertTrue(self.check("payload['a']['b'] == 7", payload))
+        self.assertTrue(self.check("payload.a.items[0].name == 'x'", payload))
+        self.assertFalse(self.check('payload.a.items[5].name == 1', payload))
+        self.assertFalse(self.check('payload.a.missing > 1', payload))
+        self.assertFalse(self.check('payload.missing.deeper == 1', payload))
+        self.assertTrue(self.check('payload.missing == None', payload))
+        self.assertFalse(self.check("payload.missing in ['x']", payload))
+        self.assertFalse(self.check('payload.a.b > 1', None))
+
+    def test_numeric_strings_compare_as_numbers(self):
+        # 与旧版求值器一致：两边都能转成数字时按数字比较
+        payload = {'days': '10', 'amount': '1000.5', 'code': 'A1'}
+        self.assertTrue(self.check('payload.days == 10', payload))
+        self.assertTrue(self.check('payload.days > 9', payload))  # 按字符串比较时 '10' < '9'
+        self.assertTrue(self.check("payload.amount >= '1000'", payload))
+        self.assertTrue(self.check('payload.amount * 2 > 2000', payload))
+        self.assertTrue(self.check("payload.code == 'A1'", payload))
+        self.assertFalse(self.check('payload.code > 1', {'code': None}))
+        self.assertTrue(self.check("payload.code > 'A0'", payload))  # 两边都是字符串时按字符串比较
+        # 运行期错误 (对非数字做算术) 视为条件不满足
+        self.assertFalse(self.check('payload.code * 2 > 1', payload))
+
+    def test_ordering_between_number_and_non_numeric_string_is_false(self):
+        for condition, payload in (
+            ('payload.level > 3', {'level': 'high'}), ('payload.level <= 3', {'level': 'high'}),
+            ('payload.amount > 5000', {'amount': '10,000'}), ('payload.amount < 5000', {'amount': '10,000'}),
+            ("payload.days >= 'many'", {'days': 5}), ('payload.flag > 0', {'flag': True}),
+        ):
+            with self.subTest(condition=condition):
+                self.assertFalse(self.check(condition, payload))
+
+    def test_not_equal_with_missing_value_is_false(self):
+        # 与旧版求值器一致：字段缺失或为空值时 != 也不成立，决策节点走默认路径
+        self.assertFalse(self.check("payload.x != 'a'", {}))
+        self.assertFalse(self.check("payload.x != 'a'", {'x': None}))
+        self.assertTrue(self.check("payload.x != 'a'", {'x': 'b'}))
+        self.assertFalse(self.check("payload.x != 'a'", {'x': 'a'}))
+
+    def test_unsafe_syntax_rejected(self):
+        for condition in (
+            'payload.__class__ == 1', "payload.a.__dict__ == 'x'", "().__class__ == 'x'",
+            "payload.name.startswith('x')", "__import__('os')", 'len(payload) > 1',
+            '1 if payload.a else 0', 'lambda: 1', 'payload.a > ', 'unknown > 1', 'payload[payload.key] == 1',
+        ):
+            with self.subTest(condition=condition):
+                with self.assertRaises(RuleSyntaxError):
+                    parse_condition(condition)
+                self.assertFalse(self.check(condition, {'a': 1, 'key': 'a', 'name': 'x'}))
+
+    def test_compiled_conditions_are_cached(self):
+        self.check('payload.days > 3', {'days': 5})
+        self.check('payload.days > 3', {'days': 1})
+        self.check('payload.days > 4', {'days': 1})
+        info = compile_condition.cache_info()
+        self.assertEqual((info.hits, info.misses), (1, 2))
+        self.assertIs(compile_condition('payload.days > 3'), compile_condition('payload.days > 3'))
+
+        # 非法条件只在首次编译时告警一次
+        output = StringIO()
+        with redirect_stdout(output):
+            self.check('payload.days >', {})
+            self.check('payload.days >', {})
+        self.assertEqual(output.getvalue().count('警告'), 1)
+
+
+class DefinitionPublishTests(WorkflowEngineTestBase):
+    def errors(self, definition_json):
+        return validate_definition(definition_json)[1]
+
+    def test_valid_definitions_pass(self):
+        self.assertEqual(self.errors(linear_definition()), [])
+        self.assertEqual(self.errors(fan_out_definition(3)), [])
+        looped = linear_definition()
+        looped['nodes'].append({'id': 'gw', 'type': 'decisionNode'})
+        looped['edges'] = [edge for edge in looped['edges'] if edge['source'] != 'b'] + [
+            {'id': 'e_b_gw', 'source': 'b', 'target': 'gw'},
+            {'id': 'e_retry', 'source': 'gw', 'target': 'a', 'data': {'condition': "payload.b_outcome == 'rejected'"}},
+            {'id': 'e_done', 'source': 'gw', 'target': 'end', 'data': {'isDefault': True}},
+        ]
+        self.assertEqual(self.errors(looped), []) # 经过审批节点的环是允许的
+
+    def test_structural_errors(self):
+        broken = linear_definition()
+        broken['nodes'] += [{'id': 'start2', 'type': 'startNode'}, approval_node('orphan'), {'id': 'gw', 'type': 'decisionNode'}]
+        broken['edges'] += [
+            {'id': 'e_dangling', 'source': 'b', 'target': 'missing'},
+            {'id': 'e_gw', 'source': 'start2', 'target': 'gw'},
+            {'id': 'e_gw_end', 'source': 'gw', 'target': 'end', 'data': {'condition': 'payload.x > 1'}},
+        ]
+        errors = '\n'.join(self.errors(broken))
+        for fragment in ('missing 不存在', '只能有一个开始节点', 'orphan', '无法到达任何结束节点', '决策节点 gw 没有默认路径'):
+            self.assertIn(fragment, errors)
+        self.assertIn('缺少结束节点', self.errors({'nodes': [{'id': 'start', 'type': 'startNode'}], 'edges': []}))
+
+    def test_edge_condition_syntax_checked(self):
+        definition = branching_definition()
+        definition['edges'][1]['data'] = {'condition': 'payload.days >'}
+        definition['edges'][2]['data'] = {'condition': "payload.name.startswith('x')"}
+        errors = self.errors(definition)
+        self.assertEqual(len(errors), 2)
+        self.assertTrue(errors[0].startswith('边 e2 的条件不合法'))
+        self.assertTrue(errors[1].startswith('边 e3 的条件不合法'))
+
+    def test_automatic_cycle_rejected(self):
+        definition = {
+            'nodes': [{'id': 'start', 'type': 'startNode'}, {'id': 'gw', 'type': 'decisionNode'}, {'id': 'end', 'type': 'endNode'}],
+            'edges': [
+                {'id': 'e1', 'source': 'start', 'target': 'gw'},
+                {'id': 'e_loop', 'source': 'gw', 'target': 'gw', 'data': {'condition': 'payload.x > 1'}},
+                {'id': 'e_end', 'source': 'gw', 'target': 'end', 'data': {'isDefault': True}},
+            ],
+        }
+        self.assertEqual(self.errors(definition), ['存在不经过任何任务节点的环: gw -> gw'])
+
+    def test_publish_stores_compiled_form_used_at_runtime(self):
+        definition = WorkflowDefinition.objects.create(name='published', definition_json=linear_definition())
+        definition = workflow_engine.publish_definition(definition.id)
+        self.assertEqual((definition.version, definition.compiled_json['start']), (1, 'start'))
+        definition = workflow_engine.publish_definition(definition.id)
+        self.assertEqual(definition.version, 2)
+
+        # 发布后的草稿修改在再次发布前不影响运行时
+        definition.definition_json = {'nodes': [], 'edges': []}
+        definition.save()
+        instance = workflow_engine.start_instance(definition.id, {}, user=self.user)
+        self.assertEqual(instance.current_node_ids, ['a'])
+
+        with self.assertRaises(DefinitionValidationError):
+            workflow_engine.publish_definition(definition.id)
+        definition.refresh_from_db()
+        self.assertEqual(definition.version, 2)
+
+    def test_republish_refused_while_instances_are_unfinished(self):
+        definition = WorkflowDefinition.objects.create(name='pinned', definition_json=linear_definition())
+        workflow_engine.publish_definition(definition.id)
+        instance = workflow_engine.start_instance(definition.id, {}, user=self.user)
+
+        definition.refresh_from_db()
+        definition.definition_json = self.single_task_definition('USER', str(self.user.pk))
+        definition.save()
+        with self.assertRaises(DefinitionValidationError) as raised:
+            workflow_engine.publish_definition(definition.id)
+        self.assertIn('还有 1 个未结束的实例', raised.exception.errors[0])
+        definition.refresh_from_db()
+        self.assertEqual((definition.version, definition.compiled_json['start']), (1, 'start'))
+        self.assertEqual(workflow_engine._get_graph(definition).outgoing_edges('a')[0]['target'], 'b')
+
+        WorkflowInstance.objects.filter(pk=instance.pk).update(status=WorkflowInstance.Status.CANCELED)
+        self.assertEqual(workflow_engine.publish_definition(definition.id).version, 2)
+
+    def test_publish_endpoint_reports_errors(self):
+        client = APIClient()
+        client.force_authenticate(get_user_model().objects.create(username='designer', is_staff=True, is_superuser=True))
+        definition = WorkflowDefinition.objects.create(name='broken', definition_json={'nodes': [], 'edges': []})
+        response = client.post(f'/api/workflows/definitions/{definition.id}/publish/')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('缺少开始节点', response.data['errors'])
+
+
+def leave_routing_definition():
+    """start -> gw (days > 3 走 hr，否则 manager) ; hr -> manager -> end"""
+    return {
+        'nodes': [
+            {'id': 'start', 'type': 'startNode'}, {'id': 'gw', 'type': 'decisionNode'},
+            approval_node('hr', assignee_identifier='hr'), approval_node('manager', assignee_identifier='managers'),
+            {'id': 'end', 'type': 'endNode'},
+        ],
+        'edges': [
+            {'id': 'e1', 'source': 'start', 'target': 'gw'},
+            {'id': 'e2', 'source': 'gw', 'target': 'hr', 'data': {'condition': 'payload.days > 3'}},
+            {'id': 'e3', 'source': 'gw', 'target': 'manager', 'data': {'isDefault': True}},
+            {'id': 'e4', 'source': 'hr', 'target': 'manager'},
+            {'id': 'e5', 'source': 'manager', 'target': 'end'},
+        ],
+    }
+
+
+class SimulationTests(WorkflowEngineTestBase):
+    def test_branch_probabilities_and_task_load_without_queries(self):
+        with self.assertNumQueries(0):
+            report = simulate_definition(leave_routing_definition(), [{'days': 1}, {'days': 5}, {'days': 2}, {'days': 10}], 400).as_dict()
+        self.assertEqual(report['statuses'], {'COMPLETED': 400})
+        self.assertEqual(report['branch_probabilities'], {'gw': {'hr': 0.5, 'manager': 0.5}})
+        self.assertEqual(report['task_load']['ROLE:managers'], {'tasks': 400, 'per_instance': 1.0})
+        self.assertEqual(report['task_load']['ROLE:hr'], {'tasks': 200, 'per_instance': 0.5})
+        # start, gw, [hr], manager, end
+        self.assertEqual((report['path_length']['min'], report['path_length']['max']), (3, 4))
+
+    def test_join_fires_once_per_simulated_instance(self):
+        report = simulate_definition(fan_out_definition(4), [{}], 50).as_dict()
+        self.assertEqual(report['statuses'], {'COMPLETED': 50})
+        self.assertEqual(report['node_visits']['join']['count'], 50)
+        self.assertEqual(report['task_load']['ROLE:approvers']['per_instance'], 5.0)
+
+    def test_outcomes_drive_decisions_and_stalls_are_reported(self):
+        definition = leave_routing_definition()
+        # 经理驳回时回到一个没有默认路径的决策节点
+        definition['nodes'].append({'id': 'check', 'type': 'decisionNode'})
+        definition['edges'][-1] = {'id': 'e5', 'source': 'manager', 'target': 'check'}
+        definition['edges'].append({'id': 'e6', 'source': 'check', 'target': 'end', 'data': {'condition': "payload.manager_outcome == 'approved'"}})
+        report = simulate_definition(definition, [{'days': 1}], 1000, outcomes={'manager': {'approved': 3, 'rejected': 1}}, seed=7).as_dict()
+        rejected = report['outcomes']['manager']['rejected']
+        self.assertTrue(150 < rejected < 350)
+        self.assertEqual(report['stalled_nodes'], {'check': rejected})
+        self.assertEqual(report['statuses'], {'COMPLETED': 1000 - rejected, 'RUNNING': rejected})
+        self.assertTrue(any('check' in error for error in report['errors']))
+
+    def test_simulate_endpoint(self):
+        client = APIClient()
+        client.force_authenticate(get_user_model().objects.create(username='designer', is_staff=True, is_superuser=True))
+        definition = WorkflowDefinition.objects.create(name='draft', definition_json=leave_routing_definition())
+        response = client.post(
+            f'/api/workflows/definitions/{definition.id}/simulate/', {'payloads': [{'days': 5}], 'instances': 10}, format='json',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['node_visits']['hr']['count'], 10)
+        self.assertFalse(WorkflowInstance.objects.exists())
+
+        definition.definition_json = {'nodes': [], 'edges': []}
+        definition.save()
+        response = client.post(f'/api/workflows/definitions/{definition.id}/simulate/', {}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_simulate_command(self):
+        definition = WorkflowDefinition.objects.create(name='draft', definition_json=fan_out_definition(2))
+        out = StringIO()
+        call_command('simulate_workflow', str(definition.id), '--instances', '20', '--json', stdout=out)
+        self.assertEqual(json.loads(out.getvalue())['node_visits']['final']['count'], 20)
+
+
+class InMemoryStorageTests(SimpleTestCase):
+    """SimpleTestCase 不允许访问数据库：整个引擎核心路径只经过 InMemoryStorage"""
+
+    def setUp(self):
+        self.storage = InMemoryStorage(roles={'approvers': [1, 2]})
+        self.engine = WorkflowEngineService(storage=self.storage)
+
+    def start(self, definition_json, payload=None):
+        definition = self.storage.add_definition(WorkflowDefinition(name='in-memory', definition_json=definition_json))
+        return self.engine.start_instance(definition.id, payload or {})
+
+    def complete(self, instance, node_id, outcome='approved'):
+        [task] = [task for task in self.storage.get_tasks(instance.pk, WorkflowTask.Status.PENDING) if task.node_id == node_id]
+        return self.engine.complete_task(task.id, None, outcome)
+
+    def test_linear_instance_runs_to_completion(self):
+        instance = self.start(linear_definition())
+        self.assertEqual(self.storage.get_instance(instance.pk).current_node_ids, ['a'])
+        [task] = self.storage.get_tasks(instance.pk)
+        # 角色任务不展开成员；角色解析由存储后端按内存中的角色表完成
+        self.assertEqual(self.storage.assignments[task.pk], [])
+        self.assertEqual(self.storage.resolve_assignees('ROLE', 'approvers', instance), [1, 2])
+        self.complete(instance, 'a')
+        self.complete(instance, 'b')
+        instance = self.storage.get_instance(instance.pk)
+        self.assertEqual(instance.status, WorkflowInstance.Status.COMPLETED)
+        self.assertEqual(instance.payload['b_outcome'], 'approved')
+        self.assertEqual(self.storage.history[-1].event_type, WorkflowHistory.EventType.INSTANCE_COMPLETED)
+
+    def test_parallel_join(self):
+        instance = self.start(fan_out_definition(3))
+        for head in ('head_1', 'head_2', 'head_3'):
+            self.complete(instance, head)
+        self.assertEqual(self.storage.get_instance(instance.pk).current_node_ids, ['final'])
+
+    @override_settings(WORKFLOW_ENGINE={'CONCURRENCY_MODE': 'optimistic'})
+    def test_optimistic_completion(self):
+        instance = self.start(fan_out_definition(2))
+        self.complete(instance, 'head_1')
+        self.complete(instance, 'head_2')
+        self.assertEqual(self.storage.get_instance(instance.pk).current_node_ids, ['final'])
+
+    def test_failed_transaction_is_rolled_back(self):
+        instance = self.start(linear_definition())
+        history_length = len(self.storage.history)
+
+        def fail(*args, **kwargs):
+            raise RuntimeError('推进失败')
+
+        self.engine._advance_in_memory = fail
+        with self.assertRaises(RuntimeError):
+            self.complete(instance, 'a')
+        self.assertEqual(len(self.storage.get_tasks(instance.pk, WorkflowTask.Status.PENDING)), 1)
+        self.assertEqual(self.storage.get_instance(instance.pk).lock_version, instance.lock_version)
+        self.assertEqual(len(self.storage.history), history_length)
+
+    def test_bulk_start(self):
+        definition = self.storage.add_definition(WorkflowDefinition(name='in-memory', definition_json=linear_definition()))
+        results = list(self.engine.start_instances_bulk(definition.id, [{'n': i} for i in range(5)], chunk_size=2))
+        self.assertEqual([result['status'] for result in results], [WorkflowInstance.Status.RUNNING] * 5)
+        self.assertEqual(len(self.storage.tasks), 5)
+        self.assertIsNone(self.engine.start_instance(WorkflowDefinition().id, {}))
+
+
+class ArchiveTests(WorkflowEngineTestBase):
+    def finished_instance(self, days_ago):
+        instance = self.start(linear_definition(), {'n': days_ago}, name=f'archive-{days_ago}')
+        for node_id in ('a', 'b'):
+            workflow_engine.complete_task(self.pending_task(instance, node_id).id, self.user, 'approved')
+        WorkflowInstance.objects.filter(pk=instance.pk).update(completed_at=timezone.now() - timedelta(days=days_ago))
+        return instance
+
+    def test_archives_old_finished_instances_with_tasks_and_history(self):
+        old = self.finished_instance(days_ago=200)
+        recent = self.finished_instance(days_ago=10)
+        running = self.start(linear_definition(), name='running')
+        event_count = WorkflowHistory.objects.filter(instance=old).count()
+
+        chunks = list(archive_instances(after_days=180, chunk_size=1))
+        self.assertEqual([len(documents) for documents in chunks], [1])
+        self.assertFalse(WorkflowInstance.objects.filter(pk=old.pk).exists())
+        self.assertFalse(WorkflowTask.objects.filter(instance_id=old.pk).exists())
+        self.assertFalse(WorkflowHistory.objects.filter(instance_id=old.pk).exists())
+        self.assertEqual(set(WorkflowInstance.objects.values_list('pk', flat=True)), {recent.pk, running.pk})
+
+        archived = ArchivedWorkflowInstance.objects.get(pk=old.pk)
+        self.assertEqual((archived.task_count, archived.event_count), (2, event_count))
+        document = decode_document(archived.document)
+        self.assertEqual(document['instance']['payload']['b_outcome'], 'approved')
+        self.assertEqual([event['event_type'] for event in document['history']][-1], WorkflowHistory.EventType.INSTANCE_COMPLETED)
+
+    def test_archive_chunks_cost_constant_queries(self):
+        for days_ago in (200, 201, 202):
+            self.finished_instance(days_ago)
+        with CaptureQueriesContext(connection) as captured:
+            archived = sum(len(documents) for documents in archive_instances(after_days=180, chunk_size=10))
+        self.assertEqual(archived, 3)
+        few = len(statements(captured.captured_queries))
+        self.finished_instance(203)
+        self.finished_instance(204)
+        with CaptureQueriesContext(connection) as captured:
+            archive_list = list(archive_instances(after_days=180, chunk_size=10))
+        self.assertEqual(len(archive_list[0]), 2)
+        self.assertEqual(len(statements(captured.captured_queries)), few)
+
+    def test_command_dry_run_and_export(self):
+        old = self.finished_instance(days_ago=200)
+        out = StringIO()
+        call_command('archive_workflow_instances', '--dry-run', stdout=out)
+        self.assertIn('1 个', out.getvalue())
+        self.assertTrue(WorkflowInstance.objects.filter(pk=old.pk).exists())
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'archive.jsonl.gz')
+            call_command('archive_workflow_instances', '--export', path, stdout=StringIO())
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                lines = [json.loads(line) for line in f]
+        self.assertEqual([line['instance']['id'] for line in lines], [str(old.pk)])
+        self.assertFalse(WorkflowInstance.objects.filter(pk=old.pk).exists())
+
+    def test_read_only_api(self):
+        old = self.finished_instance(days_ago=200)
+        list(archive_instances(after_days=180))
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get('/api/workflows/archived-instances/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['id'] for row in response.data['results']], [str(old.pk)])
+        self.assertNotIn('history', response.data['results'][0])
+
+        response = client.get(f'/api/workflows/archived-instances/{old.pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['tasks']), 2)
+        self.assertEqual(response.data['instance']['status'], WorkflowInstance.Status.COMPLETED)
+        self.assertEqual(client.delete(f'/api/workflows/archived-instances/{old.pk}/').status_code, 405)
+        self.assertEqual(client.get('/api/workflows/archived-instances/', {'object_id': 'x'}).status_code, 400)
+
+
+class MetricsTests(WorkflowEngineTestBase):
+    def test_disabled_by_default(self):
+        self.assertIsInstance(get_metrics(), NullMetrics)
+        client = APIClient()
+        client.force_authenticate(get_user_model().objects.create(username='admin', is_staff=True))
+        self.assertEqual(client.get('/api/workflows/metrics/json/').status_code, 404)
+
+    @override_settings(WORKFLOW_METRICS={'ENABLED': True, 'TOKEN': 'secret'})
+    def test_engine_operations_are_recorded(self):
+        with self.captureOnCommitCallbacks(execute=True): # 事件计数器在事务提交后才累加
+            instance = self.start(linear_definition())
+            for node_id in ('a', 'b'):
+                workflow_engine.complete_task(self.pending_task(instance, node_id).id, self.user, 'approved')
+
+        client = APIClient()
+        self.assertEqual(client.get('/api/workflows/metrics/').status_code, 403)
+        client.credentials(HTTP_AUTHORIZATION='Bearer secret')
+        data = client.get('/api/workflows/metrics/json/').data
+        counters = {(c['name'], tuple(c['labels'].items())): c['value'] for c in data['counters']}
+        self.assertEqual(counters[('workflow_instances_started_total', ())], 1)
+        self.assertEqual(counters[('workflow_instances_finished_total', (('status', 'COMPLETED'),))], 1)
+        self.assertEqual(counters[('workflow_tasks_created_total', ())], 2)
+        operations = {h['labels'].get('operation'): h['count'] for h in data['histograms'] if h['name'] == 'workflow_operation_seconds'}
+        self.assertEqual((operations['start'], operations['complete_task']), (1, 2))
+        self.assertTrue(any(h['name'] == 'workflow_lock_wait_seconds' for h in data['histograms']))
+        self.assertEqual(data['queue_depths']['instances_running'], 0)
+
+        text = client.get('/api/workflows/metrics/').content.decode()
+        self.assertIn('# TYPE workflow_operation_seconds histogram', text)
+        self.assertIn('workflow_operation_seconds_count{operation="complete_task"} 2', text)
+        self.assertIn('workflow_queue_depth{queue="tasks_open"} 0', text)
+
+
+    @override_settings(WORKFLOW_METRICS={'ENABLED': True})
+    def test_rolled_back_events_are_not_counted(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                self.start(linear_definition())
+                raise RuntimeError
+        self.assertEqual(callbacks, [])
+        self.assertEqual(get_metrics().snapshot()['counters'], [])
+
+    def test_in_memory_storage_counts_on_commit(self):
+        storage = InMemoryStorage()
+        counted = []
+        with self.assertRaises(RuntimeError), storage.atomic():
+            storage.on_commit(lambda: counted.append('rolled back'))
+            raise RuntimeError
+        with storage.atomic():
+            with storage.atomic():
+                storage.on_commit(lambda: counted.append('committed'))
+            self.assertEqual(counted, [])
+        storage.on_commit(lambda: counted.append('immediate'))
+        self.assertEqual(counted, ['committed', 'immediate'])
+
+
+class StuckInstanceTests(WorkflowEngineTestBase):
+    def stuck(self, chunk_size=2):
+        found = {}
+        for _scanned, chunk in iter_stuck_instances(chunk_size=chunk_size):
+            found.update(chunk)
+        return found
+
+    def test_detect_and_repair(self):
+        healthy = [self.start(linear_definition(), name=f'healthy-{i}') for i in range(3)]
+        stalled = self.start(gateway_chain_definition(1), {'days': -1}, name='stalled')
+        lost_task = self.start(linear_definition(), name='lost-task')
+        WorkflowTask.objects.filter(instance=lost_task).update(status=WorkflowTask.Status.CANCELED)
+
+        found = self.stuck()
+        self.assertEqual(found, {stalled.pk: {'gw_1': StuckReason.STALLED_NODE}, lost_task.pk: {'a': StuckReason.MISSING_TASK}})
+        self.assertTrue(all(instance.pk not in found for instance in healthy))
+        out = StringIO()
+        call_command('repair_stuck_instances', chunk_size=2, stdout=out)
+        self.assertIn('扫描 5 个实例，发现 2 个卡住', out.getvalue())
+
+        # 重试：缺失的任务重新创建；决策节点在 payload 修正后继续推进
+        self.assertIsNotNone(workflow_engine.retry_stuck_instance(lost_task.pk))
+        self.assertTrue(WorkflowTask.objects.filter(instance=lost_task, node_id='a', status=WorkflowTask.Status.PENDING).exists())
+        WorkflowInstance.objects.filter(pk=stalled.pk).update(payload={'days': 1})
+        stalled = workflow_engine.retry_stuck_instance(stalled.pk)
+        self.assertEqual(stalled.current_node_ids, ['a'])
+        self.assertEqual(self.stuck(), {})
+        self.assertIsNone(workflow_engine.retry_stuck_instance(healthy[0].pk))
+
+    def test_suspend_and_fail(self):
+        first = self.start(gateway_chain_definition(1), {'days': -1}, name='stalled-1')
+        second = self.start(gateway_chain_definition(1), {'days': -1}, name='stalled-2')
+        healthy = self.start(linear_definition(), name='healthy')
+        closed = workflow_engine.close_stuck_instances([first.pk, healthy.pk], WorkflowInstance.Status.SUSPENDED, '人工处理')
+        self.assertEqual(closed, [first.pk])
+        workflow_engine.close_stuck_instances([second.pk], WorkflowInstance.Status.FAILED)
+
+        statuses = dict(WorkflowInstance.objects.values_list('pk', 'status'))
+        self.assertEqual(
+            (statuses[first.pk], statuses[second.pk], statuses[healthy.pk]),
+            (WorkflowInstance.Status.SUSPENDED, WorkflowInstance.Status.FAILED, WorkflowInstance.Status.RUNNING),
+        )
+        first.refresh_from_db()
+        self.assertEqual(rebuild_instance_state(first.pk).differences(first), {})
+
+
+@override_settings(WORKFLOW_ENGINE={'CONCURRENCY_MODE': 'optimistic', 'OPTIMISTIC_BACKOFF': 0}, WORKFLOW_METRICS={'ENABLED': True})
+class OptimisticCompletionTests(WorkflowEngineTestMixin, TransactionTestCase):
+    """乐观并发只在最外层事务中启用，因此不能使用 TestCase (每个测试包在事务中)"""
+
+    def setUp(self):
+        super().setUp()
+        get_metrics().reset()
+
+    def counter(self, name):
+        return sum(c['value'] for c in get_metrics().snapshot()['counters'] if c['name'] == name)
+
+    def complete_with_concurrent_write(self, task, concurrent_writes):
+        """在读取实例之后、条件更新之前模拟其他事务提交了对实例的修改"""
+        original = workflow_engine._advance_in_memory
+        remaining = [concurrent_writes]
+
+        def advance_then_interfere(instance, *args, **kwargs):
+            original(instance, *args, **kwargs)
+            if remaining[0]:
+                remaining[0] -= 1
+                WorkflowInstance.objects.filter(pk=instance.pk).update(lock_version=F('lock_version') + 1)
+
+        workflow_engine._advance_in_memory = advance_then_interfere
+        self.addCleanup(delattr, workflow_engine, '_advance_in_memory')
+        return workflow_engine.complete_task(task.id, self.user, 'approved')
+
+    def test_join_through_optimistic_completions(self):
+        instance = self.start(fan_out_definition(5), name='fan-out')
+        for i in range(1, 6):
+            workflow_engine.complete_task(self.pending_task(instance, f'head_{i}').id, self.user, 'approved')
+        instance.refresh_from_db()
+        self.assertEqual(instance.current_node_ids, ['final'])
+        self.assertEqual(self.counter('workflow_optimistic_conflicts_total'), 0)
+        self.assertEqual(WorkflowTask.objects.filter(instance=instance, node_id='final').count(), 1)
+        self.assertEqual(rebuild_instance_state(instance.pk).differences(instance), {})
+
+    def test_conflict_rolls_back_and_retries(self):
+        instance = self.start(fan_out_definition(2), name='fan-out')
+        self.complete_with_concurrent_write(self.pending_task(instance, 'head_1'), concurrent_writes=2)
+        self.assertEqual(self.counter('workflow_optimistic_conflicts_total'), 2)
+        instance.refresh_from_db()
+        self.assertEqual((instance.current_node_ids, instance.join_counters), (['head_2'], {'join': 1}))
+        # 回滚的尝试没有留下历史或任务状态
+        self.assertEqual(WorkflowHistory.objects.filter(instance=instance, event_type=WorkflowHistory.EventType.TASK_COMPLETED).count(), 1)
+        self.assertEqual(self.counter('workflow_tasks_completed_total'), 1) # 回滚的尝试也不计入指标
+        self.assertEqual(rebuild_instance_state(instance.pk).differences(instance), {})
+
+    def test_falls_back_to_locking_after_retries(self):
+        instance = self.start(fan_out_definition(2), name='fan-out')
+        self.complete_with_concurrent_write(self.pending_task(instance, 'head_1'), concurrent_writes=100)
+        self.assertEqual(self.counter('workflow_optimistic_fallbacks_total'), 1)
+        self.assertEqual(self.counter('workflow_tasks_completed_total'), 1)
+        instance.refresh_from_db()
+        self.assertEqual(instance.join_counters, {'join': 1})
+        self.assertEqual(self.pending_task(instance, 'head_2').status, WorkflowTask.Status.PENDING)
+
+    def test_lock_version_bumped_by_locked_writers(self):
+        instance = self.start(fan_out_definition(2), name='fan-out')
+        version = WorkflowInstance.objects.get(pk=instance.pk).lock_version
+        with transaction.atomic(): # 嵌套在外层事务中时走加锁路径，save() 同样递增版本
+            workflow_engine.complete_task(self.pending_task(instance, 'head_1').id, self.user, 'approved')
+        self.assertEqual(WorkflowInstance.objects.get(pk=instance.pk).lock_version, version + 1)
+        self.assertEqual(self.counter('workflow_optimistic_fallbacks_total'), 0)
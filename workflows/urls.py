@@ -19,6 +19,9 @@ urlpatterns = [
 ]# --- API Router (用于 DRF ViewSets) ---
 router = DefaultRouter()
 router.register(r'definitions', views.WorkflowDefinitionViewSet, basename='workflowdefinition')
+router.register(r'instances', views.WorkflowInstanceViewSet, basename='workflowinstance')
+router.register(r'tasks', views.WorkflowTaskViewSet, basename='workflowtask')
+router.register(r'archived-instances', views.ArchivedWorkflowInstanceViewSet, basename='archivedworkflowinstance')
 # ... 在这里注册所有工作流相关的 API ViewSet ...
 
 # --- API URL Patterns (列表) ---
@@ -27,6 +30,9 @@ api_urlpatterns = [
     path('', include(router.urls)),
     # 单独定义的 API 端点
     path('designer/config/', views.WorkflowDesignerConfigView.as_view(), name='workflow-designer-config'),
+    # 引擎指标 (Prometheus 文本格式 / JSON)
+    path('metrics/', views.WorkflowMetricsView.as_view(), name='workflow-metrics'),
+    path('metrics/json/', views.WorkflowMetricsView.as_view(as_json=True), name='workflow-metrics-json'),
 ]
 
 # --- Page / SPA Entry URL Patterns (列表) ---
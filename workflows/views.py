@@ -1,25 +1,42 @@
 # workflows/views.py
+import hmac
+import uuid
+import json
+import time
+
 from rest_framework import viewsets, status, mixins
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import BasePermission # 添加更具体的权限
+from rest_framework.exceptions import ValidationError
 from django.contrib.contenttypes.models import ContentType
 from django.shortcuts import get_object_or_404
+from django.http import HttpResponse, StreamingHttpResponse
 from django.utils.translation import gettext as _
 from django.db.models import Q
+from django.db.models.fields.json import KeyTextTransform
 from django.contrib.auth import get_user_model
 from  django.shortcuts import render
 
-from .models import WorkflowDefinition, WorkflowInstance, WorkflowTask, WorkflowHistory
+from .models import ArchivedWorkflowInstance, WorkflowDefinition, WorkflowInstance, WorkflowTask, WorkflowHistory
 # 确保导入的模型常量有明确的来源
 from .models import WorkflowTask as TaskStatusModel
 from .models import WorkflowTask as AssigneeTypeModel
 from .serializers import (
     WorkflowDefinitionSerializer, WorkflowInstanceSerializer, WorkflowTaskSerializer,
-    WorkflowHistorySerializer, StartWorkflowSerializer, CompleteTaskSerializer
+    WorkflowHistorySerializer, StartWorkflowSerializer, StartBulkWorkflowSerializer, CompleteTaskSerializer,
+    SimulateDefinitionSerializer, ArchivedWorkflowInstanceSerializer,
+    TASK_PAYLOAD_SUMMARY_KEYS, payload_summary_annotation, requested_fields,
 )
 from .services import workflow_engine
+from .graph import DefinitionValidationError
 from .permissions import CanUseWorkflows
+from .roles import get_user_role_names
+from .pagination import ArchivedInstanceCursorPagination, HistoryCursorPagination
+from .archive import decode_document
+from .snapshots import events_after
+from .metrics import get_metrics, get_metrics_settings, queue_depths, render_prometheus
+from .simulation import simulate_definition
 
 # --- 权限类占位符 ---
 
@@ -37,33 +54,26 @@ class CanManageInstances(BasePermission):
 
 class CanCompleteTask(BasePermission):
     def has_object_permission(self, request, view, obj: WorkflowTask):
-        # TODO: 实现检查用户是否是任务的合法处理人
+        # 直接指派 / 角色 (缓存的角色集合) / assigned_users (EXISTS)，见 WorkflowEngineService.can_complete_task
         user = request.user
-        if not user or not user.is_authenticated:
-            return False
-        # 1. 直接分配给用户
-        if obj.assignee_type == AssigneeTypeModel.AssigneeType.USER and obj.assignee_identifier == str(user.id):
-            return True
-        # 2. 分配给用户所在的角色/组 (需要查询用户的角色)
-        if obj.assignee_type == AssigneeTypeModel.AssigneeType.ROLE:
-            user_roles = user.groups.values_list('name', flat=True) # 假设使用 Django groups
-            if obj.assignee_identifier in user_roles:
-                return True
-        # 3. 规则指定 (例如，申请人经理 - 需要更复杂的逻辑来解析规则并检查用户是否匹配)
-        if obj.assignee_type == AssigneeTypeModel.AssigneeType.RULE:
-            # 这里需要调用类似 _resolve_assignees 的逻辑来判断 user 是否是该规则的解析结果之一
-            # resolved_users = workflow_engine._resolve_assignees(obj.assignee_type, obj.assignee_identifier, obj.instance)
-            # if user in resolved_users:
-            #     return True
-            pass # 规则解析需要具体实现
-        # 4. 检查是否在 assigned_users M2M 字段中 (如果使用认领机制)
-        if user in obj.assigned_users.all():
+        if workflow_engine.can_complete_task(user, obj):
             return True
-
-        print(f"权限检查：用户 {user.id} 不能完成任务 {obj.id} (指派: {obj.assignee_type}:{obj.assignee_identifier})")
+        if user and user.is_authenticated:
+            print(f"权限检查：用户 {user.id} 不能完成任务 {obj.id} (指派: {obj.assignee_type}:{obj.assignee_identifier})")
         return False
 
 
+class CanReadMetrics(BasePermission):
+    """指标端点：携带 settings.WORKFLOW_METRICS['TOKEN'] 的抓取请求，或已登录的管理员"""
+    def has_permission(self, request, view):
+        token = get_metrics_settings()['TOKEN']
+        if token:
+            header = request.headers.get('Authorization', '')
+            if hmac.compare_digest(header.encode(), f'Bearer {token}'.encode()):
+                return True
+        return bool(request.user and request.user.is_staff)
+
+
 class WorkflowDefinitionViewSet(viewsets.ModelViewSet):
     """
     管理工作流定义的 API 端点。
@@ -72,6 +82,38 @@ class WorkflowDefinitionViewSet(viewsets.ModelViewSet):
     serializer_class = WorkflowDefinitionSerializer
     permission_classes = [CanUseWorkflows, CanDesignWorkflows] # TODO: 限制给设计者/管理员
 
+    @action(detail=True, methods=['post'])
+    def publish(self, request, pk=None):
+        """
+        校验并发布定义：生成编译形式并递增版本，运行时只使用编译形式。
+        校验失败或还有未结束的实例时返回 400 {"errors": [...]}。
+        """
+        definition = self.get_object()
+        try:
+            definition = workflow_engine.publish_definition(definition.pk)
+        except DefinitionValidationError as e:
+            return Response({"errors": e.errors}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(self.get_serializer(definition).data)
+
+    @action(detail=True, methods=['post'], serializer_class=SimulateDefinitionSerializer)
+    def simulate(self, request, pk=None):
+        """
+        在内存中模拟运行当前的定义草稿 (不创建实例)，返回节点访问次数、决策分支概率和各指派对象的任务量。
+        请求体见 SimulateDefinitionSerializer；定义没有开始节点时返回 400 {"errors": [...]}。
+        """
+        definition = self.get_object()
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        options = serializer.validated_data
+        try:
+            report = simulate_definition(
+                definition.definition_json, options['payloads'], options['instances'],
+                outcomes=options['outcomes'], job_results=options['job_results'], seed=options['seed'],
+            )
+        except DefinitionValidationError as e:
+            return Response({"errors": e.errors}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(report.as_dict())
+
     # TODO: 添加用于激活/停用特定版本的操作
 
 class WorkflowInstanceViewSet(mixins.ListModelMixin,
@@ -84,6 +126,14 @@ class WorkflowInstanceViewSet(mixins.ListModelMixin,
     serializer_class = WorkflowInstanceSerializer
     permission_classes = [CanUseWorkflows] # TODO: 基于用户参与情况的权限
 
+    def get_queryset(self):
+        qs = super().get_queryset()
+        if self.action == 'list':
+            fields = requested_fields(self.request)
+            if fields is not None and 'payload' not in fields:
+                qs = qs.defer('payload') # ?fields= 未请求 payload 时不从数据库读取
+        return qs
+
     @action(detail=False, methods=['post'], serializer_class=StartWorkflowSerializer)
     def start_workflow(self, request):
         """
@@ -129,20 +179,115 @@ class WorkflowInstanceViewSet(mixins.ListModelMixin,
             # start_instance 记录了错误，返回通用失败信息或特定错误
             return Response({"error": _("启动工作流实例失败。")}, status=status.HTTP_400_BAD_REQUEST)
 
+    @action(detail=False, methods=['post'], serializer_class=StartBulkWorkflowSerializer)
+    def start_bulk(self, request):
+        """
+        用同一个定义批量启动实例 (例如年度考核为每位员工启动一个流程)。
+        响应为 NDJSON 流：每个实例一行 {"index", "id", "status"} 或 {"index", "error"}，
+        最后一行为 {"summary": {"started", "failed", "seconds", "instances_per_second"}}。
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        try:
+            results = workflow_engine.start_instances_bulk(
+                definition_id=data['definition_id'],
+                payloads=data['payloads'],
+                user=request.user if request.user.is_authenticated else None,
+                chunk_size=data.get('chunk_size'),
+            )
+        except WorkflowDefinition.DoesNotExist:
+            return Response({"error": _("无法找到活动的工作流定义")}, status=status.HTTP_400_BAD_REQUEST)
+
+        def stream():
+            started = failed = 0
+            begin = time.perf_counter()
+            for result in results:
+                if 'error' in result:
+                    failed += 1
+                else:
+                    started += 1
+                yield json.dumps(result, ensure_ascii=False, default=str) + '\n'
+            seconds = time.perf_counter() - begin
+            summary = {
+                'started': started,
+                'failed': failed,
+                'seconds': round(seconds, 3),
+                'instances_per_second': round(started / seconds, 1) if seconds > 0 else None,
+            }
+            yield json.dumps({'summary': summary}, ensure_ascii=False) + '\n'
+
+        return StreamingHttpResponse(stream(), content_type='application/x-ndjson')
+
+    # 流式输出历史时每次从数据库游标取回的行数
+    HISTORY_STREAM_CHUNK_SIZE = 500
+
     @action(detail=True, methods=['get'])
     def history(self, request, pk=None):
         """
-        检索特定工作流实例的历史记录。
+        检索特定工作流实例的历史记录，按 (timestamp, id) 排序。
+        默认游标分页：?cursor=...&page_size=...，响应 {"next", "results"}。
+        ?stream=ndjson 时以 NDJSON 流返回 (从 cursor 位置开始) 的全部记录，每行一条，
+        服务端按块读取、逐行输出，内存占用与历史长度无关。
         """
         instance = self.get_object()
         # TODO: 添加权限检查，用户是否可以查看此实例的历史
-        history = WorkflowHistory.objects.filter(instance=instance).select_related('user', 'task').order_by('timestamp')
-        serializer = WorkflowHistorySerializer(history, many=True)
-        return Response(serializer.data)
+        paginator = HistoryCursorPagination()
+        if request.query_params.get('stream') == 'ndjson':
+            position = paginator.get_position(request)
+
+            def stream():
+                # 按 (timestamp, id) 逐块读取，而不是单个查询的 .iterator()：
+                # MySQL 驱动会把整个结果集缓存在客户端，键集分块才能保证内存与历史长度无关
+                last_event = position
+                while True:
+                    chunk = list(events_after(instance.pk, last_event).select_related('user')[:self.HISTORY_STREAM_CHUNK_SIZE])
+                    for event in chunk:
+                        yield json.dumps(WorkflowHistorySerializer(event).data, ensure_ascii=False, default=str) + '\n'
+                    if len(chunk) < self.HISTORY_STREAM_CHUNK_SIZE:
+                        return
+                    last_event = (chunk[-1].timestamp, chunk[-1].id)
+
+            return StreamingHttpResponse(stream(), content_type='application/x-ndjson')
+
+        page = paginator.paginate_instance_history(instance.pk, request)
+        serializer = WorkflowHistorySerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
 
     # TODO: 添加取消、暂停、恢复实例的操作 (带权限检查)
 
 
+class ArchivedWorkflowInstanceViewSet(mixins.ListModelMixin,
+                                      mixins.RetrieveModelMixin,
+                                      viewsets.GenericViewSet):
+    """
+    已归档实例的只读 API (归档见 workflows/archive.py)。
+    列表按开始时间倒序游标分页，不读取归档文档；?object_id= 查找某个触发对象的归档实例。
+    详情在列表字段之外返回解压后的 instance / tasks / history。
+    """
+    queryset = ArchivedWorkflowInstance.objects.all()
+    serializer_class = ArchivedWorkflowInstanceSerializer
+    permission_classes = [CanUseWorkflows] # TODO: 基于用户参与情况的权限
+    pagination_class = ArchivedInstanceCursorPagination
+
+    def get_queryset(self):
+        qs = super().get_queryset()
+        if self.action == 'list':
+            qs = qs.defer('document')
+            object_id = self.request.query_params.get('object_id')
+            if object_id:
+                try:
+                    qs = qs.filter(object_id=uuid.UUID(object_id))
+                except ValueError:
+                    raise ValidationError({'object_id': _("无效的 UUID")})
+        return qs
+
+    def retrieve(self, request, *args, **kwargs):
+        archived = self.get_object()
+        return Response({**self.get_serializer(archived).data, **decode_document(archived.document)})
+
+
 class WorkflowTaskViewSet(mixins.ListModelMixin,
                           mixins.RetrieveModelMixin,
                           viewsets.GenericViewSet):
@@ -162,51 +307,49 @@ class WorkflowTaskViewSet(mixins.ListModelMixin,
         if not user.is_authenticated:
             return WorkflowTask.objects.none()
 
-        # 实现基于用户 ID、用户角色/组匹配 task.assignee_identifier 和 task.assignee_type 的过滤。
-        # 这比较复杂。
-        # 简单的示例：直接分配给用户的任务 或 状态为 PENDING 且分配给用户所在角色的任务
-        User = get_user_model()
-        user_roles = user.groups.values_list('name', flat=True) # 示例：使用 Django groups 作为角色
-
-        # Q 对象用于组合查询条件
-        # 1. 直接分配给用户的任务
-        user_q = Q(assignee_type=AssigneeTypeModel.AssigneeType.USER, assignee_identifier=str(user.id))
-        # 2. 分配给用户所属角色且状态为待处理的任务 (已完成的不需要显示在待办列表)
-        #    注意：如果角色任务需要认领，逻辑会更复杂
-        role_q = Q(assignee_type=AssigneeTypeModel.AssigneeType.ROLE, assignee_identifier__in=list(user_roles), status=TaskStatusModel.Status.PENDING)
-        # 3. 如果使用了 assigned_users M2M 字段（例如认领后），也需要包含
-        assigned_q = Q(assigned_users=user)
-
-        # TODO: 规则指派 (RULE) 的过滤需要调用服务来解析规则并判断用户是否匹配，这在查询时比较困难
-        # 可能需要在服务层实现一个辅助函数来获取用户相关的任务 ID 列表
-
-        # 组合查询
-        # final_q = user_q | role_q | assigned_q
-        # distinct() 避免重复
-        # return super().get_queryset().filter(final_q).distinct()
-
-        # --- 临时：返回所有任务用于演示 ---
+        user_roles = get_user_role_names(user) # 使用 Django groups 作为角色 (带缓存)
+
+        # --- 临时：未指定 assignee 时返回所有任务用于演示 ---
         print("警告：WorkflowTaskViewSet 查询集过滤尚未完全针对用户权限实现。")
         qs = super().get_queryset()
 
         # 实现 ?status=pending 过滤
+        status_value = None
         status_filter = self.request.query_params.get('status')
         if status_filter:
             # 最好验证 status_filter 是否是合法的状态值
             valid_statuses = [choice[0] for choice in TaskStatusModel.Status.choices]
             if status_filter.upper() in valid_statuses:
-                 qs = qs.filter(status=status_filter.upper())
+                 status_value = status_filter.upper()
             else:
                  # 或者返回空集，或者忽略无效过滤器
                  pass
 
-        # 实现 ?assignee=me 过滤 (需要完善)
+        # 实现 ?assignee=me 过滤
         assignee_filter = self.request.query_params.get('assignee')
         if assignee_filter == 'me':
-             # 用上面构建的 final_q 替换这里的简单过滤
-             print("警告：按 'assignee=me' 过滤未完全实现。")
-             qs = qs.filter(Q(assignee_identifier=str(user.id)) | Q(assigned_users=user) | Q(assignee_type=AssigneeTypeModel.AssigneeType.ROLE, assignee_identifier__in=list(user_roles), status=TaskStatusModel.Status.PENDING)).distinct()
+             # 通过 WorkflowTaskCandidate 收件箱索引查找：直接指派给用户、已分配给用户 (assigned_users)
+             # 以及用户所属角色的待处理任务，都是 (principal, status, created_at) 索引上的范围扫描，
+             # 取代原先在任务表上 OR 三个条件 + JOIN assigned_users + distinct() 的查询
+             qs = qs.filter(id__in=workflow_engine.inbox_task_ids(user, list(user_roles), status=status_value))
+        elif status_value:
+             qs = qs.filter(status=status_value)
+
+        if self.action in ('list', 'retrieve'):
+            qs = self._project_instance_payload(qs)
+        return qs
 
+    def _project_instance_payload(self, qs):
+        """
+        不读取整个实例 payload：摘要需要的键在数据库中用 JSON 键提取注解取出；
+        ?fields= 未请求摘要时连这些键也不提取。
+        """
+        qs = qs.defer('instance__payload')
+        fields = requested_fields(self.request)
+        if fields is None or 'instance_payload_summary' in fields:
+            qs = qs.annotate(**{
+                payload_summary_annotation(key): KeyTextTransform(key, 'instance__payload') for _label, key in TASK_PAYLOAD_SUMMARY_KEYS
+            })
         return qs
 
 
@@ -247,6 +390,24 @@ class WorkflowTaskViewSet(mixins.ListModelMixin,
 # --- 设计器配置 API (简单示例) ---
 from rest_framework.views import APIView
 
+class WorkflowMetricsView(APIView):
+    """
+    引擎指标。?format=json (或 /metrics/json/) 返回 JSON，默认返回 Prometheus 文本格式。
+    未启用 (settings.WORKFLOW_METRICS['ENABLED'] 为 False) 时返回 404。
+    """
+    permission_classes = [CanReadMetrics]
+    as_json = False
+
+    def get(self, request, format=None):
+        metrics = get_metrics()
+        if not metrics.enabled:
+            return Response({"error": _("未启用工作流指标")}, status=status.HTTP_404_NOT_FOUND)
+        snapshot, depths = metrics.snapshot(), queue_depths()
+        if self.as_json or request.query_params.get('format') == 'json':
+            return Response({**snapshot, 'queue_depths': depths})
+        return HttpResponse(render_prometheus(snapshot, depths), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 class WorkflowDesignerConfigView(APIView):
     """
     提供工作流设计器前端所需的配置信息。
@@ -268,8 +429,11 @@ class WorkflowDesignerConfigView(APIView):
                         "assigneeType": {"label": _("指派类型"), "type": "select", "options": [("USER", _("特定用户")), ("ROLE", _("角色/组")), ("RULE", _("规则指定"))], "defaultValue": "ROLE"},
                         "assigneeIdentifier": {"label": _("指派标识 (用户ID/角色名/规则)"), "type": "text"},
                         "taskName": {"label": _("任务名称模板"), "type": "text", "helpText": _("例如：审批 {payload.leave_type} 申请")},
-                        # "timeoutDuration": {"label": _("超时 (秒, 0=无)"), "type": "number", "defaultValue": 0},
-                        # "timeoutAction": {"label": _("超时动作"), "type": "select", "options": [("NOTIFY", _("提醒")), ("AUTO_REJECT", _("自动驳回")), ("AUTO_APPROVE", _("自动批准")), ("ESCALATE", _("上报"))]},
+                        "timeoutDuration": {"label": _("超时 (秒, 0=无)"), "type": "number", "defaultValue": 0, "helpText": _("也可写作 30m / 4h / 2d")},
+                        "timeoutAction": {"label": _("超时动作"), "type": "select", "options": [("NOTIFY", _("提醒")), ("AUTO_REJECT", _("自动驳回")), ("AUTO_APPROVE", _("自动批准")), ("ESCALATE", _("上报"))], "defaultValue": "NOTIFY"},
+                        "escalateToType": {"label": _("上报指派类型"), "type": "select", "options": [("USER", _("特定用户")), ("ROLE", _("角色/组")), ("RULE", _("规则指定"))], "defaultValue": "ROLE", "helpText": _("超时动作为上报时使用")},
+                        "escalateToIdentifier": {"label": _("上报指派标识"), "type": "text"},
+                        "timeoutMessageTemplate": {"label": _("超时提醒模板"), "type": "textarea", "helpText": _("可使用 {payload.field_name} 变量")},
                     }
                 },
                 {
@@ -278,6 +442,18 @@ class WorkflowDesignerConfigView(APIView):
                     "icon": "gateway", # 使用更合适的图标名
                     "configSchema": {} # 条件通常在连接线上配置
                 },
+                {
+                    "type": "parallelSplitNode",
+                    "label": _("并行拆分"),
+                    "icon": "fork",
+                    "configSchema": {} # 同时进入所有出边
+                },
+                {
+                    "type": "parallelJoinNode",
+                    "label": _("并行汇聚"),
+                    "icon": "merge",
+                    "configSchema": {} # 所有入边的分支都到达后才继续，只触发一次
+                },
                 {
                     "type": "notificationNode",
                     "label": _("通知节点"),
@@ -288,7 +464,17 @@ class WorkflowDesignerConfigView(APIView):
                         "messageTemplate": {"label": _("消息模板"), "type": "textarea", "helpText": _("可使用 {payload.field_name} 变量")},
                     }
                  },
-                # 添加其他节点类型: ServiceTask, FormTask 等
+                {
+                    "type": "serviceTaskNode",
+                    "label": _("服务任务"),
+                    "icon": "api",
+                    "configSchema": {
+                        "serviceName": {"label": _("服务处理函数"), "type": "text", "helpText": _("已在 WORKFLOW_SERVICE_HANDLERS 中登记的名称")},
+                        "timeoutSeconds": {"label": _("单次超时 (秒)"), "type": "number", "defaultValue": 30},
+                        "maxAttempts": {"label": _("最大尝试次数"), "type": "number", "defaultValue": 5},
+                    }
+                },
+                # 添加其他节点类型: FormTask 等
             ],
             "edgeConfigSchema": { # 连接线的配置 (特别是从决策节点出来的线)
                 "condition": {"label": _("流转条件"), "type": "textarea", "helpText": _("例如：payload.amount > 1000 或 payload.status == 'urgent' (为空则无条件)")},